@@ -0,0 +1,76 @@
+"""Micro-benchmark: logging cost on the request path
+
+Times the structlog calls made for a request (one per request plus two per
+stream) as seen by the event loop thread, for the console renderer written
+synchronously and for the JSON pipeline (queued, rendered by a background
+thread), with and without sampling. The time the listener thread then
+needs to drain the queue is reported separately.
+
+Output goes to /dev/null, so the numbers are the formatting and handoff
+costs; a real terminal or a blocked pipe only makes the synchronous console
+mode slower. For the effect under load, compare load test runs, e.g.
+    python benchmarks/load_test.py --spawn --env LOG_FORMAT=json
+
+Usage (from backend/):
+    python benchmarks/bench_logging.py [--events 20000]
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import structlog  # noqa: E402
+
+from core.logger import flush_logging, setup_logging  # noqa: E402
+
+# Events logged by the OpenAI route on a streamed request
+EVENTS = [
+    ("Starting OpenAI stream", {"model": "mistral-large", "cache": "MISS"}),
+    (
+        "OpenAI stream completed",
+        {"chunks": 212, "prompt_tokens": 1034, "completion_tokens": 212, "total_tokens": 1246},
+    ),
+]
+
+
+def measure(name: str, events: int, **setup):
+    with open(os.devnull, "w") as devnull:
+        setup_logging("INFO", stream=devnull, **setup)
+        logger = structlog.get_logger("bench")
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        with structlog.contextvars.bound_contextvars(request_id="0123456789abcdef"):
+            for i in range(events):
+                event, fields = EVENTS[i % len(EVENTS)]
+                logger.info(event, **fields)
+        cpu = time.thread_time() - start_cpu
+        wall = time.perf_counter() - start_wall
+        flush_logging()
+        drain = time.perf_counter() - start_wall - wall
+    print(
+        f"{name:<28} us/event caller wall={wall / events * 1e6:6.2f} "
+        f"cpu={cpu / events * 1e6:6.2f}   drain={drain * 1e3:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+
+    measure("console, synchronous", args.events, fmt="console", sample_rates={})
+    measure("json, queued", args.events, fmt="json", sample_rates={})
+    measure(
+        "json, queued, 10% sampled",
+        args.events,
+        fmt="json",
+        sample_rates={event: 0.1 for event, _ in EVENTS},
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Micro-benchmark: SSE framing cost per streamed token
+
+Compares the original per-delta dict + json.dumps framing with the
+pre-rendered ChatChunkEncoder, with and without coalescing.
+
+Usage (from backend/):
+    python benchmarks/bench_sse.py [--tokens 20000]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from api.streaming import ChatChunkEncoder, coalesce_deltas  # noqa: E402
+
+MODEL = "mistral-large"
+# Typical Mistral deltas: short word pieces, some accented French text
+DELTAS = ["La", " souve", "raineté", " des", " données", ",", " c'est", " le", " contrôle", "."]
+
+
+def legacy_frames(deltas: list[str]) -> list[bytes]:
+    frames = []
+    for content in deltas:
+        chunk = {
+            "id": f"chatcmpl-{int(time.time())}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": MODEL,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": content},
+                    "finish_reason": None,
+                }
+            ],
+        }
+        frames.append(f"data: {json.dumps(chunk)}\n\n".encode())
+    return frames
+
+
+def encoder_frames(deltas: list[str]) -> list[bytes]:
+    encoder = ChatChunkEncoder(MODEL)
+    return [encoder.delta(content) for content in deltas]
+
+
+async def coalesced_frames(deltas: list[str], window: float, max_chars: int) -> list[bytes]:
+    async def source():
+        for delta in deltas:
+            yield delta
+
+    encoder = ChatChunkEncoder(MODEL)
+    merged = coalesce_deltas(source(), window, max_chars)
+    return [encoder.delta(content) async for content in merged]
+
+
+def measure(name: str, frames_fn, deltas: list[str]):
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    frames = frames_fn(deltas)
+    cpu = time.process_time() - start_cpu
+    wall = time.perf_counter() - start_wall
+    total_bytes = sum(len(frame) for frame in frames)
+    print(
+        f"{name:<24} events={len(frames):>7} bytes/token={total_bytes / len(deltas):7.1f} "
+        f"ns/token wall={wall / len(deltas) * 1e9:8.0f} cpu={cpu / len(deltas) * 1e9:8.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=20000)
+    args = parser.parse_args()
+
+    deltas = (DELTAS * (args.tokens // len(DELTAS) + 1))[: args.tokens]
+    measure("json.dumps per delta", legacy_frames, deltas)
+    measure("pre-rendered encoder", encoder_frames, deltas)
+    measure(
+        "encoder + 64 char merge",
+        lambda d: asyncio.run(coalesced_frames(d, 0, 64)),
+        deltas,
+    )
+    measure(
+        "encoder + 20 ms window",
+        lambda d: asyncio.run(coalesced_frames(d, 0.02, 0)),
+        deltas,
+    )
+
+
+if __name__ == "__main__":
+    main()
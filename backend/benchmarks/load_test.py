@@ -0,0 +1,435 @@
+"""Load test: throughput and latency of /v1/chat/completions
+
+Drives the backend with a mix of streaming and non-streaming requests at a
+fixed concurrency and reports requests per second, time to first token,
+inter-token latency and total latency percentiles, backend CPU time per
+completion token and backend memory (RSS). Every prompt is unique, so
+caches and request coalescing do not flatter the numbers.
+
+With --spawn, a fake upstream (mock_upstream.py) and a backend pointed at
+it are started for the run; the upstream profile options (--ttft,
+--tokens-per-second, --jitter, --error-rate, ...) shape the fake upstream.
+Otherwise --url targets a running backend, and --backend-pid enables the
+CPU and memory figures.
+
+Results can be saved as a baseline JSON and later runs compared with it,
+e.g. before and after a change:
+
+Usage (from backend/):
+    python benchmarks/load_test.py --spawn --duration 30 --save baseline.json
+    python benchmarks/load_test.py --spawn --duration 30 --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+from mock_upstream import add_profile_arguments
+
+BACKEND = Path(__file__).parent.parent
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+# Compared metrics: dotted path in the results -> whether higher is better
+COMPARED = {
+    "rps": True,
+    "tokens_per_second": True,
+    "latency_s.p50": False,
+    "latency_s.p99": False,
+    "ttft_s.p50": False,
+    "ttft_s.p99": False,
+    "itl_s.p50": False,
+    "itl_s.p99": False,
+    "cpu_ms_per_token": False,
+    "rss_mb.peak": False,
+}
+
+
+@dataclass
+class Sample:
+    """Timings of one request"""
+
+    stream: bool
+    ok: bool = False
+    latency: float = 0.0
+    ttft: float | None = None
+    itl: list[float] = field(default_factory=list)
+    completion_tokens: int = 0
+
+
+async def chat(client: httpx.AsyncClient, args: argparse.Namespace, index: int, stream: bool):
+    """Send one request and time it"""
+    sample = Sample(stream)
+    payload = {
+        "model": args.model,
+        "messages": [
+            {"role": "user", "content": f"Request {index}: {args.prompt}"},
+        ],
+        "max_tokens": args.max_tokens,
+        "temperature": 0.7,
+        "stream": stream,
+    }
+    if stream:
+        payload["stream_options"] = {"include_usage": True}
+    started = time.perf_counter()
+    try:
+        if not stream:
+            response = await client.post("/v1/chat/completions", json=payload)
+            sample.ok = response.status_code == 200
+            if sample.ok:
+                sample.completion_tokens = response.json()["usage"]["completion_tokens"]
+        else:
+            async with client.stream("POST", "/v1/chat/completions", json=payload) as response:
+                sample.ok = response.status_code == 200
+                last = None
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        continue
+                    event = json.loads(line[6:])
+                    if "error" in event:
+                        sample.ok = False
+                        continue
+                    if event.get("usage"):
+                        sample.completion_tokens = event["usage"]["completion_tokens"]
+                    if any(choice["delta"].get("content") for choice in event["choices"]):
+                        now = time.perf_counter()
+                        if last is None:
+                            sample.ttft = now - started
+                        else:
+                            sample.itl.append(now - last)
+                        last = now
+    except httpx.HTTPError:
+        sample.ok = False
+    sample.latency = time.perf_counter() - started
+    return sample
+
+
+async def run_load(args: argparse.Namespace, monitor: "ProcessMonitor | None") -> dict:
+    """Run the warmup, then the measured load, and summarize it"""
+    limits = httpx.Limits(
+        max_connections=args.concurrency, max_keepalive_connections=args.concurrency
+    )
+    timeout = httpx.Timeout(args.timeout)
+    rng = random.Random(args.seed)
+    counter = iter(range(1 << 62))
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+        await asyncio.gather(
+            *(chat(client, args, next(counter), i % 2 == 0) for i in range(args.warmup))
+        )
+
+        samples: list[Sample] = []
+        deadline = time.perf_counter() + args.duration
+        remaining = args.requests
+
+        async def worker():
+            nonlocal remaining
+            while time.perf_counter() < deadline:
+                if args.requests:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                stream = rng.random() < args.stream_ratio
+                samples.append(await chat(client, args, next(counter), stream))
+
+        if monitor is not None:
+            monitor.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        usage = await monitor.stop() if monitor is not None else None
+
+    return summarize(samples, elapsed, usage)
+
+
+def percentiles(values: list[float]) -> dict[str, float] | None:
+    if not values:
+        return None
+    values = sorted(values)
+    last = len(values) - 1
+    return {
+        name: round(values[min(last, int(q * len(values)))], 6)
+        for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+    }
+
+
+def summarize(samples: list[Sample], elapsed: float, usage: dict | None) -> dict:
+    ok = [sample for sample in samples if sample.ok]
+    streams = [sample for sample in ok if sample.stream]
+    tokens = sum(sample.completion_tokens for sample in ok)
+    results = {
+        "requests": len(samples),
+        "streams": sum(sample.stream for sample in samples),
+        "errors": len(samples) - len(ok),
+        "error_rate": round((len(samples) - len(ok)) / len(samples), 4) if samples else 0.0,
+        "duration_s": round(elapsed, 3),
+        "rps": round(len(ok) / elapsed, 2),
+        "completion_tokens": tokens,
+        "tokens_per_second": round(tokens / elapsed, 1),
+        "latency_s": percentiles([sample.latency for sample in ok]),
+        "ttft_s": percentiles([sample.ttft for sample in streams if sample.ttft is not None]),
+        "itl_s": percentiles([gap for sample in streams for gap in sample.itl]),
+        "cpu_ms_per_token": None,
+        "rss_mb": None,
+    }
+    if usage is not None:
+        if tokens:
+            results["cpu_ms_per_token"] = round(usage["cpu_s"] * 1000 / tokens, 4)
+        results["rss_mb"] = usage["rss_mb"]
+    return results
+
+
+class ProcessMonitor:
+    """CPU time and resident memory of a process and its children, from /proc"""
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self._cpu_start = 0.0
+        self._task: asyncio.Task | None = None
+
+    def pids(self) -> list[int]:
+        pids, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            try:
+                children = Path(f"/proc/{pid}/task/{pid}/children").read_text().split()
+            except OSError:
+                continue
+            pending.extend(int(child) for child in children)
+        return pids
+
+    def cpu_seconds(self) -> float:
+        total = 0
+        for pid in self.pids():
+            try:
+                fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            total += int(fields[11]) + int(fields[12])  # utime + stime
+        return total / CLOCK_TICKS
+
+    def rss_mb(self) -> float:
+        total = 0
+        for pid in self.pids():
+            try:
+                status = Path(f"/proc/{pid}/status").read_text()
+            except OSError:
+                continue
+            for line in status.splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1])  # kB
+        return total / 1024
+
+    async def _sample(self):
+        while True:
+            self.peak = max(self.peak, self.rss_mb())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._cpu_start = self.cpu_seconds()
+        self._task = asyncio.create_task(self._sample())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        end = self.rss_mb()
+        return {
+            "cpu_s": self.cpu_seconds() - self._cpu_start,
+            "rss_mb": {"peak": round(max(self.peak, end), 1), "end": round(end, 1)},
+        }
+
+
+def lookup(results: dict, path: str) -> float | None:
+    value = results
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Metrics worse than the baseline by more than `tolerance` (relative)"""
+    regressions = []
+    for path, higher_is_better in COMPARED.items():
+        current, previous = lookup(results, path), lookup(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{path}: {previous} -> {current} ({change:+.1%})")
+    return regressions
+
+
+def print_report(results: dict, baseline: dict | None = None):
+    print(
+        f"requests={results['requests']} streams={results['streams']} "
+        f"errors={results['errors']} ({results['error_rate']:.2%}) "
+        f"duration={results['duration_s']}s"
+    )
+    for path in COMPARED:
+        current = lookup(results, path)
+        line = f"  {path:<20} {current if current is not None else '-':>12}"
+        previous = lookup(baseline, path) if baseline is not None else None
+        if current is not None and previous:
+            line += f"   baseline {previous:>12}  ({(current - previous) / previous:+.1%})"
+        print(line)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+@contextmanager
+def spawn(args: argparse.Namespace, profile_args: list[str]):
+    """Start the fake upstream and a backend using it; yield the backend URL and pid"""
+    upstream_port, backend_port = free_port(), free_port()
+    upstream = subprocess.Popen(
+        [sys.executable, str(Path(__file__).parent / "mock_upstream.py")]
+        + ["--port", str(upstream_port), *profile_args]
+    )
+    env = {
+        **os.environ,
+        "LLM_PROVIDER": "mistral",
+        "MISTRAL_API_KEY": "bench",
+        "MISTRAL_API_URL": f"http://127.0.0.1:{upstream_port}/v1",
+        "HOST": "127.0.0.1",
+        "PORT": str(backend_port),
+        "WEB_CONCURRENCY": str(args.workers),
+        # Measure the serving path, not the caches
+        "RESPONSE_CACHE_ENABLED": "false",
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "SINGLEFLIGHT_ENABLED": "false",
+        **dict(setting.split("=", 1) for setting in args.env),
+    }
+    backend = subprocess.Popen(
+        [sys.executable, str(BACKEND / "run.py")],
+        env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    try:
+        wait_until_up(f"http://127.0.0.1:{upstream_port}/stats")
+        wait_until_up(f"http://127.0.0.1:{backend_port}/health")
+        yield f"http://127.0.0.1:{backend_port}", backend.pid
+    finally:
+        for process in (backend, upstream):
+            process.terminate()
+        for process in (backend, upstream):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BACKEND,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000", help="Backend to load")
+    parser.add_argument("--backend-pid", type=int, help="Backend process, for CPU and memory")
+    parser.add_argument("--spawn", action="store_true", help="Start a fake upstream and backend")
+    parser.add_argument("--workers", type=int, default=1, help="Backend workers with --spawn")
+    parser.add_argument(
+        "--env", action="append", default=[], help="Extra backend setting with --spawn (K=V)"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of measured load")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after N requests")
+    parser.add_argument("--warmup", type=int, default=4, help="Unmeasured requests first")
+    parser.add_argument("--stream-ratio", type=float, default=0.8, help="Share of streams")
+    parser.add_argument("--model", default="mistral-large")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--prompt", default="Explain data sovereignty in one paragraph.")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--save", type=Path, help="Write the results as a baseline JSON")
+    parser.add_argument("--compare", type=Path, help="Baseline JSON to compare with")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Allowed relative regression (0.1 = 10%%)"
+    )
+    parser.add_argument("--verbose", action="store_true", help="Show backend output")
+    profile = parser.add_argument_group("fake upstream (--spawn)")
+    add_profile_arguments(profile)
+    args = parser.parse_args()
+
+    profile_args = []
+    for action in profile._group_actions:
+        value = getattr(args, action.dest)
+        if value is not None:
+            profile_args += [action.option_strings[0], str(value)]
+
+    def measure(pid: int | None) -> dict:
+        monitor = ProcessMonitor(pid) if pid and Path("/proc").is_dir() else None
+        return asyncio.run(run_load(args, monitor))
+
+    if args.spawn:
+        with spawn(args, profile_args) as (args.url, pid):
+            results = measure(pid)
+    else:
+        results = measure(args.backend_pid)
+
+    baseline = json.loads(args.compare.read_text())["results"] if args.compare else None
+    print_report(results, baseline)
+
+    if args.save:
+        settings = {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("save", "compare", "url", "backend_pid", "verbose")
+        }
+        document = {
+            "commit": git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "settings": {key: str(value) for key, value in settings.items()},
+            "results": results,
+        }
+        args.save.write_text(json.dumps(document, indent=2) + "\n")
+        print(f"Saved {args.save}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Fake Mistral / OpenAI-compatible upstream for load tests
+
+Serves POST /v1/chat/completions, streaming or not, with a configurable
+time to first token, generation speed, jitter and error rate, so that the
+backend can be load-tested without an API key, cost or rate limits.
+
+Point the backend at it with:
+    LLM_PROVIDER=mistral MISTRAL_API_KEY=bench MISTRAL_API_URL=http://127.0.0.1:8100/v1
+or, for the OpenAI-compatible provider:
+    LLM_PROVIDER=openai OPENAI_COMPAT_BASE_URL=http://127.0.0.1:8100/v1
+
+Usage (from backend/):
+    python benchmarks/mock_upstream.py [--port 8100] [--ttft 0.3] [--tokens-per-second 50]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import asdict, dataclass
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# Short word pieces, one per streamed token
+WORDS = [" La", " souve", "raineté", " des", " données", ",", " c'est", " le", " contrôle", "."]
+
+
+@dataclass
+class Profile:
+    """Latency and failure behaviour of the fake upstream"""
+
+    ttft: float = 0.3  # Seconds before the first token
+    tokens_per_second: float = 50.0  # Generation speed after the first token
+    jitter: float = 0.2  # Relative spread of every delay (0.2 = +/-20%)
+    error_rate: float = 0.0  # Fraction of requests answered with error_status
+    error_status: int = 503
+    completion_tokens: int = 200  # Tokens per answer, capped by the request's max_tokens
+    seed: int | None = None
+
+    def __post_init__(self):
+        self.random = random.Random(self.seed)
+
+    def delay(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+
+def prompt_tokens(messages: list[dict]) -> int:
+    """Rough prompt size: 4 characters per token plus the chat template"""
+    return sum(len(str(message.get("content", ""))) // 4 + 4 for message in messages)
+
+
+def create_app(profile: Profile) -> Starlette:
+    stats = {"requests": 0, "streams": 0, "errors": 0, "tokens": 0}
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if profile.random.random() < profile.error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                {"object": "error", "message": "Injected upstream error", "type": "mock_error"},
+                status_code=profile.error_status,
+            )
+
+        model = body.get("model", "mock")
+        completion_id = f"cmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        count = min(profile.completion_tokens, body.get("max_tokens") or profile.completion_tokens)
+        usage = {
+            "prompt_tokens": prompt_tokens(body.get("messages", [])),
+            "completion_tokens": count,
+            "total_tokens": prompt_tokens(body.get("messages", [])) + count,
+        }
+        tokens = [WORDS[i % len(WORDS)] for i in range(count)]
+        stats["tokens"] += count
+
+        if not body.get("stream"):
+            await asyncio.sleep(profile.delay(profile.ttft + count / profile.tokens_per_second))
+            return JSONResponse(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "".join(tokens)},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            )
+
+        stats["streams"] += 1
+
+        def chunk(delta: dict, finish_reason: str | None = None, **extra) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            return f"data: {json.dumps(payload)}\n\n".encode()
+
+        async def events():
+            await asyncio.sleep(profile.delay(profile.ttft))
+            for index, token in enumerate(tokens):
+                if index:
+                    await asyncio.sleep(profile.delay(1 / profile.tokens_per_second))
+                delta = {"content": token}
+                if not index:
+                    delta["role"] = "assistant"
+                yield chunk(delta)
+            yield chunk({"content": ""}, "stop", usage=usage)
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def models(request: Request):
+        return JSONResponse(
+            {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "bench"}]}
+        )
+
+    async def stats_endpoint(request: Request):
+        return JSONResponse({**stats, "profile": asdict(profile)})
+
+    return Starlette(
+        routes=[
+            Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+            Route("/v1/models", models),
+            Route("/stats", stats_endpoint),
+        ]
+    )
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """Command line options of a Profile, shared with the load generator"""
+    defaults = Profile()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--jitter", type=float, default=defaults.jitter)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def profile_from_arguments(args: argparse.Namespace) -> Profile:
+    return Profile(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        completion_tokens=args.completion_tokens,
+        seed=args.seed,
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(profile_from_arguments(args)),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,61 @@
-"""Application runner script"""
+"""Application runner script
 
-import sys
+Starts uvicorn with WEB_CONCURRENCY worker processes (default: one per usable CPU).
+With more than one worker, state that must be common to all of them is
+placed in SHARED_STATE_DIR (default: a fresh temporary directory) unless
+configured explicitly: metrics snapshots, rate budgets, the response cache
+disk tier, batch checkpoints, the job queue and stored conversations.
+
+Workers are spawned, not forked, and every connection, thread and file
+handle is opened in the application lifespan, i.e. inside each worker.
+"""
+
+import os
+import tempfile
 from pathlib import Path
 
-# Add src to path
-sys.path.insert(0, str(Path(__file__).parent / "src"))
+SRC = Path(__file__).parent / "src"
+
+# Environment variable -> file or directory in SHARED_STATE_DIR
+SHARED_STATE = {
+    "METRICS_MULTIPROC_DIR": "metrics",
+    "RATE_LIMIT_DB_PATH": "ratelimits.db",
+    "RESPONSE_CACHE_DB_PATH": "responses.db",
+    "BATCH_DB_PATH": "batches.db",
+    "JOBS_DB_PATH": "jobs.db",
+    "CONVERSATIONS_DB_PATH": "conversations.db",
+}
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on, e.g. a container's cpuset, not the host's"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def configure_workers(environ: dict = os.environ) -> int:
+    """Resolve the worker count and point shared state at a common directory"""
+    workers = int(environ.get("WEB_CONCURRENCY") or 0) or available_cpus()
+    environ["WEB_CONCURRENCY"] = str(workers)  # Inherited by the workers
+    if workers > 1:
+        shared_dir = environ.get("SHARED_STATE_DIR") or tempfile.mkdtemp(prefix="kairn-")
+        os.makedirs(shared_dir, exist_ok=True)
+        environ["SHARED_STATE_DIR"] = shared_dir
+        for name, filename in SHARED_STATE.items():
+            if not environ.get(name):
+                environ[name] = os.path.join(shared_dir, filename)
+    return workers
+
 
 if __name__ == "__main__":
     import uvicorn
 
-    from src.main import app
-
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    workers = configure_workers()
+    uvicorn.run(
+        "main:app",
+        app_dir=str(SRC),
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+    )
@@ -0,0 +1,134 @@
+"""Batch completions: many chat completions in one JSONL request"""
+
+import json
+from collections.abc import AsyncGenerator
+from functools import partial
+
+import structlog
+from fastapi import APIRouter, Depends, Header, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from api.dependencies import (
+    get_admission,
+    get_batch_store,
+    get_llm_service,
+    get_metrics,
+    get_token_estimator,
+)
+from api.openai_routes import chat_completion_body
+from config import BATCH_CONCURRENCY, BATCH_PRIORITY, MODEL_MAP
+from core.metrics import Metrics
+from services.admission import AdmissionController, run_admitted
+from services.batch import BatchStore, batch_id, parse_batch, result_line
+from services.llm_service import Completion, LLMService
+from services.tokens import TokenEstimator
+
+logger = structlog.get_logger(__name__)
+
+router = APIRouter(tags=["Batches"])
+
+# Endpoint label of the metrics recorded here
+ENDPOINT = "batches"
+
+
+@router.post("/v1/batches")
+async def create_batch(
+    request: Request,
+    batch: str | None = Query(default=None, alias="batch_id"),
+    service: LLMService = Depends(get_llm_service),
+    store: BatchStore = Depends(get_batch_store),
+    estimator: TokenEstimator = Depends(get_token_estimator),
+    metrics: Metrics = Depends(get_metrics),
+    admission: AdmissionController | None = Depends(get_admission),
+    tenant: str | None = Header(default=None, alias="X-Tenant-Id"),
+):
+    """
+    Run a JSONL file of chat completion requests and stream the results.
+
+    The body uses the OpenAI batch input format, one request per line. Results
+    are streamed back as JSONL in the order they finish. Successful results
+    are checkpointed under the batch id (the `batch_id` query parameter, or a
+    hash of the body), so resubmitting an interrupted batch replays the
+    finished items and only runs the rest.
+    """
+    payload = await request.body()
+    try:
+        items = parse_batch(payload)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": {
+                    "message": str(e),
+                    "type": "invalid_request_error",
+                    "code": "invalid_batch",
+                }
+            },
+        )
+    # Another tenant's system prompt gives other answers: never share checkpoints
+    batch = batch or batch_id(payload if tenant is None else f"{tenant}\0".encode() + payload)
+    completed = store.completed(batch)
+    remaining = [item for item in items if item.custom_id not in completed]
+    logger.info(
+        "Batch started",
+        batch_id=batch,
+        items=len(items),
+        resumed=len(items) - len(remaining),
+    )
+
+    async def call(kwargs: dict) -> Completion:
+        """One completion, paced by admission control below interactive traffic"""
+        model = kwargs["model"]
+        metrics.requests.inc(ENDPOINT, model, "false")
+        completion = await run_admitted(
+            admission,
+            MODEL_MAP.get(model, model),
+            partial(service.generate_completion, **kwargs),
+            priority=BATCH_PRIORITY,
+            tokens=estimator.count_messages(kwargs["messages"])
+            + service.prompts.select(model, tenant).tokens
+            + kwargs["max_tokens"],
+        )
+        metrics.record_usage(
+            ENDPOINT,
+            model,
+            completion.usage.prompt_tokens,
+            completion.usage.completion_tokens,
+            completion.usage.cached_tokens,
+        )
+        return completion
+
+    requests = [
+        {
+            "messages": [
+                {"role": msg.role, "content": msg.content} for msg in item.request.messages
+            ],
+            "model": item.request.model,
+            "temperature": item.request.temperature,
+            "max_tokens": item.request.max_tokens,
+            "tenant": tenant,
+        }
+        for item in remaining
+    ]
+
+    async def results() -> AsyncGenerator[bytes, None]:
+        for item in items:
+            if item.custom_id in completed:
+                yield f"{completed[item.custom_id]}\n".encode()
+        failed = 0
+        async for index, outcome in service.generate_batch(requests, BATCH_CONCURRENCY, call):
+            item = remaining[index]
+            if isinstance(outcome, Exception):
+                failed += 1
+                logger.warning("Batch item failed", batch_id=batch, custom_id=item.custom_id)
+                line = json.dumps(result_line(item.custom_id, error=outcome), ensure_ascii=False)
+            else:
+                body = chat_completion_body(item.request.model, outcome)
+                line = json.dumps(result_line(item.custom_id, body), ensure_ascii=False)
+                store.save(batch, item.custom_id, line)
+            yield f"{line}\n".encode()
+        logger.info("Batch finished", batch_id=batch, items=len(items), failed=failed)
+
+    return StreamingResponse(
+        results(), media_type="application/x-ndjson", headers={"X-Batch-Id": batch}
+    )
@@ -0,0 +1,70 @@
+"""FastAPI dependencies giving routes access to application-scoped state"""
+
+from fastapi import Request
+
+from core.metrics import Metrics
+from services.admission import AdmissionController
+from services.batch import BatchStore
+from services.conversations import ConversationStore
+from services.jobs import JobQueue
+from services.llm_service import LLMService
+from services.model_catalog import ModelCatalog
+from services.response_cache import ResponseCache
+from services.semantic_cache import SemanticCache
+from services.singleflight import SingleFlight
+from services.tokens import TokenEstimator
+
+
+def get_llm_service(request: Request) -> LLMService:
+    """LLMService for the configured provider, from the app-wide registry"""
+    return request.app.state.llm_registry.get()
+
+
+def get_response_cache(request: Request) -> ResponseCache | None:
+    """Completion cache, or None when disabled"""
+    return request.app.state.response_cache
+
+
+def get_single_flight(request: Request) -> SingleFlight | None:
+    """Request coalescing layer, or None when disabled"""
+    return request.app.state.single_flight
+
+
+def get_semantic_cache(request: Request) -> SemanticCache | None:
+    """Near-duplicate answer cache, or None when disabled"""
+    return request.app.state.semantic_cache
+
+
+def get_model_catalog(request: Request) -> ModelCatalog:
+    """Pre-encoded model lists"""
+    return request.app.state.model_catalog
+
+
+def get_token_estimator(request: Request) -> TokenEstimator:
+    """Local token counter"""
+    return request.app.state.token_estimator
+
+
+def get_metrics(request: Request) -> Metrics:
+    """Application metrics"""
+    return request.app.state.metrics
+
+
+def get_admission(request: Request) -> AdmissionController | None:
+    """Upstream admission control, or None when disabled"""
+    return request.app.state.admission
+
+
+def get_batch_store(request: Request) -> BatchStore:
+    """Checkpoints of batch results"""
+    return request.app.state.batch_store
+
+
+def get_job_queue(request: Request) -> JobQueue:
+    """Asynchronous job queue"""
+    return request.app.state.jobs
+
+
+def get_conversations(request: Request) -> ConversationStore | None:
+    """Stored conversation prefixes, or None when disabled"""
+    return request.app.state.conversations
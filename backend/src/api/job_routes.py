@@ -0,0 +1,145 @@
+"""Asynchronous completion jobs: submit now, fetch the result later"""
+
+from collections.abc import Awaitable, Callable
+from functools import partial
+
+import structlog
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.responses import JSONResponse
+from starlette.datastructures import State
+
+from api.dependencies import get_job_queue, get_llm_service, get_token_estimator
+from api.openai_routes import chat_completion_body, context_length_error
+from config import JOBS_MAX_WAIT, JOBS_PRIORITY, MODEL_MAP
+from models.schemas import ChatRequest
+from services.admission import run_admitted
+from services.jobs import FINAL_STATES, JobQueue
+from services.llm_service import Completion, LLMService
+from services.tokens import TokenEstimator
+
+logger = structlog.get_logger(__name__)
+
+router = APIRouter(tags=["Jobs"])
+
+# Endpoint label of the metrics recorded here
+ENDPOINT = "jobs"
+
+
+def job_runner(state: State) -> Callable[[dict], Awaitable[Completion]]:
+    """Run jobs through the shared service, paced below interactive traffic"""
+
+    async def run(request: dict) -> Completion:
+        service = state.llm_registry.get()
+        model = request["model"]
+        state.metrics.requests.inc(ENDPOINT, model, "false")
+        completion = await run_admitted(
+            state.admission,
+            MODEL_MAP.get(model, model),
+            partial(service.generate_completion, **request),
+            priority=JOBS_PRIORITY,
+            tokens=state.token_estimator.count_messages(request["messages"])
+            + service.prompts.select(model, request.get("tenant")).tokens
+            + request["max_tokens"],
+        )
+        state.metrics.record_usage(
+            ENDPOINT,
+            model,
+            completion.usage.prompt_tokens,
+            completion.usage.completion_tokens,
+            completion.usage.cached_tokens,
+        )
+        return completion
+
+    return run
+
+
+def job_object(job: dict) -> dict:
+    """OpenAI-style representation of a job"""
+    model = job["request"]["model"]
+    result = job["result"]
+    return {
+        "id": job["id"],
+        "object": "chat.completion.job",
+        "model": model,
+        "status": job["status"],
+        "created_at": int(job["created_at"]),
+        "started_at": job["started_at"] and int(job["started_at"]),
+        "finished_at": job["finished_at"] and int(job["finished_at"]),
+        "result": chat_completion_body(model, Completion.from_dict(result)) if result else None,
+        "error": {"message": job["error"]} if job["error"] else None,
+    }
+
+
+def not_found(job_id: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=404,
+        content={
+            "error": {
+                "message": f"No job with id {job_id!r}",
+                "type": "invalid_request_error",
+                "code": "job_not_found",
+            }
+        },
+    )
+
+
+@router.post("/v1/jobs", status_code=202)
+async def create_job(
+    request: ChatRequest,
+    jobs: JobQueue = Depends(get_job_queue),
+    service: LLMService = Depends(get_llm_service),
+    estimator: TokenEstimator = Depends(get_token_estimator),
+    tenant: str | None = Header(default=None, alias="X-Tenant-Id"),
+):
+    """Queue a non-streaming chat completion and return its job id right away"""
+    messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    prompt_tokens = (
+        estimator.count_messages(messages) + service.prompts.select(request.model, tenant).tokens
+    )
+    if (error := context_length_error(request, prompt_tokens, service)) is not None:
+        return error
+    job = jobs.submit(
+        {
+            "messages": messages,
+            "model": request.model,
+            "temperature": request.temperature,
+            "max_tokens": request.max_tokens,
+            "tenant": tenant,
+        }
+    )
+    logger.info("Job queued", job_id=job["id"], model=request.model)
+    return job_object(job)
+
+
+@router.get("/v1/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    wait: float = Query(default=0, ge=0, description="Seconds to wait for the job to finish"),
+    jobs: JobQueue = Depends(get_job_queue),
+):
+    """Job status and result; with `wait`, long-poll until the job is finished"""
+    job = await jobs.wait(job_id, min(wait, JOBS_MAX_WAIT))
+    if job is None:
+        return not_found(job_id)
+    return job_object(job)
+
+
+@router.delete("/v1/jobs/{job_id}")
+async def cancel_job(job_id: str, jobs: JobQueue = Depends(get_job_queue)):
+    """Cancel a job that has not started yet"""
+    if not jobs.store.cancel(job_id):
+        job = jobs.store.get(job_id)
+        if job is None:
+            return not_found(job_id)
+        if job["status"] not in FINAL_STATES:
+            return JSONResponse(
+                status_code=409,
+                content={
+                    "error": {
+                        "message": "The job is already running",
+                        "type": "invalid_request_error",
+                        "code": "job_running",
+                    }
+                },
+            )
+    return job_object(jobs.store.get(job_id))
@@ -0,0 +1,244 @@
+"""Ollama-compatible API routes"""
+
+import asyncio
+import time
+from collections.abc import AsyncGenerator
+
+import structlog
+from fastapi import APIRouter, Depends, Header, Request, Response
+from starlette.background import BackgroundTask
+
+from api.dependencies import (
+    get_admission,
+    get_llm_service,
+    get_metrics,
+    get_model_catalog,
+    get_token_estimator,
+)
+from api.openai_routes import admit, context_length_error, encoded_json, hedge_admission
+from api.streaming import CancellableStreamingResponse, OllamaChunkEncoder, coalesce_deltas
+from config import STREAM_COALESCE_MAX_CHARS, STREAM_COALESCE_WINDOW_MS
+from core.metrics import Metrics
+from core.tracing import StreamSpan, mark_parsed, tracer
+from models.schemas import (
+    ChatRequest,
+    Message,
+    OllamaChatRequest,
+    OllamaGenerateRequest,
+    OllamaOptions,
+)
+from services.admission import AdmissionController, hold_during
+from services.llm_service import STREAM_ERROR_PREFIX, LLMService
+from services.model_catalog import ModelCatalog
+from services.tokens import TokenEstimator, TokenUsage
+
+logger = structlog.get_logger(__name__)
+
+router = APIRouter(tags=["Ollama"])
+
+# Completion length when the request leaves num_predict unset or at -1
+DEFAULT_NUM_PREDICT = ChatRequest.model_fields["max_tokens"].default
+MAX_NUM_PREDICT = 32000
+
+
+@router.get("/api/tags")
+async def list_ollama_models(
+    request: Request, catalog: ModelCatalog = Depends(get_model_catalog)
+) -> Response:
+    """List available models (Ollama format)"""
+    return encoded_json(catalog.ollama, request)
+
+
+@router.post("/api/chat")
+async def ollama_chat(
+    request: OllamaChatRequest,
+    service: LLMService = Depends(get_llm_service),
+    estimator: TokenEstimator = Depends(get_token_estimator),
+    metrics: Metrics = Depends(get_metrics),
+    admission: AdmissionController | None = Depends(get_admission),
+    priority: int = Header(default=0, alias="X-Priority"),
+    tenant: str | None = Header(default=None, alias="X-Tenant-Id"),
+):
+    """Ollama /api/chat endpoint, streamed as NDJSON"""
+    chat = chat_request(request.model, request.messages, request.stream, request.options)
+    return await complete(
+        chat, "ollama_chat", service, estimator, metrics, admission, priority, tenant
+    )
+
+
+@router.post("/api/generate")
+async def ollama_generate(
+    request: OllamaGenerateRequest,
+    service: LLMService = Depends(get_llm_service),
+    estimator: TokenEstimator = Depends(get_token_estimator),
+    metrics: Metrics = Depends(get_metrics),
+    admission: AdmissionController | None = Depends(get_admission),
+    priority: int = Header(default=0, alias="X-Priority"),
+    tenant: str | None = Header(default=None, alias="X-Tenant-Id"),
+):
+    """Ollama /api/generate endpoint: a single prompt, streamed as NDJSON"""
+    messages = [Message(role="user", content=request.prompt)]
+    if request.system:
+        messages.insert(0, Message(role="system", content=request.system))
+    chat = chat_request(request.model, messages, request.stream, request.options)
+    return await complete(
+        chat, "ollama_generate", service, estimator, metrics, admission, priority, tenant
+    )
+
+
+def chat_request(
+    model: str, messages: list[Message], stream: bool, options: OllamaOptions
+) -> ChatRequest:
+    """Chat request of an Ollama request, num_predict mapped to max_tokens"""
+    num_predict = options.num_predict
+    return ChatRequest(
+        model=model,
+        messages=messages,
+        stream=stream,
+        temperature=options.temperature,
+        max_tokens=(
+            min(num_predict, MAX_NUM_PREDICT)
+            if num_predict is not None and num_predict > 0
+            else DEFAULT_NUM_PREDICT
+        ),
+    )
+
+
+def stats(usage: TokenUsage, started: float, first: float | None) -> dict[str, int]:
+    """Ollama counters of a finished completion; durations in nanoseconds"""
+    now = time.perf_counter()
+    first = first or now
+    return {
+        "total_duration": int((now - started) * 1e9),
+        "load_duration": 0,
+        "prompt_eval_count": usage.prompt_tokens,
+        "prompt_eval_duration": int((first - started) * 1e9),
+        "eval_count": usage.completion_tokens,
+        "eval_duration": int((now - first) * 1e9),
+    }
+
+
+async def complete(
+    request: ChatRequest,
+    endpoint: str,
+    service: LLMService,
+    estimator: TokenEstimator,
+    metrics: Metrics,
+    admission: AdmissionController | None,
+    priority: int,
+    tenant: str | None,
+):
+    """Run a chat request and answer it in the Ollama format of the endpoint"""
+    started = time.perf_counter()
+    mark_parsed()
+    metrics.requests.inc(endpoint, request.model, "true" if request.stream else "false")
+    messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    prompt_tokens = (
+        estimator.count_messages(messages) + service.prompts.select(request.model, tenant).tokens
+    )
+    if (error := context_length_error(request, prompt_tokens, service)) is not None:
+        return error
+    encoder = OllamaChunkEncoder(request.model, chat=endpoint == "ollama_chat")
+    ticket = await admit(admission, None, "", request, prompt_tokens, priority)
+
+    if not request.stream:
+        completion = None
+        try:
+            with tracer.start_as_current_span("chat.completion"):
+                completion = await service.generate_completion(
+                    messages=messages,
+                    model=request.model,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens,
+                    tenant=tenant,
+                )
+        finally:
+            if ticket is not None:
+                ticket.release(completion and completion.usage.total_tokens)
+        metrics.request_duration.observe(time.perf_counter() - started, endpoint, request.model)
+        metrics.record_usage(
+            endpoint,
+            request.model,
+            completion.usage.prompt_tokens,
+            completion.usage.completion_tokens,
+            completion.usage.cached_tokens,
+        )
+        body = {"model": request.model, "created_at": encoder.created_at}
+        if encoder.chat:
+            body["message"] = {"role": "assistant", "content": completion.content}
+        else:
+            body["response"] = completion.content
+        return {
+            **body,
+            "done": True,
+            "done_reason": "stop",
+            **stats(completion.usage, started, None),
+        }
+
+    usage = TokenUsage()
+    source = service.stream_completion(
+        messages=messages,
+        model=request.model,
+        temperature=request.temperature,
+        max_tokens=request.max_tokens,
+        usage=usage,
+        tenant=tenant,
+        admit_hedge=hedge_admission(admission, request, prompt_tokens),
+    )
+    if ticket is not None:
+        source = hold_during(source, ticket, usage)
+
+    async def ndjson_stream() -> AsyncGenerator[bytes, None]:
+        chunk_count = 0
+        streamed = []
+        timer = metrics.track_stream(endpoint, request.model, started)
+        span = StreamSpan("chat.stream", {"gen_ai.request.model": request.model})
+        outcome = "error"
+        deltas = coalesce_deltas(
+            source, STREAM_COALESCE_WINDOW_MS / 1000, STREAM_COALESCE_MAX_CHARS
+        )
+        try:
+            async for content in deltas:
+                # Upstream errors arrive as content, and are sent as such, as on /v1
+                if content.startswith(STREAM_ERROR_PREFIX):
+                    logger.error("Ollama stream error", error=content)
+                streamed.append(content)
+                chunk_count += 1
+                timer.token()
+                span.token(content)
+                yield encoder.delta(content)
+
+            logger.info("Ollama stream completed", chunks=chunk_count, **usage.as_dict())
+            metrics.record_usage(
+                endpoint,
+                request.model,
+                usage.prompt_tokens,
+                usage.completion_tokens,
+                usage.cached_tokens,
+            )
+            outcome = "completed"
+            yield encoder.final(stats(usage, started, timer.first))
+
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            saved = metrics.record_stream_cancelled(
+                endpoint,
+                request.model,
+                estimator.count("".join(streamed)),
+                request.max_tokens,
+            )
+            logger.info("Ollama stream cancelled by client", chunks=chunk_count, saved=saved)
+            raise
+        except Exception as e:
+            logger.error("Ollama stream exception", error=str(e), exc_info=True)
+            yield encoder.error(str(e))
+        finally:
+            await deltas.aclose()
+            timer.finish(usage.completion_tokens)
+            span.finish(outcome, usage.prompt_tokens, usage.completion_tokens)
+
+    return CancellableStreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(ticket.release) if ticket is not None else None,
+    )
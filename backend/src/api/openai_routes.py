@@ -1,139 +1,495 @@
 """OpenAI-compatible API routes"""
 
-import json
+import asyncio
 import time
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from functools import partial
 
 import structlog
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Header, Request, Response
+from fastapi.responses import JSONResponse
+from starlette.background import BackgroundTask
 
-from config import AVAILABLE_MODELS
+from api.dependencies import (
+    get_admission,
+    get_conversations,
+    get_llm_service,
+    get_metrics,
+    get_model_catalog,
+    get_response_cache,
+    get_semantic_cache,
+    get_single_flight,
+    get_token_estimator,
+)
+from api.streaming import (
+    DONE_EVENT,
+    CancellableStreamingResponse,
+    ChatChunkEncoder,
+    coalesce_deltas,
+)
+from config import (
+    MODEL_CONTEXT_WINDOWS,
+    MODEL_MAP,
+    MODELS_CACHE_MAX_AGE,
+    STREAM_COALESCE_MAX_CHARS,
+    STREAM_COALESCE_WINDOW_MS,
+    STREAM_REPLAY_CHUNK_SIZE,
+)
+from core.metrics import Metrics
+from core.tracing import StreamSpan, mark_parsed, tracer
 from models.schemas import ChatRequest
-from services.llm_service import LLMService
+from services.admission import Admission, AdmissionController, hold_during
+from services.conversations import ConversationStore, UnknownPrefix
+from services.llm_service import STREAM_ERROR_PREFIX, Completion, LLMService
+from services.model_catalog import EncodedResponse, ModelCatalog
+from services.response_cache import ResponseCache, replay_deltas, request_key
+from services.semantic_cache import SemanticCache, semantic_query
+from services.singleflight import SingleFlight
+from services.tokens import TokenEstimator, TokenUsage
 
 logger = structlog.get_logger(__name__)
 
 router = APIRouter(tags=["OpenAI"])
 
+# Endpoint label of the metrics recorded here
+ENDPOINT = "chat_completions"
+
 
 @router.get("/v1/models")
 @router.get("/models")
-async def list_openai_models():
+async def list_openai_models(
+    request: Request, catalog: ModelCatalog = Depends(get_model_catalog)
+) -> Response:
     """List available models (OpenAI format)"""
-    models = [
-        {
-            "id": model["name"],
-            "object": "model",
-            "created": int(time.time()),
-            "owned_by": "mistral-ai",
-        }
-        for model in AVAILABLE_MODELS
-    ]
-    return {"data": models, "object": "list"}
+    return encoded_json(catalog.openai, request)
+
+
+def encoded_json(encoded: EncodedResponse, request: Request) -> Response:
+    """A pre-encoded JSON body, or 304 Not Modified when the client has it"""
+    headers = {"ETag": encoded.etag, "Cache-Control": f"public, max-age={MODELS_CACHE_MAX_AGE}"}
+    if encoded.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(encoded.body, media_type="application/json", headers=headers)
 
 
 @router.post("/v1/chat/completions")
 @router.post("/chat/completions")
-async def chat_completions(request: ChatRequest):
+async def chat_completions(
+    request: ChatRequest,
+    response: Response,
+    service: LLMService = Depends(get_llm_service),
+    cache: ResponseCache | None = Depends(get_response_cache),
+    flights: SingleFlight | None = Depends(get_single_flight),
+    semantic: SemanticCache | None = Depends(get_semantic_cache),
+    estimator: TokenEstimator = Depends(get_token_estimator),
+    metrics: Metrics = Depends(get_metrics),
+    admission: AdmissionController | None = Depends(get_admission),
+    conversations: ConversationStore | None = Depends(get_conversations),
+    priority: int = Header(default=0, alias="X-Priority"),
+    tenant: str | None = Header(default=None, alias="X-Tenant-Id"),
+):
     """OpenAI-compatible /v1/chat/completions endpoint"""
+    started = time.perf_counter()
+    mark_parsed()
+    metrics.requests.inc(ENDPOINT, request.model, "true" if request.stream else "false")
     logger.debug(
         "Chat completions request",
         model=request.model,
         stream=request.stream,
         messages_count=len(request.messages),
     )
-    service = LLMService()
 
     # Convert Pydantic models to dict
     messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
 
+    # Continuing a stored conversation: only the new messages were sent. They
+    # are stored with the answer, so a failed request leaves the conversation as it was
+    base = turn = None
+    if conversations is not None and (request.prefix or request.conversation_id):
+        try:
+            base, earlier = conversations.resolve(request.prefix, request.conversation_id)
+        except UnknownPrefix:
+            return unknown_prefix_error()
+        turn = messages
+        messages = earlier + messages
+
+    # System prompt variant, canonicalized and token-counted at startup
+    system = service.prompts.select(request.model, tenant)
+
+    # Canonical request key, shared by the response cache and request coalescing
+    cacheable = cache is not None and cache.accepts(request.temperature)
+    key = None
+    if cacheable or flights is not None:
+        key = request_key(
+            request.model,
+            messages,
+            request.temperature,
+            request.max_tokens,
+            system.digest,
+        )
+    cache_key = key if cacheable else None
+    # Fresh questions can also be answered by a near-duplicate (semantic cache)
+    query = semantic_query(request.model, messages, system.digest) if semantic is not None else None
+
     if not request.stream:
         # Non-streaming response
-        content = await service.generate_completion(
-            messages=messages,
-            model=request.model,
-            temperature=request.temperature,
-            max_tokens=request.max_tokens,
+        completion = None
+        if cache_key is not None:
+            cached = traced_lookup("exact", cache.get, cache_key)
+            metrics.record_cache_lookup(ENDPOINT, request.model, "exact", cached is not None)
+            if cached is not None:
+                completion = Completion.from_dict(cached)
+        if completion is None and query is not None:
+            match = traced_lookup("semantic", semantic.lookup, *query)
+            metrics.record_cache_lookup(ENDPOINT, request.model, "semantic", match is not None)
+            if match is not None:
+                answer, similarity = match
+                completion = Completion(
+                    answer, estimator.estimate_usage(messages, system.tokens, answer)
+                )
+                response.headers["X-Cache-Similarity"] = f"{similarity:.3f}"
+        response.headers["X-Cache"] = (
+            "HIT"
+            if completion is not None
+            else "BYPASS"
+            if cache_key is None and query is None
+            else "MISS"
         )
 
-        return {
-            "id": f"chatcmpl-{int(time.time())}",
-            "object": "chat.completion",
-            "created": int(time.time()),
-            "model": request.model,
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {"role": "assistant", "content": content},
-                    "finish_reason": "stop",
-                }
-            ],
-            "usage": {
-                "prompt_tokens": 0,
-                "completion_tokens": 0,
-                "total_tokens": 0,
-            },
-        }
-
-    # Streaming response
-    async def openai_stream() -> AsyncGenerator[str, None]:
-        chunk_count = 0
-        try:
-            logger.info("Starting OpenAI stream", model=request.model)
+        if completion is None:
+            prompt_tokens = estimator.count_messages(messages) + system.tokens
+            if (error := context_length_error(request, prompt_tokens, service)) is not None:
+                return error
+            ticket = await admit(admission, flights, key, request, prompt_tokens, priority)
+
+            def generate():
+                return service.generate_completion(
+                    messages=messages,
+                    model=request.model,
+                    temperature=request.temperature,
+                    max_tokens=request.max_tokens,
+                    tenant=tenant,
+                )
+
+            with tracer.start_as_current_span("chat.completion") as span:
+                completion = await shared_completion(flights, key, ticket, generate)
+                span.set_attribute("gen_ai.usage.input_tokens", completion.usage.prompt_tokens)
+                span.set_attribute("gen_ai.usage.output_tokens", completion.usage.completion_tokens)
+            if cache_key is not None:
+                cache.set(cache_key, completion.as_dict())
+            if query is not None:
+                semantic.add(*query, completion.content)
+
+        if turn is not None:
+            response.headers["X-Conversation-Prefix"] = conversations.extend(
+                base,
+                [*turn, {"role": "assistant", "content": completion.content}],
+                request.conversation_id,
+            )
+        metrics.request_duration.observe(time.perf_counter() - started, ENDPOINT, request.model)
+        metrics.record_usage(
+            ENDPOINT,
+            request.model,
+            completion.usage.prompt_tokens,
+            completion.usage.completion_tokens,
+            completion.usage.cached_tokens,
+        )
+        return chat_completion_body(request.model, completion)
 
-            async for content in service.stream_completion(
+    # Streaming response: replay a recorded stream, or record the live one
+    stream_key = f"stream:{cache_key}" if cache_key is not None else None
+    recorded = None
+    if stream_key is not None:
+        recorded = traced_lookup("exact", cache.get, stream_key)
+        metrics.record_cache_lookup(ENDPOINT, request.model, "exact", recorded is not None)
+    headers = {}
+    if recorded is None and query is not None:
+        match = traced_lookup("semantic", semantic.lookup, *query)
+        metrics.record_cache_lookup(ENDPOINT, request.model, "semantic", match is not None)
+        if match is not None:
+            answer, similarity = match
+            recorded = {
+                "deltas": [answer],
+                "usage": estimator.estimate_usage(messages, system.tokens, answer).as_dict(),
+            }
+            headers["X-Cache-Similarity"] = f"{similarity:.3f}"
+    ticket = None
+    if recorded is not None:
+        source = replay_deltas(recorded["deltas"], STREAM_REPLAY_CHUNK_SIZE)
+        usage = TokenUsage.from_dict(recorded["usage"])
+        recording = None
+    else:
+        prompt_tokens = estimator.count_messages(messages) + system.tokens
+        if (error := context_length_error(request, prompt_tokens, service)) is not None:
+            return error
+        ticket = await admit(admission, flights, f"stream:{key}", request, prompt_tokens, priority)
+        usage = TokenUsage()
+
+        def open_stream():
+            stream = service.stream_completion(
                 messages=messages,
                 model=request.model,
                 temperature=request.temperature,
                 max_tokens=request.max_tokens,
-            ):
+                usage=usage,
+                tenant=tenant,
+                admit_hedge=hedge_admission(admission, request, prompt_tokens),
+            )
+            return stream if ticket is None else hold_during(stream, ticket, usage)
+
+        # Identical concurrent streams fan out from one upstream stream
+        if flights is not None:
+            source, usage = flights.stream(f"stream:{key}", open_stream, usage)
+        else:
+            source = open_stream()
+        recording = [] if stream_key is not None or query is not None else None
+    headers["X-Cache"] = (
+        "HIT"
+        if recorded is not None
+        else "BYPASS"
+        if stream_key is None and query is None
+        else "MISS"
+    )
+
+    if turn is not None:
+        # Prefix of the request; stored with the answer when the stream ends
+        headers["X-Conversation-Prefix"] = conversations.head(base, turn)
+    encoder = ChatChunkEncoder(request.model)
+    include_usage = request.stream_options is not None and request.stream_options.include_usage
+
+    async def openai_stream() -> AsyncGenerator[bytes, None]:
+        nonlocal recording
+        chunk_count = 0
+        answer = [] if turn is not None else None
+        streamed = []
+        timer = metrics.track_stream(ENDPOINT, request.model, started)
+        span = StreamSpan(
+            "chat.stream", {"gen_ai.request.model": request.model, "cache": headers["X-Cache"]}
+        )
+        outcome = "error"
+        deltas = coalesce_deltas(
+            source, STREAM_COALESCE_WINDOW_MS / 1000, STREAM_COALESCE_MAX_CHARS
+        )
+        try:
+            logger.info("Starting OpenAI stream", model=request.model, cache=headers["X-Cache"])
+
+            async for content in deltas:
+                streamed.append(content)
+                if recording is not None:
+                    if content.startswith(STREAM_ERROR_PREFIX):
+                        recording = None  # Never replay a failed stream
+                    else:
+                        recording.append(content)
+                if answer is not None:
+                    if content.startswith(STREAM_ERROR_PREFIX):
+                        answer = None  # Keep failed answers out of the conversation
+                    else:
+                        answer.append(content)
+
                 # Check if it's an error
                 if content.startswith("{") and "error" in content:
                     logger.error("Stream error detected", error=content)
-                    yield f"data: {content}\n\n"
-                    yield "data: [DONE]\n\n"
+                    yield f"data: {content}\n\n".encode()
+                    yield DONE_EVENT
                     return
 
                 chunk_count += 1
-
-                # Send OpenAI-format chunk
-                chunk = {
-                    "id": f"chatcmpl-{int(time.time())}",
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": request.model,
-                    "choices": [
-                        {
-                            "index": 0,
-                            "delta": {"role": "assistant", "content": content},
-                            "finish_reason": None,
-                        }
-                    ],
-                }
-                yield f"data: {json.dumps(chunk)}\n\n"
+                timer.token()
+                span.token(content)
+                yield encoder.delta(content)
 
             # Send final done message
-            logger.info("OpenAI stream completed", chunks=chunk_count)
-            final_chunk = {
-                "id": f"chatcmpl-{int(time.time())}",
-                "object": "chat.completion.chunk",
-                "created": int(time.time()),
-                "model": request.model,
-                "choices": [
-                    {
-                        "index": 0,
-                        "delta": {},
-                        "finish_reason": "stop",
-                    }
-                ],
-            }
-            yield f"data: {json.dumps(final_chunk)}\n\n"
-            yield "data: [DONE]\n\n"
+            logger.info("OpenAI stream completed", chunks=chunk_count, **usage.as_dict())
+            metrics.record_usage(
+                ENDPOINT,
+                request.model,
+                usage.prompt_tokens,
+                usage.completion_tokens,
+                usage.cached_tokens,
+            )
+            if recording is not None:
+                if stream_key is not None:
+                    cache.set(stream_key, {"deltas": recording, "usage": usage.as_dict()})
+                if query is not None:
+                    semantic.add(*query, "".join(recording))
+            if answer is not None:
+                conversations.extend(
+                    base,
+                    [*turn, {"role": "assistant", "content": "".join(answer)}],
+                    request.conversation_id,
+                )
+            outcome = "completed"
+            yield encoder.final(usage.as_dict() if include_usage else None)
 
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            # Client gone: closing the deltas below closes the upstream stream
+            if recorded is None:
+                saved = metrics.record_stream_cancelled(
+                    ENDPOINT,
+                    request.model,
+                    estimator.count("".join(streamed)),
+                    request.max_tokens,
+                )
+                logger.info("OpenAI stream cancelled by client", chunks=chunk_count, saved=saved)
+            raise
         except Exception as e:
             logger.error("OpenAI stream exception", error=str(e), exc_info=True)
-            error_data = {"error": {"message": str(e), "type": "server_error"}}
-            yield f"data: {json.dumps(error_data)}\n\n"
+            yield encoder.error(str(e))
+        finally:
+            await deltas.aclose()
+            timer.finish(usage.completion_tokens)
+            span.finish(outcome, usage.prompt_tokens, usage.completion_tokens)
 
-    return StreamingResponse(openai_stream(), media_type="text/event-stream")
+    return CancellableStreamingResponse(
+        openai_stream(),
+        media_type="text/event-stream",
+        headers=headers,
+        # Frees the slot even if the client left before the stream started
+        background=BackgroundTask(ticket.release) if ticket is not None else None,
+    )
+
+
+def chat_completion_body(model: str, completion: Completion) -> dict:
+    """OpenAI chat.completion object of a finished completion"""
+    return {
+        "id": f"chatcmpl-{int(time.time())}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": completion.content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": completion.usage.as_dict(),
+    }
+
+
+async def admit(
+    admission: AdmissionController | None,
+    flights: SingleFlight | None,
+    flight_key: str,
+    request: ChatRequest,
+    prompt_tokens: int,
+    priority: int,
+) -> Admission | None:
+    """
+    Slot for an upstream call.
+
+    Returns None when admission control is off or when the request joins an
+    identical in-flight call, which does not open a new upstream call.
+
+    Raises:
+        AdmissionRejected: Turned into a 429 by the application.
+    """
+    if admission is None or (flights is not None and flights.in_flight(flight_key)):
+        return None
+    model = MODEL_MAP.get(request.model, request.model)
+    with tracer.start_as_current_span(
+        "admission", attributes={"gen_ai.request.model": model, "priority": priority}
+    ):
+        return await admission.acquire(
+            model, priority=priority, tokens=prompt_tokens + request.max_tokens
+        )
+
+
+def hedge_admission(
+    admission: AdmissionController | None, request: ChatRequest, prompt_tokens: int
+) -> Callable[[], Admission | None] | None:
+    """Non-blocking admission for a hedge, which is skipped when none is free"""
+    if admission is None:
+        return None
+    model = MODEL_MAP.get(request.model, request.model)
+    return partial(admission.try_acquire, model, tokens=prompt_tokens + request.max_tokens)
+
+
+async def shared_completion(
+    flights: SingleFlight | None,
+    key: str,
+    ticket: Admission | None,
+    call: Callable[[], Awaitable[Completion]],
+) -> Completion:
+    """
+    Run the upstream call, once for identical concurrent requests.
+
+    The ticket is held for as long as the upstream call runs: a caller that
+    gives up leaves the shared call running for the others, so the ticket
+    is released by the call itself, not by the caller. A caller whose call
+    never ran, because it joined one started meanwhile, gives it back at once.
+    """
+    started = False
+
+    async def admitted() -> Completion:
+        nonlocal started
+        started = True
+        completion = None
+        try:
+            completion = await call()
+            return completion
+        finally:
+            if ticket is not None:
+                ticket.release(completion and completion.usage.total_tokens)
+
+    if flights is None:
+        return await admitted()
+    try:
+        return await flights.do(key, admitted)
+    finally:
+        if ticket is not None and not started:
+            ticket.release(0)
+
+
+def traced_lookup(kind: str, lookup, *args):
+    """Cache lookup in a span telling the cache stage and whether it hit"""
+    with tracer.start_as_current_span("cache.lookup", attributes={"cache.kind": kind}) as span:
+        result = lookup(*args)
+        span.set_attribute("cache.hit", result is not None)
+        return result
+
+
+def unknown_prefix_error() -> JSONResponse:
+    """The stored prefix expired: the client must send the whole conversation again"""
+    return JSONResponse(
+        status_code=400,
+        content={
+            "error": {
+                "message": "Unknown or expired conversation prefix, send the full conversation",
+                "type": "invalid_request_error",
+                "code": "unknown_prefix",
+            }
+        },
+    )
+
+
+def context_length_error(
+    request: ChatRequest, prompt_tokens: int, service: LLMService
+) -> JSONResponse | None:
+    """Pre-flight check: reject requests that cannot fit the model's context window
+
+    Skipped when the service trims long histories to fit by itself.
+    """
+    if service.context is not None:
+        return None
+    window = MODEL_CONTEXT_WINDOWS.get(MODEL_MAP.get(request.model, request.model))
+    if window is None:
+        return None
+    needed = prompt_tokens + request.max_tokens
+    if needed <= window:
+        return None
+    logger.warning("Context window exceeded", model=request.model, needed=needed, window=window)
+    return JSONResponse(
+        status_code=400,
+        content={
+            "error": {
+                "message": (
+                    f"This model's maximum context length is {window} tokens, "
+                    f"but the request needs about {needed} (prompt + max_tokens)."
+                ),
+                "type": "invalid_request_error",
+                "code": "context_length_exceeded",
+            }
+        },
+    )
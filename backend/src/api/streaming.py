@@ -0,0 +1,255 @@
+"""Low-overhead encoding of streamed completions"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import deque
+from collections.abc import AsyncGenerator
+from contextlib import aclosing
+from datetime import UTC, datetime
+from json.encoder import encode_basestring
+
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from services.llm_service import STREAM_ERROR_PREFIX
+
+DONE_EVENT = b"data: [DONE]\n\n"
+
+
+class ChatChunkEncoder:
+    """Pre-rendered OpenAI `chat.completion.chunk` SSE frames
+
+    The id, creation time and model are fixed once per stream, so the constant
+    envelope is rendered to bytes up front and each delta only costs escaping
+    its content. The role is sent with the first delta only, as OpenAI does.
+    """
+
+    def __init__(self, model: str):
+        self.id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.created = int(time.time())
+        head = (
+            f'data: {{"id":"{self.id}","object":"chat.completion.chunk",'
+            f'"created":{self.created},"model":{encode_basestring(model)},'
+            f'"choices":[{{"index":0,"delta":{{'
+        ).encode()
+        self._first_prefix = head + b'"role":"assistant","content":'
+        self._prefix = head + b'"content":'
+        self._suffix = b'},"finish_reason":null}]}\n\n'
+        self._final = head + b'},"finish_reason":"stop"}]}\n\n'
+        self._usage_prefix = (
+            f'data: {{"id":"{self.id}","object":"chat.completion.chunk",'
+            f'"created":{self.created},"model":{encode_basestring(model)},'
+            f'"choices":[],"usage":'
+        ).encode()
+        self._started = False
+
+    def delta(self, content: str) -> bytes:
+        """One SSE event carrying a content delta"""
+        if self._started:
+            prefix = self._prefix
+        else:
+            prefix = self._first_prefix
+            self._started = True
+        return prefix + encode_basestring(content).encode() + self._suffix
+
+    def final(self, usage: dict[str, int] = None) -> bytes:
+        """
+        Closing chunk with finish_reason followed by the [DONE] marker.
+
+        With `usage` (OpenAI `stream_options.include_usage`), an extra chunk
+        with empty choices and the usage object is sent before [DONE].
+        """
+        if usage is None:
+            return self._final + DONE_EVENT
+        return (
+            self._final
+            + self._usage_prefix
+            + json.dumps(usage, separators=(",", ":")).encode()
+            + b"}\n\n"
+            + DONE_EVENT
+        )
+
+    @staticmethod
+    def error(message: str, error_type: str = "server_error") -> bytes:
+        """OpenAI-style error event"""
+        payload = json.dumps({"error": {"message": message, "type": error_type}})
+        return f"data: {payload}\n\n".encode()
+
+
+class OllamaChunkEncoder:
+    """Pre-rendered Ollama NDJSON lines
+
+    Same approach as ChatChunkEncoder for the Ollama `/api/chat` (content in
+    `message`) and `/api/generate` (content in `response`) streams: one JSON
+    object per line, the envelope rendered once per stream.
+    """
+
+    def __init__(self, model: str, chat: bool = True):
+        self.chat = chat
+        self.created_at = datetime.now(UTC).isoformat().replace("+00:00", "Z")
+        head = f'{{"model":{encode_basestring(model)},"created_at":"{self.created_at}",'.encode()
+        if chat:
+            self._prefix = head + b'"message":{"role":"assistant","content":'
+            close = b"},"
+        else:
+            self._prefix = head + b'"response":'
+            close = b","
+        self._suffix = close + b'"done":false}\n'
+        self._final = self._prefix + b'""' + close + b'"done":true,"done_reason":"stop",'
+
+    def delta(self, content: str) -> bytes:
+        """One line carrying a content delta"""
+        return self._prefix + encode_basestring(content).encode() + self._suffix
+
+    def final(self, stats: dict[str, int]) -> bytes:
+        """Closing line with `done` set and the token counts and durations"""
+        return self._final + json.dumps(stats, separators=(",", ":")).encode()[1:] + b"\n"
+
+    @staticmethod
+    def error(message: str) -> bytes:
+        """Ollama-style error line"""
+        return json.dumps({"error": message}).encode() + b"\n"
+
+
+class CancellableStreamingResponse(StreamingResponse):
+    """StreamingResponse that stops its body as soon as the client disconnects
+
+    Starlette only watches for disconnects under ASGI spec < 2.4, and a client
+    leaving while a chunk is being sent leaves the body generator suspended
+    until garbage collection, with its upstream completion still running.
+    Here the body is streamed by a task that is cancelled on disconnect, and
+    the generator is always closed by that same task, which unwinds every
+    generator below it and closes the upstream stream right away.
+    """
+
+    async def stream_response(self, send: Send) -> None:
+        try:
+            await super().stream_response(send)
+        finally:
+            await self.body_iterator.aclose()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        stream = asyncio.create_task(self.stream_response(send))
+        disconnect = asyncio.create_task(self.listen_for_disconnect(receive))
+        try:
+            await asyncio.wait((stream, disconnect), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (stream, disconnect):
+                task.cancel()
+            await asyncio.gather(stream, disconnect, return_exceptions=True)
+        if not stream.cancelled() and (error := stream.exception()) is not None:
+            if isinstance(error, OSError):
+                raise ClientDisconnect() from error
+            raise error
+        if self.background is not None:
+            await self.background()
+
+
+async def coalesce_deltas(
+    deltas: AsyncGenerator[str, None], window: float = 0.0, max_chars: int = 0
+) -> AsyncGenerator[str, None]:
+    """
+    Merge deltas into fewer, larger ones.
+
+    Args:
+        deltas: Source of content deltas.
+        window: Flush buffered text at most this many seconds after its first
+            delta arrived, even if the source is stalled. 0 disables the timer.
+        max_chars: Flush as soon as this many characters are buffered.
+            0 disables the size limit.
+
+    With both limits disabled the deltas pass through untouched. An error
+    delta (STREAM_ERROR_PREFIX) is never merged: buffered text is flushed
+    and the error follows on its own, so consumers can still recognize it.
+    """
+    if window <= 0 and max_chars <= 0:
+        async with aclosing(deltas):
+            async for delta in deltas:
+                yield delta
+        return
+
+    buffer: list[str] = []
+    buffered = 0
+
+    if window <= 0:
+        async with aclosing(deltas):
+            async for delta in deltas:
+                if delta.startswith(STREAM_ERROR_PREFIX):
+                    if buffer:
+                        yield "".join(buffer)
+                        buffer.clear()
+                        buffered = 0
+                    yield delta
+                    continue
+                buffer.append(delta)
+                buffered += len(delta)
+                if buffered >= max_chars:
+                    yield "".join(buffer)
+                    buffer.clear()
+                    buffered = 0
+        if buffer:
+            yield "".join(buffer)
+        return
+
+    # Time window: a pump task reads ahead so a quiet source cannot hold back
+    # buffered text; a single timer per buffer wakes us when the window ends
+    loop = asyncio.get_running_loop()
+    ready: deque[str] = deque()
+    wakeup = asyncio.Event()
+
+    async def pump():
+        try:
+            async for delta in deltas:
+                ready.append(delta)
+                wakeup.set()
+        finally:
+            wakeup.set()
+
+    task = asyncio.ensure_future(pump())
+    timer = None
+    deadline = 0.0
+    try:
+        while True:
+            await wakeup.wait()
+            wakeup.clear()
+            while ready:
+                delta = ready.popleft()
+                if delta.startswith(STREAM_ERROR_PREFIX):
+                    if buffer:
+                        timer.cancel()
+                        yield "".join(buffer)
+                        buffer.clear()
+                        buffered = 0
+                    yield delta
+                    continue
+                if not buffer:
+                    deadline = loop.time() + window
+                    timer = loop.call_at(deadline, wakeup.set)
+                buffer.append(delta)
+                buffered += len(delta)
+                if max_chars > 0 and buffered >= max_chars:
+                    timer.cancel()
+                    yield "".join(buffer)
+                    buffer.clear()
+                    buffered = 0
+            if task.done():
+                break
+            if buffer and loop.time() >= deadline:
+                yield "".join(buffer)
+                buffer.clear()
+                buffered = 0
+    finally:
+        if timer is not None:
+            timer.cancel()
+        # Close the source now, not on some later loop turn: this closes the
+        # upstream stream and releases its admission slot
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await deltas.aclose()
+
+    if buffer:
+        yield "".join(buffer)
+    task.result()  # Re-raise a failure of the source
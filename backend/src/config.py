@@ -1,5 +1,6 @@
 """Configuration centralisée de l'application"""
 
+import json
 import os
 
 import structlog
@@ -12,12 +13,134 @@ logger = structlog.get_logger(__name__)
 # LLM Provider Configuration (European/Open-Source models)
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "mistral")  # Default: Mistral AI (France)
 
+# Serving: uvicorn worker processes started by run.py (unset or 0 = one per
+# CPU). Concurrency and queue limits below are per host, split between workers.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY") or 1)
+# Directory of the state shared by workers (run.py sets it up)
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR")
+
 # API Configuration
-MISTRAL_API_URL = "https://api.mistral.ai/v1"
+MISTRAL_API_URL = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai/v1")
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+# OpenAI-compatible server (vLLM, llama.cpp, Ollama /v1, ...), provider "openai"
+OPENAI_COMPAT_BASE_URL = os.getenv("OPENAI_COMPAT_BASE_URL")
+OPENAI_COMPAT_API_KEY = os.getenv("OPENAI_COMPAT_API_KEY", "not-needed")
 # Future providers:
 # HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
-# OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# Provider router: several backends per logical model, as JSON, e.g.
+# {"mistral-large": ["mistral:mistral-large-latest", "openai:mistral-large-2411"]}
+# Keys are requested names or MODEL_MAP targets; unlisted models use LLM_PROVIDER
+MODEL_BACKENDS = json.loads(os.getenv("MODEL_BACKENDS", "{}"))
+ROUTER_LATENCY_SMOOTHING = float(os.getenv("ROUTER_LATENCY_SMOOTHING", "0.3"))  # EWMA weight
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "5"))  # Before ejection
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "30"))  # Seconds before a retry probe
+
+# Upstream HTTP client (one pooled client shared by every provider model)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))  # seconds
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() == "true"
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))  # seconds
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "600"))  # seconds
+
+# Response cache (exact-match, non-streaming completions)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds
+RESPONSE_CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB_PATH")  # Optional SQLite disk tier
+RESPONSE_CACHE_DB_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_DB_MAX_ENTRIES", "65536"))
+# Also cache sampled (temperature > 0) completions
+RESPONSE_CACHE_SAMPLED = os.getenv("RESPONSE_CACHE_SAMPLED", "false").lower() == "true"
+# Merge replayed stream deltas into chunks of at least N characters (0 = as recorded)
+STREAM_REPLAY_CHUNK_SIZE = int(os.getenv("STREAM_REPLAY_CHUNK_SIZE", "0"))
+
+# Semantic cache (near-duplicate fresh questions, local static embeddings)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "minishlab/potion-base-8M")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))  # cosine
+SEMANTIC_CACHE_CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", "10000"))
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH")  # Optional memory-mapped index
+
+# Streaming: merge upstream deltas into fewer SSE events (0 disables each limit)
+STREAM_COALESCE_WINDOW_MS = float(os.getenv("STREAM_COALESCE_WINDOW_MS", "0"))
+STREAM_COALESCE_MAX_CHARS = int(os.getenv("STREAM_COALESCE_MAX_CHARS", "0"))
+
+# Request coalescing: identical concurrent requests share one upstream call
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+
+# Conversation store: clients send a conversation_id or prefix id plus only
+# the new messages; earlier ones are rebuilt from the store
+CONVERSATIONS_ENABLED = os.getenv("CONVERSATIONS_ENABLED", "true").lower() == "true"
+CONVERSATIONS_DB_PATH = os.getenv("CONVERSATIONS_DB_PATH")  # Unset: in memory
+CONVERSATIONS_TTL = float(os.getenv("CONVERSATIONS_TTL", "86400"))  # Since last use (seconds)
+
+# Hedged streams: when the first token is later than this percentile of recent
+# times to first token, race a second request (next backend, or the same one)
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "false").lower() == "true"
+HEDGING_PERCENTILE = float(os.getenv("HEDGING_PERCENTILE", "95"))
+HEDGING_BUDGET = float(os.getenv("HEDGING_BUDGET", "0.05"))  # Max extra streams (fraction)
+HEDGING_MIN_DELAY = float(os.getenv("HEDGING_MIN_DELAY", "0.1"))  # seconds
+HEDGING_MIN_SAMPLES = int(os.getenv("HEDGING_MIN_SAMPLES", "20"))  # Before hedging starts
+
+# Admission control: concurrent upstream calls per model, bounded waiting queue
+# and upstream rate budgets (0 = unlimited)
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))  # seconds
+UPSTREAM_RPM = int(os.getenv("UPSTREAM_RPM", "0"))  # Requests per minute
+UPSTREAM_TPM = int(os.getenv("UPSTREAM_TPM", "0"))  # Tokens per minute
+# SQLite file holding the rate budgets, so that all workers draw from them
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH")
+# Per-model overrides of ADMISSION_MAX_CONCURRENCY, keyed by upstream model
+# name, e.g. "mistral-large-latest=8,mistral-medium-latest=16"
+ADMISSION_MODEL_CONCURRENCY = {
+    model.strip(): int(limit)
+    for model, _, limit in (
+        pair.partition("=") for pair in os.getenv("ADMISSION_MODEL_CONCURRENCY", "").split(",")
+    )
+    if model.strip()
+}
+
+# Batch completions (/v1/batches): items in flight per batch, admission
+# priority (below interactive requests at 0) and checkpoint database
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+BATCH_PRIORITY = int(os.getenv("BATCH_PRIORITY", "-10"))
+BATCH_DB_PATH = os.getenv("BATCH_DB_PATH")  # Unset: in memory, lost on restart
+BATCH_RETENTION = float(os.getenv("BATCH_RETENTION", "86400"))  # Keep checkpoints (seconds)
+
+# Asynchronous jobs (/v1/jobs): SQLite queue shared by the workers of this
+# host; set JOBS_DB_PATH to a file for jobs to survive restarts
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH")  # Unset: in memory, lost on restart
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "4"))  # Jobs run at once per process
+JOBS_PRIORITY = int(os.getenv("JOBS_PRIORITY", "-5"))  # Admission priority of jobs
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "1"))  # seconds
+JOBS_MAX_WAIT = float(os.getenv("JOBS_MAX_WAIT", "60"))  # Longest long-poll (seconds)
+JOBS_RETENTION = float(os.getenv("JOBS_RETENTION", "86400"))  # Keep results (seconds)
+
+# Model lists (/v1/models, /api/tags): encoded once and revalidated with ETags;
+# clients may reuse them for MODELS_CACHE_MAX_AGE seconds. With a discovery
+# interval, the models served by each configured provider are merged in and
+# refreshed in the background (0 = configured models only).
+MODELS_CACHE_MAX_AGE = int(os.getenv("MODELS_CACHE_MAX_AGE", "60"))
+MODELS_DISCOVERY_INTERVAL = float(os.getenv("MODELS_DISCOVERY_INTERVAL", "0"))  # seconds
+
+# Tracing (OpenTelemetry): off by default. A fraction of requests is traced
+# (head sampling) and exported over OTLP/HTTP (OTEL_EXPORTER_OTLP_ENDPOINT,
+# default localhost:4318) or appended to TRACING_FILE as JSON lines.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "0.1"))
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "otlp")  # "otlp" or "file"
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "kairn-backend")
+# Deltas of a stream recorded as span events; later ones are only counted
+TRACING_MAX_TOKEN_EVENTS = int(os.getenv("TRACING_MAX_TOKEN_EVENTS", "256"))
+
+# Metrics: with several workers, each one publishes snapshots to this directory
+# and /metrics aggregates them (unset = this worker only)
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "5"))  # seconds
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 
@@ -38,6 +161,40 @@ MODEL_MAP = {
     "mistral-medium:latest": "mistral-medium-latest",
 }
 
+# Context window (tokens) of each upstream model, for pre-flight budget checks
+MODEL_CONTEXT_WINDOWS = {
+    "mistral-large-latest": 128000,
+    "mistral-medium-latest": 128000,
+}
+
+# System prompt variants: JSON map of variant name to prompt file, e.g.
+# {"concise": "/app/prompts/concise.md"}, assigned to models (requested or
+# MODEL_MAP names) and to tenants (X-Tenant-Id header) by two more JSON maps;
+# a tenant's variant wins over a model's, DEFAULT_SYSTEM_PROMPT is the fallback
+SYSTEM_PROMPT_VARIANTS = json.loads(os.getenv("SYSTEM_PROMPT_VARIANTS", "{}"))
+SYSTEM_PROMPT_MODELS = json.loads(os.getenv("SYSTEM_PROMPT_MODELS", "{}"))
+SYSTEM_PROMPT_TENANTS = json.loads(os.getenv("SYSTEM_PROMPT_TENANTS", "{}"))
+
+# Prompt tokens (system prompt + history) sent per request to each upstream
+# model; longer chats keep their most recent turns (see CONTEXT_* below)
+MODEL_HISTORY_BUDGETS = {
+    "mistral-large-latest": 32000,
+    "mistral-medium-latest": 32000,
+}
+
+# Context manager: trim histories to MODEL_HISTORY_BUDGETS and the context
+# window, optionally replacing dropped turns with a cached rolling summary
+CONTEXT_MANAGER_ENABLED = os.getenv("CONTEXT_MANAGER_ENABLED", "true").lower() == "true"
+CONTEXT_SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY_ENABLED", "false").lower() == "true"
+CONTEXT_SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL", "mistral-medium")
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "512"))
+CONTEXT_SUMMARY_CACHE_SIZE = int(os.getenv("CONTEXT_SUMMARY_CACHE_SIZE", "1024"))
+
+# Local tokenizer for token estimates: a tokenizer.json path or a Hugging Face
+# repo (e.g. mistralai/Mistral-Nemo-Instruct-2407). Unset: ~4 chars per token.
+TOKENIZER_PATH = os.getenv("TOKENIZER_PATH")
+TOKENIZER_REPO = os.getenv("TOKENIZER_REPO")
+
 # Default models exposed to frontend (Ollama format)
 AVAILABLE_MODELS = [
     {
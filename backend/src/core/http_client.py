@@ -0,0 +1,47 @@
+"""Shared upstream HTTP client"""
+
+import importlib.util
+
+import httpx
+import structlog
+
+from config import (
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_HTTP2,
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_MAX_CONNECTIONS,
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+    UPSTREAM_READ_TIMEOUT,
+)
+
+logger = structlog.get_logger(__name__)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Create the pooled, keep-alive client used for every upstream LLM call.
+
+    HTTP/2 needs the optional `h2` package; without it the client falls back
+    to HTTP/1.1 keep-alive instead of failing at startup.
+    """
+    http2 = UPSTREAM_HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP/2 requested but h2 is not installed, using HTTP/1.1")
+        http2 = False
+
+    client = httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+    )
+    logger.info(
+        "Upstream HTTP client created",
+        http2=http2,
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    return client
@@ -1,54 +1,294 @@
+import atexit
+import importlib.util
+import json
 import logging
 import os
+import random
+import sys
+import threading
+import uuid
+from functools import partial
+from logging.handlers import QueueHandler
+from queue import SimpleQueue
+from typing import TextIO
 
 import structlog
 from dotenv import load_dotenv
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 load_dotenv()
 
+# Log level name (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "console": colored, aligned, written synchronously (development).
+# "json": one JSON object per line, rendered and written by a background thread.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "console").lower()
+# JSON map of event name to the fraction of its occurrences to keep, e.g.
+# {"Chat completions request": 0.01}; kept events carry their sample_rate
+LOG_SAMPLING = json.loads(os.getenv("LOG_SAMPLING", "{}"))
 
-def setup_logging(level: int | None = logging.INFO) -> None:
+_handler: logging.Handler | None = None
+_writer: "_LogWriter | None" = None
+
+
+def _json_serializer():
+    """orjson when installed (several times faster), else the json module"""
+    if importlib.util.find_spec("orjson") is None:
+        return json.dumps
+    import orjson
+
+    def dumps(obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=str).decode()
+
+    return dumps
+
+
+def sample_events(rates: dict[str, float]) -> structlog.types.Processor:
+    """Processor keeping only a fraction of each listed event"""
+
+    def sample(logger, method_name, event_dict):
+        rate = rates.get(event_dict.get("event"))
+        if rate is None:
+            return event_dict
+        if random.random() >= rate:
+            raise structlog.DropEvent
+        event_dict["sample_rate"] = rate
+        return event_dict
+
+    return sample
+
+
+class _QueueHandler(QueueHandler):
+    """Hand stdlib records to the writer thread as they are
+
+    The stock handler formats each record before queueing it, i.e. on the
+    calling thread; here the writer formats it.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _QueueLogger:
+    """structlog logger queueing processed event dicts for the writer thread
+
+    Skips the stdlib logging machinery (record creation, caller lookup,
+    handler locks) that would otherwise run on the event loop for every event.
+    """
+
+    def __init__(self, queue: SimpleQueue, name: str = ""):
+        self._queue = queue
+        self.name = name
+
+    def msg(self, **event_dict) -> None:
+        self._queue.put(event_dict)
+
+    log = debug = info = warn = warning = error = critical = exception = fatal = msg
+
+
+class _LogWriter:
+    """Thread rendering queued events as JSON lines and writing them in batches"""
+
+    def __init__(self, stream: TextIO, render, formatter: logging.Formatter):
+        self.queue = SimpleQueue()
+        self.stream = stream
+        self.render = render
+        self.formatter = formatter
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _line(self, item: dict | logging.LogRecord) -> str:
+        if isinstance(item, logging.LogRecord):
+            return self.formatter.format(item) + "\n"
+        return self.render(None, None, item) + "\n"
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            lines = []
+            # Everything queued meanwhile goes out in the same write
+            while item is not None:
+                try:
+                    lines.append(self._line(item))
+                except Exception:
+                    lines.append(f"Unrenderable log event: {item!r}\n")
+                if self.queue.empty():
+                    break
+                item = self.queue.get()
+            if lines:
+                self.stream.write("".join(lines))
+                self.stream.flush()
+            if item is None:
+                return
+
+    def stop(self):
+        """Write out what is queued and end the thread"""
+        self.queue.put(None)
+        self._thread.join()
+
+
+def _level(level: int | str | None) -> int:
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(level or LOG_LEVEL)
+    return value if isinstance(value, int) else logging.INFO
+
+
+def setup_logging(
+    level: int | str | None = None,
+    fmt: str = None,
+    sample_rates: dict[str, float] = None,
+    stream: TextIO = None,
+) -> None:
     """
     Configure structured logging for the application.
 
     Args:
-        level: The logging level to use. Defaults to INFO.
+        level: The logging level to use. Defaults to LOG_LEVEL (INFO).
+        fmt: "console" or "json". Defaults to LOG_FORMAT.
+        sample_rates: Fraction of each event name to keep. Defaults to LOG_SAMPLING.
+        stream: Output stream. Defaults to stderr (console) or stdout (json).
+
+    In JSON mode, the calling thread only builds the event dict and queues
+    it; rendering and writing happen in a writer thread, so a slow or
+    blocked stdout never stalls the event loop. Records of other libraries
+    (uvicorn included) go through the same queue and renderer. Can be called
+    again to reconfigure.
     """
-    # Basic configuration
-    logging.basicConfig(level=level)
+    global _handler, _writer
+    level = _level(level)
+    fmt = fmt or LOG_FORMAT
+    sample_rates = LOG_SAMPLING if sample_rates is None else sample_rates
+
+    root = logging.getLogger()
+    flush_logging()
+    if _handler is not None:
+        root.removeHandler(_handler)
+    root.setLevel(level)
+
+    if fmt != "json":
+        _handler = logging.StreamHandler(stream)
+        _handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root.addHandler(_handler)
+
+        # Configure processors for structlog
+        processors = [
+            structlog.stdlib.filter_by_level,
+            structlog.contextvars.merge_contextvars,
+            structlog.processors.add_log_level,
+            structlog.processors.TimeStamper(fmt="iso"),
+            structlog.processors.StackInfoRenderer(),
+            structlog.processors.format_exc_info,
+            structlog.dev.ConsoleRenderer(
+                colors=True,
+                exception_formatter=structlog.dev.plain_traceback,
+                pad_event=50,  # For better alignment of logs
+            ),
+        ]
+        if sample_rates:
+            processors.insert(1, sample_events(sample_rates))
+
+        structlog.configure(
+            processors=processors,
+            wrapper_class=structlog.stdlib.BoundLogger,
+            logger_factory=structlog.stdlib.LoggerFactory(),
+            cache_logger_on_first_use=True,
+        )
+        return
+
+    timestamper = structlog.processors.TimeStamper(fmt="iso", utc=True)
+    render = structlog.processors.JSONRenderer(serializer=_json_serializer())
+    _writer = _LogWriter(
+        stream or sys.stdout,
+        render,
+        structlog.stdlib.ProcessorFormatter(
+            processors=[
+                structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+                structlog.processors.format_exc_info,
+                render,
+            ],
+            foreign_pre_chain=[
+                structlog.stdlib.add_log_level,
+                structlog.stdlib.add_logger_name,
+                timestamper,
+            ],
+        ),
+    )
+    # Records of other libraries take the same queue
+    _handler = _QueueHandler(_writer.queue)
+    root.addHandler(_handler)
+
+    # Uvicorn logs through its own handlers: send them through the queue too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(name)
+        logger.handlers = []
+        logger.propagate = True
 
-    # Configure processors for structlog
     processors = [
-        structlog.stdlib.filter_by_level,
         structlog.contextvars.merge_contextvars,
         structlog.processors.add_log_level,
-        structlog.processors.TimeStamper(fmt="iso"),
+        structlog.stdlib.add_logger_name,
+        timestamper,
         structlog.processors.StackInfoRenderer(),
+        # Tracebacks must be captured on the thread handling the exception
         structlog.processors.format_exc_info,
-        structlog.dev.ConsoleRenderer(
-            colors=True,
-            exception_formatter=structlog.dev.plain_traceback,
-            pad_event=50,  # For better alignment of logs
-        ),
     ]
+    if sample_rates:
+        processors.insert(0, sample_events(sample_rates))
 
     structlog.configure(
         processors=processors,
-        wrapper_class=structlog.stdlib.BoundLogger,
-        logger_factory=structlog.stdlib.LoggerFactory(),
+        # Calls below the level return right away, before any processing
+        wrapper_class=structlog.make_filtering_bound_logger(level),
+        logger_factory=partial(_QueueLogger, _writer.queue),
         cache_logger_on_first_use=True,
     )
 
 
-if os.getenv("LOG_LEVEL") == "INFO":
-    setup_logging(level=logging.INFO)
-elif os.getenv("LOG_LEVEL") == "DEBUG":
-    setup_logging(level=logging.DEBUG)
-elif os.getenv("LOG_LEVEL") == "WARNING":
-    setup_logging(level=logging.WARNING)
-elif os.getenv("LOG_LEVEL") == "ERROR":
-    setup_logging(level=logging.ERROR)
-elif os.getenv("LOG_LEVEL") == "CRITICAL":
-    setup_logging(level=logging.CRITICAL)
-else:
-    setup_logging(level=logging.INFO)
+def flush_logging() -> None:
+    """Write out every queued event (JSON mode) and stop the writer thread"""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+atexit.register(flush_logging)
+
+
+class RequestIdMiddleware:
+    """Bind a request id to every log event of a request
+
+    The id is the client's X-Request-Id when it sends a usable one, else a
+    new random id; it is echoed in the response headers. Bound through
+    contextvars, it also reaches tasks started while handling the request,
+    such as the body of a streaming response.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        if not request_id or len(request_id) > 128 or not request_id.isprintable():
+            request_id = uuid.uuid4().hex
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        with structlog.contextvars.bound_contextvars(request_id=request_id):
+            await self.app(scope, receive, send_with_id)
+
+
+setup_logging()
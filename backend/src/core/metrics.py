@@ -0,0 +1,465 @@
+"""In-process metrics with Prometheus text exposition
+
+Instruments are plain dicts keyed by label values and are only updated from
+the event loop, so recording a sample is a dict lookup and an addition: no
+locks, no allocations once a label set has been seen.
+
+With several uvicorn workers, each worker periodically writes a JSON snapshot
+of its instruments to a shared directory and /metrics sums the snapshots of
+the other workers with its own live values. Counters of workers that exited
+are folded into one retired snapshot and stay in the sums, so totals never go
+down; their gauges are dropped.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import time
+from bisect import bisect_left
+from collections.abc import Iterable
+from typing import Any
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+INTER_TOKEN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 35, 50, 75, 100, 150, 250)
+QUEUE_WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Weight of the latest completion in the per-model average completion length
+COMPLETION_SMOOTHING = 0.1
+
+
+class Counter:
+    """Monotonic counter"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Counter):
+    """Value that goes up and down"""
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+
+class Histogram(Counter):
+    """Bucketed distribution
+
+    Each label set holds one count per bucket (non-cumulative, +Inf last)
+    followed by the sum of observed values.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        self.values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+
+def _label_pairs(labelnames: tuple[str, ...], labels: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class StreamTimer:
+    """Latency tracking of one streamed completion"""
+
+    def __init__(self, metrics: "Metrics", endpoint: str, model: str, start: float = None):
+        self.metrics = metrics
+        self.labels = (endpoint, model)
+        self.start = start or time.perf_counter()
+        self.first: float | None = None
+        self.last = self.start
+        metrics.active_streams.inc(*self.labels)
+
+    def token(self):
+        """Record a delta sent to the client"""
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+            self.metrics.time_to_first_token.observe(now - self.start, *self.labels)
+        else:
+            self.metrics.inter_token_latency.observe(now - self.last, *self.labels)
+        self.last = now
+
+    def finish(self, completion_tokens: int = 0):
+        """Record the end of the stream, successful or not"""
+        self.metrics.active_streams.dec(*self.labels)
+        self.metrics.stream_duration.observe(time.perf_counter() - self.start, *self.labels)
+        if completion_tokens and self.first is not None and self.last > self.first:
+            self.metrics.tokens_per_second.observe(
+                completion_tokens / (self.last - self.first), *self.labels
+            )
+
+
+class Metrics:
+    """Application instruments"""
+
+    def __init__(self, namespace: str = "kairn"):
+        labels = ("endpoint", "model")
+        self.requests = Counter(
+            f"{namespace}_requests_total", "Completion requests", (*labels, "stream")
+        )
+        self.request_duration = Histogram(
+            f"{namespace}_request_duration_seconds", "Non-streaming completion latency", labels
+        )
+        self.time_to_first_token = Histogram(
+            f"{namespace}_time_to_first_token_seconds", "Time to the first streamed delta", labels
+        )
+        self.inter_token_latency = Histogram(
+            f"{namespace}_inter_token_latency_seconds",
+            "Time between streamed deltas",
+            labels,
+            INTER_TOKEN_BUCKETS,
+        )
+        self.stream_duration = Histogram(
+            f"{namespace}_stream_duration_seconds", "Total duration of streams", labels
+        )
+        self.tokens_per_second = Histogram(
+            f"{namespace}_tokens_per_second",
+            "Completion tokens per second of generation",
+            labels,
+            TOKENS_PER_SECOND_BUCKETS,
+        )
+        self.tokens = Counter(
+            f"{namespace}_tokens_total", "Tokens of served completions", (*labels, "type")
+        )
+        self.active_streams = Gauge(f"{namespace}_active_streams", "Streams in progress", labels)
+        self.stream_cancellations = Counter(
+            f"{namespace}_stream_cancellations_total",
+            "Streams stopped because the client disconnected",
+            labels,
+        )
+        self.stream_tokens_saved = Counter(
+            f"{namespace}_stream_tokens_saved_total",
+            "Completion tokens not generated thanks to cancelled streams (estimate)",
+            labels,
+        )
+        self.cache_lookups = Counter(
+            f"{namespace}_cache_lookups_total",
+            "Response cache lookups",
+            (*labels, "cache", "result"),
+        )
+        self.upstream_errors = Counter(
+            f"{namespace}_upstream_errors_total",
+            "Failed upstream calls",
+            ("provider", "model", "type"),
+        )
+        self.upstream_failovers = Counter(
+            f"{namespace}_upstream_failovers_total",
+            "Calls moved to another backend after a failure",
+            ("provider", "model"),
+        )
+        self.hedged_streams = Counter(
+            f"{namespace}_hedged_streams_total",
+            "Streams raced against a hedge request, by winner",
+            ("model", "winner"),
+        )
+        self.admission_queue_depth = Gauge(
+            f"{namespace}_admission_queue_depth", "Requests waiting for a slot", ("model",)
+        )
+        self.admission_wait = Histogram(
+            f"{namespace}_admission_wait_seconds",
+            "Time from arrival to admission",
+            ("model",),
+            QUEUE_WAIT_BUCKETS,
+        )
+        self.admission_rejections = Counter(
+            f"{namespace}_admission_rejections_total",
+            "Requests shed by admission control",
+            ("model", "reason"),
+        )
+        self.context_dropped_tokens = Counter(
+            f"{namespace}_context_dropped_tokens_total",
+            "History tokens trimmed to fit the model's budget",
+            ("model",),
+        )
+        self.context_summaries = Counter(
+            f"{namespace}_context_summaries_total",
+            "Summaries of trimmed history, by cache result",
+            ("model", "result"),
+        )
+        self.jobs = Counter(
+            f"{namespace}_jobs_total", "Finished asynchronous jobs", ("model", "status")
+        )
+        self.instruments: list[Counter] = [
+            value for value in vars(self).values() if isinstance(value, Counter)
+        ]
+        # Moving average of completion tokens per model, to estimate what a
+        # cancelled stream would still have generated
+        self._completion_tokens: dict[str, float] = {}
+
+    def track_stream(self, endpoint: str, model: str, start: float = None) -> StreamTimer:
+        """
+        Start timing a stream; call finish() on the result when it ends.
+
+        Args:
+            endpoint: Endpoint label.
+            model: Model label.
+            start: time.perf_counter() of the request's arrival, so the time
+                to first token includes everything before the stream opened.
+        """
+        return StreamTimer(self, endpoint, model, start)
+
+    def record_usage(
+        self,
+        endpoint: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cached_tokens: int = 0,
+    ):
+        """Count the tokens of a served completion
+
+        Cached tokens are the part of the prompt tokens the provider read from
+        its prefix cache.
+        """
+        self.tokens.inc(endpoint, model, "prompt", amount=prompt_tokens)
+        self.tokens.inc(endpoint, model, "completion", amount=completion_tokens)
+        if cached_tokens:
+            self.tokens.inc(endpoint, model, "cached", amount=cached_tokens)
+        if completion_tokens:
+            average = self._completion_tokens.get(model)
+            self._completion_tokens[model] = (
+                completion_tokens
+                if average is None
+                else average + COMPLETION_SMOOTHING * (completion_tokens - average)
+            )
+
+    def record_stream_cancelled(
+        self, endpoint: str, model: str, generated: int, max_tokens: int
+    ) -> int:
+        """
+        Count a stream cut short by its client and the tokens it did not use.
+
+        The saving is estimated as the model's average completion length,
+        capped by max_tokens, minus what was generated before the cut; it is
+        0 until a completion of the model has been recorded.
+
+        Returns:
+            The estimated number of completion tokens saved.
+        """
+        self.stream_cancellations.inc(endpoint, model)
+        expected = min(self._completion_tokens.get(model, 0), max_tokens)
+        saved = max(0, round(expected) - generated)
+        self.stream_tokens_saved.inc(endpoint, model, amount=saved)
+        return saved
+
+    def record_cache_lookup(self, endpoint: str, model: str, cache: str, hit: bool):
+        self.cache_lookups.inc(endpoint, model, cache, "hit" if hit else "miss")
+
+    def snapshot(self) -> dict[str, list]:
+        """JSON-serializable copy of every instrument"""
+        return {
+            instrument.name: [[list(labels), value] for labels, value in instrument.values.items()]
+            for instrument in self.instruments
+        }
+
+    def render(self, snapshots: Iterable[dict[str, list]] = ()) -> str:
+        """Prometheus text format of the live values plus other workers' snapshots"""
+        merged = {instrument.name: dict(instrument.values) for instrument in self.instruments}
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                if name in merged:
+                    _add_samples(merged[name], samples)
+
+        lines = []
+        for instrument in self.instruments:
+            lines.append(f"# HELP {instrument.name} {instrument.documentation}")
+            lines.append(f"# TYPE {instrument.name} {instrument.kind}")
+            for labels, value in merged[instrument.name].items():
+                if isinstance(instrument, Histogram):
+                    lines.extend(self._render_histogram(instrument, labels, value))
+                else:
+                    label_text = _label_pairs(instrument.labelnames, labels)
+                    lines.append(f"{instrument.name}{label_text} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histogram(histogram: Histogram, labels: tuple, counts: list) -> list[str]:
+        lines = []
+        cumulative = 0
+        bounds = [*(_number(bound) for bound in histogram.buckets), "+Inf"]
+        for bound, count in zip(bounds, counts[:-1], strict=True):
+            cumulative += count
+            label_text = _label_pairs(histogram.labelnames, labels, f'le="{bound}"')
+            lines.append(f"{histogram.name}_bucket{label_text} {_number(cumulative)}")
+        label_text = _label_pairs(histogram.labelnames, labels)
+        lines.append(f"{histogram.name}_sum{label_text} {_number(counts[-1])}")
+        lines.append(f"{histogram.name}_count{label_text} {_number(cumulative)}")
+        return lines
+
+
+def _add_samples(values: dict[tuple, Any], samples: list):
+    """Add snapshot samples to instrument values keyed by label values"""
+    for labels, value in samples:
+        labels = tuple(labels)
+        current = values.get(labels)
+        if current is None:
+            values[labels] = value
+        elif isinstance(current, list):
+            values[labels] = [a + b for a, b in zip(current, value, strict=True)]
+        else:
+            values[labels] = current + value
+
+
+class MetricsSnapshotter:
+    """Share this worker's metrics with the other workers through a directory
+
+    On shutdown a worker's counters and histograms are added to the retired
+    snapshot, which is still summed (as in prometheus_client's multiprocess
+    mode): a total dropping when a worker exits would look like a counter
+    reset to Prometheus. One file holds every exited worker, so scrapes do
+    not slow down as workers come and go.
+    """
+
+    def __init__(self, metrics: Metrics, directory: str, interval: float = 5.0):
+        self.metrics = metrics
+        self.directory = directory
+        self.interval = interval
+        self.path = os.path.join(directory, f"worker-{os.getpid()}.json")
+        self.gauges = {
+            instrument.name for instrument in metrics.instruments if instrument.kind == "gauge"
+        }
+        self._task: asyncio.Task | None = None
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self):
+        """Atomically replace this worker's snapshot file"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.metrics.snapshot(), f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def retire(self):
+        """Fold this worker's last snapshot into the retired totals and remove it"""
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Dropping unreadable metrics snapshot", path=self.path, error=str(e))
+            os.remove(self.path)
+            return
+        retired_path = os.path.join(self.directory, "retired.json")
+        # Exiting workers may retire at the same time: serialize the read-modify-write
+        with open(os.path.join(self.directory, "retired.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            totals: dict[str, dict[tuple, Any]] = {}
+            try:
+                with open(retired_path) as f:
+                    snapshots = [json.load(f), snapshot]
+            except FileNotFoundError:
+                snapshots = [snapshot]
+            for retired in snapshots:
+                for name, samples in retired.items():
+                    if name not in self.gauges:
+                        _add_samples(totals.setdefault(name, {}), samples)
+            tmp_path = f"{retired_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {
+                        name: [[list(labels), value] for labels, value in values.items()]
+                        for name, values in totals.items()
+                    },
+                    f,
+                    separators=(",", ":"),
+                )
+            os.replace(tmp_path, retired_path)
+            os.remove(self.path)
+
+    def others(self) -> list[dict[str, list]]:
+        """Snapshots of the other workers
+
+        Retired snapshots, and those not refreshed for three intervals (of
+        workers that died without retiring theirs), only count with their
+        counters and histograms.
+        """
+        snapshots = []
+        oldest = time.time() - 3 * self.interval
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json") or entry.path == self.path:
+                continue
+            try:
+                live = entry.name.startswith("worker-") and entry.stat().st_mtime >= oldest
+                with open(entry.path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.debug("Skipping unreadable metrics snapshot", path=entry.path, error=str(e))
+                continue
+            if not live:
+                snapshot = {
+                    name: samples for name, samples in snapshot.items() if name not in self.gauges
+                }
+            snapshots.append(snapshot)
+        return snapshots
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                logger.warning("Failed to write metrics snapshot", path=self.path, error=str(e))
+
+    def start(self):
+        # A file with our name was left by a dead worker with the same pid
+        self.retire()
+        self.write()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop publishing and retire this worker's final snapshot"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            self.write()
+        except OSError as e:
+            logger.warning("Failed to write metrics snapshot", path=self.path, error=str(e))
+        self.retire()
@@ -0,0 +1,188 @@
+"""OpenTelemetry tracing: opt-in, head-sampled, exported in the background
+
+Spans of a traced request:
+- `POST /v1/chat/completions` (server span, from TracingMiddleware), with a
+  `request parsed` event once the body is validated
+- `cache.lookup`, `admission`, `llm.get_agent`
+- the upstream HTTP request (httpx instrumentation: connect and headers)
+  and the model request (pydantic-ai instrumentation, without content)
+- `chat.stream` or `chat.completion`, with the first token and the
+  following deltas as events
+
+With tracing disabled, no provider is installed and every span is the
+OpenTelemetry API's no-op span.
+"""
+
+import structlog
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, SpanLimits, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import (
+    TRACING_ENABLED,
+    TRACING_EXPORTER,
+    TRACING_FILE,
+    TRACING_MAX_TOKEN_EVENTS,
+    TRACING_SAMPLE_RATE,
+    TRACING_SERVICE_NAME,
+)
+
+logger = structlog.get_logger(__name__)
+
+tracer = trace.get_tracer("kairn")
+
+
+class FileSpanExporter(ConsoleSpanExporter):
+    """Spans appended to a file, one JSON object per line"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf-8")
+        super().__init__(out=self.file, formatter=self.line)
+
+    @staticmethod
+    def line(span: ReadableSpan) -> str:
+        return span.to_json(indent=None) + "\n"
+
+    def shutdown(self):
+        self.file.close()
+
+
+def create_exporter(kind: str = TRACING_EXPORTER, path: str = TRACING_FILE) -> SpanExporter:
+    """
+    Span exporter by name.
+
+    "otlp" sends OTLP over HTTP to OTEL_EXPORTER_OTLP_ENDPOINT (default: a
+    collector on localhost:4318); "file" appends JSON lines to `path`.
+    """
+    if kind == "file":
+        return FileSpanExporter(path)
+    if kind == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter()
+    raise ValueError(f"Unknown TRACING_EXPORTER: {kind}")
+
+
+def create_tracer_provider(
+    exporter: SpanExporter, sample_rate: float = TRACING_SAMPLE_RATE
+) -> TracerProvider:
+    """
+    Provider exporting in batches from a background thread.
+
+    Head sampling: a trace is kept or dropped when its root span starts, and
+    child spans, including those of a caller sending `traceparent`, follow
+    that decision, so dropped requests cost almost nothing.
+    """
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(sample_rate)),
+        # The SDK keeps the last 128 events of a span by default, which would
+        # drop the first token of long streams
+        span_limits=SpanLimits(max_events=TRACING_MAX_TOKEN_EVENTS + 16),
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    return provider
+
+
+def setup_tracing(http_client) -> TracerProvider | None:
+    """Install the tracer provider and instrument upstream calls, if enabled"""
+    if not TRACING_ENABLED:
+        return None
+    from opentelemetry.instrumentation.httpx import HTTPXClientInstrumentor
+    from pydantic_ai import Agent
+    from pydantic_ai.models.instrumented import InstrumentationSettings
+
+    provider = create_tracer_provider(create_exporter())
+    trace.set_tracer_provider(provider)
+    HTTPXClientInstrumentor.instrument_client(http_client, tracer_provider=provider)
+    # Model request spans, without prompts or answers
+    Agent.instrument_all(InstrumentationSettings(tracer_provider=provider, include_content=False))
+    logger.info(
+        "Tracing enabled",
+        exporter=TRACING_EXPORTER,
+        sample_rate=TRACING_SAMPLE_RATE,
+    )
+    return provider
+
+
+class TracingMiddleware:
+    """Server span around each HTTP request
+
+    Continues the caller's trace when it sends a W3C `traceparent` header.
+    The span is named after the matched route once it is known.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        carrier = {
+            name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]
+        }
+        method = scope["method"]
+        with tracer.start_as_current_span(
+            f"{method} {scope['path']}",
+            context=propagate.extract(carrier),
+            kind=SpanKind.SERVER,
+            attributes={"http.request.method": method, "url.path": scope["path"]},
+        ) as span:
+
+            async def send_traced(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    route = scope.get("route")
+                    if route is not None:
+                        span.update_name(f"{method} {route.path}")
+                        span.set_attribute("http.route", route.path)
+                    span.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            await self.app(scope, receive, send_traced)
+
+
+def mark_parsed():
+    """Event on the request span: body validated, route handler starting"""
+    trace.get_current_span().add_event("request parsed")
+
+
+class StreamSpan:
+    """Span of a streamed completion, with the delta timings as events
+
+    The first delta is a `first_token` event; later ones are `token` events
+    up to TRACING_MAX_TOKEN_EVENTS, after which they are only counted, to
+    keep spans bounded. Started explicitly rather than as the current span,
+    since the stream is an async generator.
+    """
+
+    def __init__(self, name: str, attributes: dict):
+        self.span = tracer.start_span(name, attributes=attributes)
+        self.recording = self.span.is_recording()
+        self.chunks = 0
+
+    def token(self, content: str):
+        self.chunks += 1
+        if not self.recording:
+            return
+        if self.chunks == 1:
+            self.span.add_event("first_token", {"chars": len(content)})
+        elif self.chunks <= TRACING_MAX_TOKEN_EVENTS:
+            self.span.add_event("token", {"index": self.chunks, "chars": len(content)})
+
+    def finish(self, outcome: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        """End the span; outcome is completed, cancelled or error"""
+        if self.recording:
+            self.span.set_attribute("stream.outcome", outcome)
+            self.span.set_attribute("stream.chunks", self.chunks)
+            self.span.set_attribute("gen_ai.usage.input_tokens", prompt_tokens)
+            self.span.set_attribute("gen_ai.usage.output_tokens", completion_tokens)
+            if outcome == "error":
+                self.span.set_status(Status(StatusCode.ERROR))
+        self.span.end()
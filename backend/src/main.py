@@ -1,22 +1,202 @@
 """FastAPI application entry point"""
 
+import math
+from contextlib import asynccontextmanager
+
 import structlog
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 
+from api.batch_routes import router as batch_router
+from api.job_routes import job_runner
+from api.job_routes import router as job_router
+from api.ollama_routes import router as ollama_router
 from api.openai_routes import router as openai_router
-from config import CORS_ORIGINS, MISTRAL_API_KEY
-from core.logger import setup_logging
+from config import (
+    ADMISSION_ENABLED,
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_MAX_WAIT,
+    ADMISSION_MODEL_CONCURRENCY,
+    BATCH_DB_PATH,
+    BATCH_RETENTION,
+    CONVERSATIONS_DB_PATH,
+    CONVERSATIONS_ENABLED,
+    CONVERSATIONS_TTL,
+    CORS_ORIGINS,
+    JOBS_CONCURRENCY,
+    JOBS_DB_PATH,
+    JOBS_POLL_INTERVAL,
+    JOBS_RETENTION,
+    METRICS_MULTIPROC_DIR,
+    METRICS_SNAPSHOT_INTERVAL,
+    MISTRAL_API_KEY,
+    MODELS_DISCOVERY_INTERVAL,
+    RATE_LIMIT_DB_PATH,
+    RESPONSE_CACHE_DB_MAX_ENTRIES,
+    RESPONSE_CACHE_DB_PATH,
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_SAMPLED,
+    RESPONSE_CACHE_TTL,
+    SEMANTIC_CACHE_CAPACITY,
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_MODEL,
+    SEMANTIC_CACHE_PATH,
+    SEMANTIC_CACHE_THRESHOLD,
+    SINGLEFLIGHT_ENABLED,
+    TOKENIZER_PATH,
+    TOKENIZER_REPO,
+    TRACING_ENABLED,
+    UPSTREAM_RPM,
+    UPSTREAM_TPM,
+    WEB_CONCURRENCY,
+)
+from core.logger import RequestIdMiddleware, setup_logging
+from core.metrics import CONTENT_TYPE, Metrics, MetricsSnapshotter
+from core.tracing import TracingMiddleware, setup_tracing
+from services.admission import AdmissionController, AdmissionRejected
+from services.batch import BatchStore
+from services.conversations import ConversationStore
+from services.jobs import JobQueue, JobStore
+from services.model_catalog import ModelCatalog, configured_providers, provider_endpoints
+from services.registry import LLMServiceRegistry
+from services.response_cache import ResponseCache
+from services.semantic_cache import SemanticCache, StaticEmbedder
+from services.singleflight import SingleFlight
+from services.tokens import TokenEstimator
 
 # Setup structured logging
 setup_logging()
 logger = structlog.get_logger(__name__)
 
+
+def worker_share(limit: int) -> int:
+    """This worker's part of a host-wide limit"""
+    return max(1, math.ceil(limit / WEB_CONCURRENCY))
+
+
+def create_semantic_cache() -> SemanticCache | None:
+    """Load the embedding model and index, or disable the stage if unavailable"""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    try:
+        embedder = StaticEmbedder.from_pretrained(SEMANTIC_CACHE_MODEL)
+    except Exception as e:
+        logger.warning(
+            "Semantic cache disabled, embedding model unavailable",
+            model=SEMANTIC_CACHE_MODEL,
+            error=str(e),
+        )
+        return None
+    path = SEMANTIC_CACHE_PATH
+    if path and WEB_CONCURRENCY > 1:
+        # The index is written in place and cannot be shared between processes
+        logger.warning("Semantic cache kept in memory with several workers", path=path)
+        path = None
+    return SemanticCache(
+        embedder,
+        embedder.dim,
+        path=path,
+        capacity=SEMANTIC_CACHE_CAPACITY,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Own application-scoped state for the lifetime of the process"""
+    app.state.metrics = Metrics()
+    app.state.metrics_snapshotter = (
+        MetricsSnapshotter(app.state.metrics, METRICS_MULTIPROC_DIR, METRICS_SNAPSHOT_INTERVAL)
+        if METRICS_MULTIPROC_DIR
+        else None
+    )
+    if app.state.metrics_snapshotter is not None:
+        app.state.metrics_snapshotter.start()
+    app.state.token_estimator = TokenEstimator.load(TOKENIZER_PATH, TOKENIZER_REPO)
+    app.state.llm_registry = LLMServiceRegistry(
+        metrics=app.state.metrics, estimator=app.state.token_estimator
+    )
+    app.state.tracer_provider = setup_tracing(app.state.llm_registry.http_client)
+    app.state.model_catalog = ModelCatalog(
+        endpoints=provider_endpoints(configured_providers()),
+        http_client=app.state.llm_registry.http_client,
+        interval=MODELS_DISCOVERY_INTERVAL,
+        router=app.state.llm_registry.router,
+    )
+    app.state.model_catalog.start()
+    app.state.response_cache = (
+        ResponseCache(
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            ttl=RESPONSE_CACHE_TTL,
+            db_path=RESPONSE_CACHE_DB_PATH,
+            cache_sampled=RESPONSE_CACHE_SAMPLED,
+            max_db_entries=RESPONSE_CACHE_DB_MAX_ENTRIES,
+        )
+        if RESPONSE_CACHE_ENABLED
+        else None
+    )
+    app.state.semantic_cache = create_semantic_cache()
+    app.state.single_flight = SingleFlight() if SINGLEFLIGHT_ENABLED else None
+    app.state.admission = (
+        AdmissionController(
+            max_concurrency=worker_share(ADMISSION_MAX_CONCURRENCY),
+            model_limits={
+                model: worker_share(limit) for model, limit in ADMISSION_MODEL_CONCURRENCY.items()
+            },
+            max_queue=worker_share(ADMISSION_MAX_QUEUE),
+            max_wait=ADMISSION_MAX_WAIT,
+            rpm=UPSTREAM_RPM,
+            tpm=UPSTREAM_TPM,
+            shared_db=RATE_LIMIT_DB_PATH,
+            metrics=app.state.metrics,
+        )
+        if ADMISSION_ENABLED
+        else None
+    )
+    app.state.conversations = (
+        ConversationStore(CONVERSATIONS_DB_PATH, CONVERSATIONS_TTL)
+        if CONVERSATIONS_ENABLED
+        else None
+    )
+    app.state.batch_store = BatchStore(BATCH_DB_PATH, retention=BATCH_RETENTION)
+    app.state.jobs = JobQueue(
+        JobStore(JOBS_DB_PATH),
+        job_runner(app.state),
+        concurrency=JOBS_CONCURRENCY,
+        poll_interval=JOBS_POLL_INTERVAL,
+        retention=JOBS_RETENTION,
+        metrics=app.state.metrics,
+    )
+    app.state.jobs.start()
+    yield
+    await app.state.jobs.stop()
+    app.state.batch_store.close()
+    if app.state.conversations is not None:
+        app.state.conversations.close()
+    if app.state.admission is not None:
+        app.state.admission.close()
+    if app.state.semantic_cache is not None:
+        app.state.semantic_cache.close()
+    if app.state.response_cache is not None:
+        app.state.response_cache.close()
+    await app.state.model_catalog.stop()
+    await app.state.llm_registry.aclose()
+    if app.state.tracer_provider is not None:
+        # Export the spans still buffered
+        app.state.tracer_provider.shutdown()
+    if app.state.metrics_snapshotter is not None:
+        await app.state.metrics_snapshotter.stop()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="French Sovereign Chatbot Backend",
     description="OpenAI-compatible API for Mistral AI",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS middleware
@@ -28,8 +208,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request id bound to every log event of the request
+app.add_middleware(RequestIdMiddleware)
+if TRACING_ENABLED:
+    # Added last, so outermost: the server span covers the whole request
+    app.add_middleware(TracingMiddleware)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """Shed load with an OpenAI-style rate limit error"""
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+        content={
+            "error": {
+                "message": str(exc),
+                "type": "rate_limit_error",
+                "code": "rate_limit_exceeded",
+            }
+        },
+    )
+
+
 # Include routers
 app.include_router(openai_router)
+app.include_router(ollama_router)
+app.include_router(batch_router)
+app.include_router(job_router)
 
 logger.info(
     "FastAPI application initialized",
@@ -52,7 +258,27 @@ async def root():
 @app.get("/health")
 async def health():
     """Detailed health check"""
-    return {"status": "healthy", "api": {"mistral": bool(MISTRAL_API_KEY)}}
+    return {
+        "status": "healthy",
+        "api": {"mistral": bool(MISTRAL_API_KEY)},
+        "agents": app.state.llm_registry.stats(),
+        "backends": app.state.llm_registry.router.stats(),
+        "models": app.state.model_catalog.stats(),
+        "response_cache": app.state.response_cache and app.state.response_cache.stats(),
+        "semantic_cache": app.state.semantic_cache and app.state.semantic_cache.stats(),
+        "single_flight": app.state.single_flight and app.state.single_flight.stats(),
+        "admission": app.state.admission and app.state.admission.stats(),
+        "jobs": app.state.jobs.stats(),
+        "conversations": app.state.conversations and app.state.conversations.stats(),
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics, aggregated over all workers in multi-worker mode"""
+    snapshotter = app.state.metrics_snapshotter
+    snapshots = snapshotter.others() if snapshotter is not None else ()
+    return Response(app.state.metrics.render(snapshots), media_type=CONTENT_TYPE)
 
 
 if __name__ == "__main__":
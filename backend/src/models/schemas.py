@@ -10,6 +10,12 @@ class Message(BaseModel):
     content: str = Field(..., description="Message content")
 
 
+class StreamOptions(BaseModel):
+    """OpenAI streaming options"""
+
+    include_usage: bool = Field(default=False, description="Send a final usage chunk")
+
+
 class ChatRequest(BaseModel):
     """OpenAI-compatible chat completions request"""
 
@@ -18,6 +24,41 @@ class ChatRequest(BaseModel):
     stream: bool = Field(default=True, description="Stream response")
     temperature: float = Field(default=0.7, ge=0.0, le=2.0)
     max_tokens: int = Field(default=4096, ge=1, le=32000)
+    stream_options: StreamOptions | None = Field(default=None)
+    conversation_id: str | None = Field(
+        default=None, description="Server-side conversation continued by these messages"
+    )
+    prefix: str | None = Field(
+        default=None, description="Id of stored earlier messages, sent instead of them"
+    )
+
+
+class OllamaOptions(BaseModel):
+    """Ollama model options; only the sampling settings the providers share are used"""
+
+    temperature: float = Field(default=0.7, ge=0.0, le=2.0)
+    num_predict: int | None = Field(
+        default=None, description="Maximum tokens to generate, -1 or unset for the default"
+    )
+
+
+class OllamaChatRequest(BaseModel):
+    """Ollama /api/chat request"""
+
+    model: str = Field(default="mistral-large", description="Model name")
+    messages: list[Message] = Field(..., description="Conversation history")
+    stream: bool = Field(default=True, description="Stream NDJSON lines")
+    options: OllamaOptions = Field(default_factory=OllamaOptions)
+
+
+class OllamaGenerateRequest(BaseModel):
+    """Ollama /api/generate request"""
+
+    model: str = Field(default="mistral-large", description="Model name")
+    prompt: str = Field(..., description="Prompt")
+    system: str | None = Field(default=None, description="Extra system instructions")
+    stream: bool = Field(default=True, description="Stream NDJSON lines")
+    options: OllamaOptions = Field(default_factory=OllamaOptions)
 
 
 class HealthResponse(BaseModel):
@@ -1,5 +1,5 @@
 """Prompts système pour les LLMs"""
 
-from .system_prompts import DEFAULT_SYSTEM_PROMPT
+from .system_prompts import DEFAULT_SYSTEM_PROMPT, SUMMARY_PROMPT
 
-__all__ = ["DEFAULT_SYSTEM_PROMPT"]
+__all__ = ["DEFAULT_SYSTEM_PROMPT", "SUMMARY_PROMPT"]
@@ -79,3 +79,11 @@ You are experienced in:
 ### Summary
 You are **Kairn**, the **European Sovereign Cloud Assistant**—a **neutral, technically rigorous, and sovereignty-aware guide** who listens first, reasons with evidence, and helps teams make **smart, verifiable cloud decisions** with **clarity, privacy, and pragmatism**.
 """
+
+
+SUMMARY_PROMPT = """
+Summarize the conversation below so that it can replace it as context for the rest of the chat.
+Keep facts, decisions, constraints, names, numbers and open questions; drop greetings and repetition.
+If a previous summary is given, update it with the new messages.
+Answer with the summary only, in the language of the conversation.
+"""
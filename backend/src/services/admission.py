@@ -0,0 +1,380 @@
+"""Admission control: per-model concurrency limits, queueing and rate budgets"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import sqlite3
+import time
+from collections.abc import AsyncGenerator, Awaitable, Callable, Iterator
+from contextlib import aclosing, contextmanager
+
+import structlog
+
+from core.metrics import Metrics
+from services.llm_service import Completion
+from services.tokens import TokenUsage
+
+logger = structlog.get_logger(__name__)
+
+# Weight of the latest sample in the moving average of slot hold times
+HOLD_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """The request cannot be admitted soon enough and should be retried later"""
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))  # Whole seconds, for Retry-After
+        super().__init__(f"Request rejected ({reason}), retry after {self.retry_after}s")
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously
+
+    Reservations may drive the level negative; the deficit tells how long
+    the caller must wait before its reservation is covered, so concurrent
+    callers are served in order without a lock.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = self._now()
+
+    @staticmethod
+    def _now() -> float:
+        return time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket and return the seconds until it is covered"""
+        now = self._now()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount: float):
+        """Give back part of a reservation that was not used"""
+        self.level = min(self.capacity, self.level + amount)
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket whose level is shared by the worker processes of a host
+
+    The level lives in a SQLite file; each reservation is one short
+    immediate transaction, so the workers draw from a single budget.
+    Reservations run on the event loop, so they never wait for another
+    worker's lock: while the file is busy, this worker uses the level it
+    last saw and carries the change over to the next transaction.
+    """
+
+    def __init__(self, per_minute: float, db_path: str, name: str):
+        super().__init__(per_minute)
+        self.name = name
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets "
+            "(name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute(
+            "INSERT OR IGNORE INTO token_buckets (name, level, updated) VALUES (?, ?, ?)",
+            (name, self.level, self.updated),
+        )
+        self._db.execute("PRAGMA busy_timeout=0")  # Setup may wait, reservations may not
+        self._pending = 0.0  # Net amount taken while the file was busy
+
+    @staticmethod
+    def _now() -> float:
+        return time.time()  # Comparable across processes
+
+    @contextmanager
+    def _shared(self, taken: float) -> Iterator[None]:
+        """Load the shared level, let the caller take from it, and store it back"""
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # Locked by another worker: go on locally rather than block the loop
+            self._pending += taken
+            yield
+            return
+        try:
+            level, self.updated = self._db.execute(
+                "SELECT level, updated FROM token_buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            self.level = min(self.capacity, level - self._pending)
+            yield
+            self._db.execute(
+                "UPDATE token_buckets SET level = ?, updated = ? WHERE name = ?",
+                (self.level, self.updated, self.name),
+            )
+            self._db.execute("COMMIT")
+            self._pending = 0.0
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def reserve(self, amount: float) -> float:
+        with self._shared(min(amount, self.capacity)):
+            return super().reserve(amount)
+
+    def refund(self, amount: float):
+        with self._shared(-amount):
+            super().refund(amount)
+
+    def close(self):
+        self._db.close()
+
+
+class _Pool:
+    """Concurrency slots and waiting queue of one upstream model"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters: list[list] = []  # Heap of [-priority, sequence, future]
+        self.hold_time = 1.0  # Moving average of seconds a slot is held
+
+
+class Admission:
+    """A granted slot; release it exactly once when the upstream call ends"""
+
+    def __init__(self, controller: "AdmissionController", model: str, tokens: int):
+        self.controller = controller
+        self.model = model
+        self.tokens = tokens
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self, used_tokens: int = None):
+        """
+        Free the slot. Safe to call more than once.
+
+        Args:
+            used_tokens: Tokens actually consumed; the unused part of the
+                reservation is returned to the tokens-per-minute budget.
+        """
+        if self.released:
+            return
+        self.released = True
+        if used_tokens is not None and self.controller.tpm is not None:
+            self.controller.tpm.refund(max(0, self.tokens - used_tokens))
+        self.controller._release(self.model, time.monotonic() - self.admitted_at)
+
+
+async def hold_during(
+    stream: AsyncGenerator[str, None], admission: Admission, usage: TokenUsage
+) -> AsyncGenerator[str, None]:
+    """Keep the admission for as long as the upstream stream runs"""
+    try:
+        async with aclosing(stream):
+            async for delta in stream:
+                yield delta
+    finally:
+        admission.release(usage.total_tokens)
+
+
+async def run_admitted(
+    admission: "AdmissionController | None",
+    model: str,
+    call: Callable[[], Awaitable[Completion]],
+    priority: int = 0,
+    tokens: int = 0,
+) -> Completion:
+    """
+    Run a background completion under admission control.
+
+    Unlike interactive requests, which get a 429, rejected background work
+    waits for the suggested delay and tries again.
+    """
+    ticket = None
+    while admission is not None and ticket is None:
+        try:
+            ticket = await admission.acquire(model, priority=priority, tokens=tokens)
+        except AdmissionRejected as e:
+            await asyncio.sleep(e.retry_after)
+    completion = None
+    try:
+        completion = await call()
+    finally:
+        if ticket is not None:
+            ticket.release(completion and completion.usage.total_tokens)
+    return completion
+
+
+class AdmissionController:
+    """Bound upstream concurrency per model and pace calls to upstream budgets
+
+    Each upstream model has a fixed number of slots. Requests beyond that wait
+    in a priority queue (higher priority first, FIFO within a priority) for at
+    most max_wait seconds. Once a slot is granted, the requests-per-minute and
+    tokens-per-minute buckets are charged; a request that would have to wait
+    past its deadline for budget is rejected instead. When the queue is full,
+    requests are shed immediately.
+
+    Slots are per process. With shared_db, the rate buckets are shared by
+    every worker process using that file.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        model_limits: dict[str, int] = None,
+        max_queue: int = 256,
+        max_wait: float = 30.0,
+        rpm: int = 0,
+        tpm: int = 0,
+        shared_db: str = None,
+        metrics: Metrics = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_limits = model_limits or {}
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.rpm = self._bucket("rpm", rpm, shared_db)
+        self.tpm = self._bucket("tpm", tpm, shared_db)
+        self.metrics = metrics
+        self._pools: dict[str, _Pool] = {}
+        self._sequence = itertools.count()
+
+    @staticmethod
+    def _bucket(name: str, per_minute: int, shared_db: str | None) -> TokenBucket | None:
+        if per_minute <= 0:
+            return None
+        if shared_db:
+            return SharedTokenBucket(per_minute, shared_db, name)
+        return TokenBucket(per_minute)
+
+    def _pool(self, model: str) -> _Pool:
+        pool = self._pools.get(model)
+        if pool is None:
+            pool = _Pool(self.model_limits.get(model, self.max_concurrency))
+            self._pools[model] = pool
+        return pool
+
+    def _reject(self, model: str, reason: str, retry_after: float):
+        if self.metrics is not None:
+            self.metrics.admission_rejections.inc(model, reason)
+        logger.warning("Request rejected", model=model, reason=reason, retry_after=retry_after)
+        raise AdmissionRejected(reason, retry_after)
+
+    async def acquire(self, model: str, priority: int = 0, tokens: int = 0) -> Admission:
+        """
+        Wait for a slot and for upstream budget.
+
+        Args:
+            model: Upstream model name; aliases should be resolved first so
+                they share the same slots.
+            priority: Higher values are admitted first.
+            tokens: Tokens to reserve from the tokens-per-minute budget.
+
+        Raises:
+            AdmissionRejected: The queue is full or the request could not be
+                admitted within max_wait.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        pool = self._pool(model)
+
+        if pool.active < pool.limit and not pool.waiters:
+            pool.active += 1
+        else:
+            if len(pool.waiters) >= self.max_queue:
+                self._reject(
+                    model, "queue_full", pool.hold_time * len(pool.waiters) / max(pool.limit, 1)
+                )
+            await self._wait_for_slot(model, pool, priority)
+
+        delay = 0.0
+        if self.rpm is not None:
+            delay = self.rpm.reserve(1)
+        if self.tpm is not None:
+            delay = max(delay, self.tpm.reserve(tokens))
+        remaining = self.max_wait - (loop.time() - started)
+        if delay > remaining:
+            if self.rpm is not None:
+                self.rpm.refund(1)
+            if self.tpm is not None:
+                self.tpm.refund(min(tokens, self.tpm.capacity))
+            self._release(model, 0.0)
+            self._reject(model, "rate_limited", delay)
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self._release(model, 0.0)
+                raise
+
+        if self.metrics is not None:
+            self.metrics.admission_wait.observe(loop.time() - started, model)
+        return Admission(self, model, tokens)
+
+    def try_acquire(self, model: str, tokens: int = 0) -> Admission | None:
+        """
+        A slot and upstream budget free right now, or None.
+
+        Never queues nor waits: for optional extra calls, such as hedges,
+        which must neither exceed the limits nor delay admitted requests.
+        """
+        pool = self._pool(model)
+        if pool.active >= pool.limit or pool.waiters:
+            return None
+        if self.rpm is not None and self.rpm.reserve(1) > 0:
+            self.rpm.refund(1)
+            return None
+        if self.tpm is not None and self.tpm.reserve(tokens) > 0:
+            self.tpm.refund(min(tokens, self.tpm.capacity))
+            if self.rpm is not None:
+                self.rpm.refund(1)
+            return None
+        pool.active += 1
+        return Admission(self, model, tokens)
+
+    async def _wait_for_slot(self, model: str, pool: _Pool, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        entry = [-priority, next(self._sequence), future]
+        heapq.heappush(pool.waiters, entry)
+        if self.metrics is not None:
+            self.metrics.admission_queue_depth.inc(model)
+        try:
+            # The slot is handed over by _release() resolving the future
+            await asyncio.wait_for(future, self.max_wait)
+        except TimeoutError:
+            self._reject(model, "timeout", pool.hold_time)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(model, 0.0)  # Granted just as the caller gave up
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.admission_queue_depth.dec(model)
+            if not future.done() or future.cancelled():
+                pool.waiters.remove(entry)
+                heapq.heapify(pool.waiters)
+
+    def _release(self, model: str, held: float):
+        pool = self._pools[model]
+        if held:
+            pool.hold_time += HOLD_TIME_SMOOTHING * (held - pool.hold_time)
+        while pool.waiters:
+            _, _, future = heapq.heappop(pool.waiters)
+            if not future.done():
+                future.set_result(None)  # The slot passes to the next waiter
+                return
+        pool.active -= 1
+
+    def close(self):
+        for bucket in (self.rpm, self.tpm):
+            if isinstance(bucket, SharedTokenBucket):
+                bucket.close()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Busy slots and queue length per model"""
+        return {
+            model: {"active": pool.active, "limit": pool.limit, "queued": len(pool.waiters)}
+            for model, pool in self._pools.items()
+        }
@@ -0,0 +1,133 @@
+"""Batch completions: JSONL input, checkpointed results"""
+
+import hashlib
+import json
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+
+import structlog
+from pydantic import ValidationError
+
+from models.schemas import ChatRequest
+
+logger = structlog.get_logger(__name__)
+
+BATCH_URL = "/v1/chat/completions"
+
+
+@dataclass
+class BatchItem:
+    """One line of a batch input file"""
+
+    custom_id: str
+    request: ChatRequest
+
+
+def batch_id(payload: bytes) -> str:
+    """Stable id of a batch input, so resubmitting the same file resumes it"""
+    return "batch_" + hashlib.sha256(payload).hexdigest()[:32]
+
+
+def parse_batch(payload: bytes) -> list[BatchItem]:
+    """
+    Parse an OpenAI batch input file.
+
+    Each non-empty line is {"custom_id", "method": "POST",
+    "url": "/v1/chat/completions", "body": <chat completion request>}.
+
+    Raises:
+        ValueError: A line is invalid or a custom_id is repeated.
+    """
+    items = []
+    seen = set()
+    for number, line in enumerate(payload.decode().splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            custom_id = str(entry["custom_id"])
+            if entry.get("url", BATCH_URL) != BATCH_URL:
+                raise ValueError(f"unsupported url {entry['url']!r}")
+            request = ChatRequest.model_validate({**entry["body"], "stream": False})
+        except (ValueError, KeyError, TypeError, ValidationError) as e:
+            raise ValueError(f"Line {number}: {e}") from e
+        if custom_id in seen:
+            raise ValueError(f"Line {number}: duplicate custom_id {custom_id!r}")
+        seen.add(custom_id)
+        items.append(BatchItem(custom_id, request))
+    return items
+
+
+def result_line(custom_id: str, body: dict = None, error: Exception = None) -> dict:
+    """OpenAI batch output line of a finished item, successful or not"""
+    line = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": custom_id}
+    if error is None:
+        line["response"] = {"status_code": 200, "body": body}
+        line["error"] = None
+    else:
+        line["response"] = None
+        line["error"] = {"code": type(error).__name__, "message": str(error)}
+    return line
+
+
+class BatchStore:
+    """SQLite checkpoints of finished batch items
+
+    Successful results are stored as they finish; resubmitting a batch
+    replays them and only runs the items that are missing. Failed items are
+    not stored, so they are retried on resume. A batch is dropped once it
+    has not been checkpointed for `retention` seconds, checked at most every
+    `purge_interval` seconds as items are saved.
+    """
+
+    def __init__(self, db_path: str = None, retention: float = 86400, purge_interval: float = 60):
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self._db = sqlite3.connect(
+            db_path or ":memory:", check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS batch_results (batch_id TEXT NOT NULL, "
+            "custom_id TEXT NOT NULL, line TEXT NOT NULL, saved_at REAL NOT NULL, "
+            "PRIMARY KEY (batch_id, custom_id))"
+        )
+        self.purge()
+
+    def completed(self, batch: str) -> dict[str, str]:
+        """Stored output lines of a batch, by custom_id"""
+        rows = self._db.execute(
+            "SELECT custom_id, line FROM batch_results WHERE batch_id = ?", (batch,)
+        )
+        return dict(rows.fetchall())
+
+    def save(self, batch: str, custom_id: str, line: str):
+        """Checkpoint the output line of a finished item"""
+        now = time.time()
+        if now - self._purged_at >= self.purge_interval:
+            self.purge()
+        self._db.execute(
+            "INSERT OR REPLACE INTO batch_results (batch_id, custom_id, line, saved_at) "
+            "VALUES (?, ?, ?, ?)",
+            (batch, custom_id, line, now),
+        )
+
+    def purge(self) -> int:
+        """Drop the batches not checkpointed for longer than the retention"""
+        self._purged_at = time.time()
+        cursor = self._db.execute(
+            "DELETE FROM batch_results WHERE batch_id IN (SELECT batch_id FROM batch_results "
+            "GROUP BY batch_id HAVING MAX(saved_at) < ?)",
+            (self._purged_at - self.retention,),
+        )
+        if cursor.rowcount:
+            logger.info("Batch store purged", results=cursor.rowcount)
+        return cursor.rowcount
+
+    def close(self):
+        self._db.close()
+        logger.info("Batch store closed")
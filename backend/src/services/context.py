@@ -0,0 +1,171 @@
+"""Context-window management: fit long chats into a per-model token budget"""
+
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+import structlog
+
+from config import MODEL_MAP
+from core.metrics import Metrics
+from services.conversations import prefix_id
+from services.tokens import MESSAGE_OVERHEAD_TOKENS, TokenEstimator
+
+logger = structlog.get_logger(__name__)
+
+# (previous summary or None, messages to fold into it) -> new summary
+Summarizer = Callable[[str | None, list[dict[str, str]]], Awaitable[str]]
+
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+
+class ContextManager:
+    """Keep the system prompt and the most recent turns within a token budget
+
+    The budget of a model is its declared history budget, further capped by
+    its context window minus the requested max_tokens. System messages and
+    the last message are always kept; other messages are dropped oldest
+    first. With a summarizer, dropped messages are replaced by a rolling
+    summary: summaries are cached by dropped prefix, and a longer prefix is
+    summarized by folding only its new messages into the cached summary of
+    the longest known shorter one.
+    """
+
+    def __init__(
+        self,
+        estimator: TokenEstimator,
+        budgets: dict[str, int] = None,
+        windows: dict[str, int] = None,
+        summary_tokens: int = 512,
+        cache_size: int = 1024,
+        metrics: Metrics = None,
+    ):
+        self.estimator = estimator
+        self.budgets = budgets or {}
+        self.windows = windows or {}
+        self.summary_tokens = summary_tokens
+        self.cache_size = cache_size
+        self.metrics = metrics
+        self._summaries: OrderedDict[str, str] = OrderedDict()
+
+    def budget(self, model: str, max_tokens: int) -> int | None:
+        """Prompt tokens allowed for a request, None if the model has no limit"""
+        upstream = MODEL_MAP.get(model, model)
+        budget = self.budgets.get(upstream)
+        window = self.windows.get(upstream)
+        if window is not None:
+            budget = window - max_tokens if budget is None else min(budget, window - max_tokens)
+        return budget
+
+    async def fit(
+        self,
+        messages: list[dict[str, str]],
+        model: str,
+        system_tokens: int,
+        max_tokens: int,
+        summarize: Summarizer = None,
+    ) -> list[dict[str, str]]:
+        """
+        Messages to send for a request, trimmed to the model's budget.
+
+        `system_tokens` is the precomputed cost of the service system prompt.
+
+        Returns the messages unchanged when they fit. Otherwise returns the
+        kept system messages, the summary of the dropped turns (when a
+        summarizer is given and succeeds) and the most recent turns.
+        """
+        budget = self.budget(model, max_tokens)
+        if budget is None or len(messages) < 2:
+            return messages
+        costs = [
+            self.estimator.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+            for message in messages
+        ]
+        if system_tokens + sum(costs) <= budget:
+            return messages
+
+        last = len(messages) - 1
+        available = budget - system_tokens - costs[last]
+        for i in range(last):
+            if messages[i]["role"] == "system":
+                available -= costs[i]
+        if summarize is None:
+            return self._trim(messages, costs, self._cut(messages, costs, available), model)
+
+        available -= self.summary_tokens + MESSAGE_OVERHEAD_TOKENS
+        cut = self._cut(messages, costs, available)
+        # Prefix key of the dropped turns at each possible cut
+        keys = [""]
+        for message in messages[:last]:
+            if message["role"] != "system":
+                keys.append(prefix_id(keys[-1], message["role"], message["content"]))
+            else:
+                keys.append(keys[-1])
+
+        # A cached summary at or after the minimal cut fits: no upstream call
+        for known in range(cut, last + 1):
+            summary = self._summaries.get(keys[known])
+            if summary is not None:
+                self._summaries.move_to_end(keys[known])
+                self._record_summary(model, "hit")
+                return self._trim(messages, costs, known, model, summary)
+
+        # Drop a quarter of the budget more than needed, so that the summary
+        # serves the next few turns before it has to be extended
+        cut = max(cut, self._cut(messages, costs, available - available // 4))
+        known = cut
+        while known and keys[known] not in self._summaries:
+            known -= 1
+        previous = self._summaries.get(keys[known]) if known else None
+        new = [message for message in messages[known:cut] if message["role"] != "system"]
+        if not new:
+            return self._trim(messages, costs, cut, model, previous)
+        try:
+            summary = await summarize(previous, new)
+        except Exception as e:
+            logger.warning("Summarization failed, truncating only", model=model, error=str(e))
+            self._record_summary(model, "error")
+            return self._trim(messages, costs, cut, model, previous)
+        self._record_summary(model, "miss")
+        self._summaries[keys[cut]] = summary
+        while len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+        return self._trim(messages, costs, cut, model, summary)
+
+    @staticmethod
+    def _cut(messages: list[dict[str, str]], costs: list[int], available: int) -> int:
+        """Index of the first turn kept: the most recent turns that fit"""
+        last = len(messages) - 1
+        cut = last
+        while cut > 0:
+            i = cut - 1
+            if messages[i]["role"] != "system":
+                if costs[i] > available:
+                    break
+                available -= costs[i]
+            cut = i
+        # Kept history starts with a user turn, not with an orphan answer
+        while cut < last and messages[cut]["role"] == "assistant":
+            cut += 1
+        return cut
+
+    def _trim(
+        self,
+        messages: list[dict[str, str]],
+        costs: list[int],
+        cut: int,
+        model: str,
+        summary: str | None = None,
+    ) -> list[dict[str, str]]:
+        """System messages before the cut, the summary, then the kept turns"""
+        kept = [message for message in messages[:cut] if message["role"] == "system"]
+        if self.metrics is not None:
+            dropped = sum(costs[i] for i in range(cut) if messages[i]["role"] != "system")
+            self.metrics.context_dropped_tokens.inc(model, amount=dropped)
+        logger.debug("Trimmed chat history", model=model, cut=cut, summarized=bool(summary))
+        if summary:
+            kept.append({"role": "system", "content": SUMMARY_HEADER + summary})
+        return kept + messages[cut:]
+
+    def _record_summary(self, model: str, result: str):
+        if self.metrics is not None:
+            self.metrics.context_summaries.inc(model, result)
@@ -0,0 +1,154 @@
+"""Server-side conversation prefixes, so clients can send only new messages"""
+
+import hashlib
+import sqlite3
+import time
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+
+def prefix_id(parent: str, role: str, content: str) -> str:
+    """Id of the prefix made of `parent` followed by one message"""
+    digest = hashlib.sha256(f"{parent}\0{role}\0{content}".encode())
+    return digest.hexdigest()[:32]
+
+
+class UnknownPrefix(KeyError):
+    """The referenced prefix was never stored or has expired"""
+
+
+class ConversationStore:
+    """Message prefixes stored as a tree of content-addressed nodes
+
+    Each node holds one message and a reference to the prefix before it, so
+    conversations that share a beginning share its nodes and extending a
+    conversation stores only the new messages. A prefix is rebuilt in one
+    recursive query. Conversation ids map to the latest prefix of a
+    conversation, so a client can continue it without tracking prefix ids.
+    Expired entries are purged at most every `purge_interval` seconds, by
+    the next `extend`.
+    """
+
+    def __init__(self, db_path: str = None, ttl: float = 86400, purge_interval: float = 60):
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self._db = sqlite3.connect(
+            db_path or ":memory:", check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS prefixes (id TEXT PRIMARY KEY, parent TEXT NOT NULL, "
+            "depth INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+            "used_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations "
+            "(id TEXT PRIMARY KEY, head TEXT NOT NULL, used_at REAL NOT NULL)"
+        )
+        self.purge()
+
+    def resolve(
+        self, prefix: str | None = None, conversation_id: str | None = None
+    ) -> tuple[str, list[dict[str, str]]]:
+        """
+        Messages of a stored prefix, oldest first, with the prefix id.
+
+        An explicit prefix wins over the conversation's latest one. An unknown
+        conversation id starts an empty conversation.
+
+        Raises:
+            UnknownPrefix: The prefix is unknown or partly expired; the client
+                must send the whole conversation again. The conversation id,
+                if any, is reset so that it can be reused for that.
+        """
+        if prefix is None and conversation_id is not None:
+            row = self._db.execute(
+                "SELECT head FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            prefix = row[0] if row is not None else None
+        if not prefix:
+            return "", []
+
+        now = time.time()
+        rows = self._db.execute(
+            "WITH RECURSIVE chain(id, parent, depth, role, content) AS ("
+            "SELECT id, parent, depth, role, content FROM prefixes WHERE id = ? "
+            "UNION ALL SELECT p.id, p.parent, p.depth, p.role, p.content "
+            "FROM prefixes p JOIN chain c ON p.id = c.parent) "
+            "SELECT id, depth, role, content FROM chain ORDER BY depth",
+            (prefix,),
+        ).fetchall()
+        if not rows or len(rows) != rows[-1][1] + 1:
+            if conversation_id is not None:
+                # Start over: the next request with this id carries the whole conversation
+                self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            raise UnknownPrefix(prefix)
+        # Keep the whole chain alive for as long as the conversation is used
+        self._db.execute(
+            f"UPDATE prefixes SET used_at = ? WHERE id IN ({','.join('?' * len(rows))})",
+            (now, *(row[0] for row in rows)),
+        )
+        return prefix, [{"role": role, "content": content} for _, _, role, content in rows]
+
+    @staticmethod
+    def head(prefix: str, messages: list[dict[str, str]]) -> str:
+        """Id of the prefix `extend` would store, without storing anything"""
+        for message in messages:
+            prefix = prefix_id(prefix, message["role"], message["content"])
+        return prefix
+
+    def extend(
+        self, prefix: str, messages: list[dict[str, str]], conversation_id: str | None = None
+    ) -> str:
+        """Store messages after a prefix and return the id of the new prefix"""
+        now = time.time()
+        if now - self._purged_at >= self.purge_interval:
+            self.purge()
+        depth = 0
+        if prefix:
+            row = self._db.execute("SELECT depth FROM prefixes WHERE id = ?", (prefix,)).fetchone()
+            if row is None:
+                raise UnknownPrefix(prefix)
+            depth = row[0] + 1
+        nodes = []
+        for message in messages:
+            node = prefix_id(prefix, message["role"], message["content"])
+            nodes.append((node, prefix, depth, message["role"], message["content"], now))
+            prefix = node
+            depth += 1
+        self._db.executemany(
+            "INSERT INTO prefixes (id, parent, depth, role, content, used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET used_at = excluded.used_at",
+            nodes,
+        )
+        if conversation_id is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO conversations (id, head, used_at) VALUES (?, ?, ?)",
+                (conversation_id, prefix, now),
+            )
+        return prefix
+
+    def purge(self):
+        """Forget prefixes and conversations unused for longer than the TTL"""
+        self._purged_at = time.time()
+        oldest = self._purged_at - self.ttl
+        prefixes = self._db.execute("DELETE FROM prefixes WHERE used_at < ?", (oldest,)).rowcount
+        conversations = self._db.execute(
+            "DELETE FROM conversations WHERE used_at < ?", (oldest,)
+        ).rowcount
+        if prefixes or conversations:
+            logger.info("Conversation store purged", prefixes=prefixes, conversations=conversations)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "prefixes": self._db.execute("SELECT COUNT(*) FROM prefixes").fetchone()[0],
+            "conversations": self._db.execute("SELECT COUNT(*) FROM conversations").fetchone()[0],
+        }
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,179 @@
+"""Hedged streams: race a second upstream call when the first token is late"""
+
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncGenerator, AsyncIterator, Callable
+from typing import Any
+
+import structlog
+
+from core.metrics import Metrics
+
+logger = structlog.get_logger(__name__)
+
+_END = object()
+
+
+class _Racer:
+    """Run one stream in its own task, buffering its output
+
+    Each stream is driven by a single task from start to end, so context
+    managers opened inside it are always entered and exited by the same task.
+    """
+
+    def __init__(self, stream: AsyncIterator[str], on_end: Callable[[], None] | None = None):
+        self.on_end = on_end
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.ready = asyncio.get_running_loop().create_future()  # First chunk, error or end
+        self.started = time.perf_counter()
+        self.task = asyncio.create_task(self._pump(stream))
+
+    async def _pump(self, stream: AsyncIterator[str]):
+        try:
+            async for chunk in stream:
+                self._put(chunk)
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(_END)
+            if self.on_end is not None:
+                self.on_end()
+
+    def _put(self, item):
+        self.queue.put_nowait(item)
+        if not self.ready.done():
+            self.ready.set_result(item)
+
+    @property
+    def failed(self) -> bool:
+        return self.ready.done() and isinstance(self.ready.result(), Exception)
+
+    async def drain(self) -> AsyncGenerator[str, None]:
+        while (item := await self.queue.get()) is not _END:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class HedgePolicy:
+    """When to hedge a stream, and how often we can afford to
+
+    The hedge delay is a percentile of recent times to first token of the
+    model, so only the slow tail gets a second request. Each stream earns
+    `budget` hedge credits and each hedge spends one, which caps the extra
+    upstream load at that fraction of streams.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        budget: float = 0.05,
+        min_delay: float = 0.1,
+        min_samples: int = 20,
+        window: int = 512,
+        max_credits: float = 10,
+        metrics: Metrics = None,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.max_credits = max_credits
+        self.metrics = metrics
+        self.credits = 0.0
+        self._samples: dict[str, deque[float]] = {}
+
+    def observe(self, model: str, ttft: float):
+        """Record a time to first token"""
+        samples = self._samples.get(model)
+        if samples is None:
+            samples = self._samples[model] = deque(maxlen=self.window)
+        samples.append(ttft)
+
+    def delay(self, model: str) -> float | None:
+        """Seconds to wait for the first token before hedging, None until warmed up"""
+        samples = self._samples.get(model)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    def _spend(self) -> bool:
+        if self.credits < 1:
+            return False
+        self.credits -= 1
+        return True
+
+    async def race(
+        self,
+        model: str,
+        open_primary: Callable[[], AsyncIterator[str]],
+        open_hedge: Callable[[], AsyncIterator[str]],
+        opened: list[str] | None = None,
+        admit: Callable[[], Any] | None = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream from the primary, racing a hedge if its first token is late.
+
+        The first stream to produce a chunk wins and the other one is
+        cancelled. A stream that fails before its first chunk drops out of the
+        race; if every stream fails, the primary's error is raised. If
+        `opened` is given, "primary" and, when a hedge is sent, "hedge" are
+        appended to it as the streams are opened.
+
+        `admit` returns an admission ticket (with a `release()` method) for
+        the hedge if one is free right now, else None and no hedge is sent:
+        hedges fire when upstream is slow, often under load, and must not
+        exceed the concurrency and token budgets.
+        """
+        self.credits = min(self.max_credits, self.credits + self.budget)
+        opened = [] if opened is None else opened
+        racers = [_Racer(open_primary())]
+        opened.append("primary")
+        try:
+            delay = self.delay(model)
+            if delay is not None:
+                await asyncio.wait([racers[0].ready], timeout=delay)
+                if not racers[0].ready.done() and self._spend():
+                    ticket = admit() if admit is not None else None
+                    if admit is not None and ticket is None:
+                        self.credits += 1  # Not spent: no capacity for a hedge
+                        logger.debug("No capacity to hedge", model=model)
+                    else:
+                        logger.debug("Hedging slow stream", model=model, delay=delay)
+                        racers.append(_Racer(open_hedge(), ticket and ticket.release))
+                        opened.append("hedge")
+
+            winner = await self._winner(racers)
+            if winner is None:
+                raise racers[0].ready.result()
+            for racer in racers:
+                if racer is not winner:
+                    racer.task.cancel()
+            self.observe(model, time.perf_counter() - winner.started)
+            if len(racers) > 1 and self.metrics is not None:
+                outcome = "primary" if winner is racers[0] else "hedge"
+                self.metrics.hedged_streams.inc(model, outcome)
+
+            async for chunk in winner.drain():
+                yield chunk
+        finally:
+            for racer in racers:
+                racer.task.cancel()
+            # Let the cancelled streams close their upstream calls
+            await asyncio.gather(*(racer.task for racer in racers), return_exceptions=True)
+
+    @staticmethod
+    async def _winner(racers: list[_Racer]) -> _Racer | None:
+        """First racer to produce something other than an error"""
+        while True:
+            pending = [racer.ready for racer in racers if not racer.ready.done()]
+            for racer in racers:
+                if racer.ready.done() and not racer.failed:
+                    return racer
+            if not pending:
+                return None
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
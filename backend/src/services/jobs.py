@@ -0,0 +1,274 @@
+"""Asynchronous completion jobs: a persistent queue and its worker pool"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+
+import structlog
+
+from core.metrics import Metrics
+from services.llm_service import Completion
+
+logger = structlog.get_logger(__name__)
+
+# Job states; the last three are final
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+_COLUMNS = "id, status, request, result, error, attempts, created_at, started_at, finished_at"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """Jobs in a SQLite table, shared by every worker process using the file
+
+    Claiming a job is a single UPDATE ... RETURNING, so concurrent workers,
+    in this process or another one, never run the same job twice.
+    """
+
+    def __init__(self, db_path: str = None):
+        self._db = sqlite3.connect(
+            db_path or ":memory:", check_same_thread=False, isolation_level=None
+        )
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+            "request TEXT NOT NULL, result TEXT, error TEXT, owner INTEGER, "
+            "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+            "started_at REAL, finished_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, created_at)")
+
+    def submit(self, request: dict) -> dict:
+        """Queue a job; request holds generate_completion keyword arguments"""
+        job_id = f"job_{uuid.uuid4().hex}"
+        self._db.execute(
+            "INSERT INTO jobs (id, status, request, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, QUEUED, json.dumps(request, ensure_ascii=False), time.time()),
+        )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def claim(self) -> dict | None:
+        """Mark the oldest queued job as running in this process and return it"""
+        row = self._db.execute(
+            f"UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, started_at = ? "
+            f"WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) "
+            f"RETURNING {_COLUMNS}",
+            (RUNNING, os.getpid(), time.time(), QUEUED),
+        ).fetchone()
+        return self._job(row) if row is not None else None
+
+    def finish(self, job_id: str, completion: Completion):
+        self._db.execute(
+            "UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (
+                SUCCEEDED,
+                json.dumps(completion.as_dict(), ensure_ascii=False),
+                time.time(),
+                job_id,
+                RUNNING,
+            ),
+        )
+
+    def fail(self, job_id: str, error: str):
+        self._db.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (FAILED, error, time.time(), job_id, RUNNING),
+        )
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not started; False if it already has"""
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, time.time(), job_id, QUEUED),
+        )
+        return cursor.rowcount > 0
+
+    def recover(self, max_attempts: int) -> int:
+        """
+        Requeue the running jobs of processes that died; call before starting workers.
+
+        A job that already took down its worker max_attempts times is failed
+        instead, so one poisonous request cannot crash-loop the service. Jobs
+        owned by this pid are from a previous run (containers reuse pids).
+        """
+        recovered = 0
+        rows = self._db.execute(
+            "SELECT id, owner, attempts FROM jobs WHERE status = ?", (RUNNING,)
+        ).fetchall()
+        for job_id, owner, attempts in rows:
+            if owner is not None and owner != os.getpid() and _pid_alive(owner):
+                continue
+            if attempts >= max_attempts:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                    (FAILED, "Job interrupted too many times", time.time(), job_id),
+                )
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL WHERE id = ?", (QUEUED, job_id)
+                )
+                recovered += 1
+        return recovered
+
+    def release_owned(self):
+        """Requeue the jobs this process was running when it was stopped"""
+        self._db.execute(
+            "UPDATE jobs SET status = ?, owner = NULL, attempts = attempts - 1 "
+            "WHERE status = ? AND owner = ?",
+            (QUEUED, RUNNING, os.getpid()),
+        )
+
+    def purge(self, older_than: float) -> int:
+        """Delete finished jobs older than the given number of seconds"""
+        cursor = self._db.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?",
+            (*FINAL_STATES, time.time() - older_than),
+        )
+        return cursor.rowcount
+
+    def counts(self) -> dict[str, int]:
+        """Number of jobs in each state"""
+        rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        return dict(rows.fetchall())
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def close(self):
+        self._db.close()
+
+
+class JobQueue:
+    """Worker pool running queued jobs, with long polling of their results
+
+    Workers are woken right away by jobs submitted through this queue, and
+    check the store every poll_interval for jobs submitted by other
+    processes sharing it.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        run: Callable[[dict], Awaitable[Completion]],
+        concurrency: int = 4,
+        poll_interval: float = 1.0,
+        max_attempts: int = 3,
+        retention: float = 86400,
+        metrics: Metrics = None,
+    ):
+        self.store = store
+        self.run = run
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.metrics = metrics
+        self._wakeup = asyncio.Event()
+        self._finished: dict[str, asyncio.Event] = {}  # Jobs someone is waiting for
+        self._workers: list[asyncio.Task] = []
+
+    def submit(self, request: dict) -> dict:
+        job = self.store.submit(request)
+        self._wakeup.set()
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> dict | None:
+        """The job once it is final, or as it is when the timeout expires"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.store.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINAL_STATES or remaining <= 0:
+                self._finished.pop(job_id, None)
+                return job
+            event = self._finished.setdefault(job_id, asyncio.Event())
+            try:
+                # Jobs run by other processes are only seen by polling
+                await asyncio.wait_for(event.wait(), min(remaining, self.poll_interval))
+            except TimeoutError:
+                pass
+
+    async def _work(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = self.store.claim()
+                if job is not None:
+                    await self._execute(job)
+                    continue
+            except Exception as e:
+                # A store error, such as a locked database, must not end the worker
+                logger.error("Job worker error", error=str(e), exc_info=True)
+                await asyncio.sleep(self.poll_interval)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except TimeoutError:
+                pass
+
+    async def _execute(self, job: dict):
+        model = job["request"].get("model", "")
+        logger.info("Job started", job_id=job["id"], model=model, attempt=job["attempts"])
+        try:
+            completion = await self.run(job["request"])
+        except Exception as e:
+            logger.warning("Job failed", job_id=job["id"], error=str(e))
+            self.store.fail(job["id"], str(e))
+            status = FAILED
+        else:
+            self.store.finish(job["id"], completion)
+            status = SUCCEEDED
+            logger.info("Job finished", job_id=job["id"], **completion.usage.as_dict())
+        if self.metrics is not None:
+            self.metrics.jobs.inc(model, status)
+        event = self._finished.pop(job["id"], None)
+        if event is not None:
+            event.set()
+
+    def start(self):
+        recovered = self.store.recover(self.max_attempts)
+        purged = self.store.purge(self.retention)
+        if recovered or purged:
+            logger.info("Job store recovered", requeued=recovered, purged=purged)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Stop the workers and requeue the jobs they were running"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self.store.release_owned()
+        self.store.close()
+
+    def stats(self) -> dict[str, int]:
+        return self.store.counts()
@@ -1,30 +1,103 @@
 """Service for European/Open-Source LLM interactions using Pydantic AI"""
 
-from collections.abc import AsyncGenerator
+import asyncio
+from collections.abc import AsyncGenerator, Awaitable, Callable, Iterable
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any
 
+import httpx
 import structlog
+from openai import AsyncOpenAI
 from pydantic_ai import Agent
 from pydantic_ai.models.mistral import MistralModel
+from pydantic_ai.models.openai import OpenAIChatModel
+from pydantic_ai.providers.mistral import MistralProvider
+from pydantic_ai.providers.openai import OpenAIProvider
 
-from config import LLM_PROVIDER, MISTRAL_API_KEY, MODEL_MAP
-from prompts import DEFAULT_SYSTEM_PROMPT
+from config import (
+    CONTEXT_SUMMARY_ENABLED,
+    CONTEXT_SUMMARY_MAX_TOKENS,
+    CONTEXT_SUMMARY_MODEL,
+    LLM_PROVIDER,
+    MISTRAL_API_KEY,
+    MISTRAL_API_URL,
+    MODEL_MAP,
+    OPENAI_COMPAT_API_KEY,
+    OPENAI_COMPAT_BASE_URL,
+)
+from core.metrics import Metrics
+from core.tracing import tracer
+from prompts import DEFAULT_SYSTEM_PROMPT, SUMMARY_PROMPT
+from services.context import ContextManager
+from services.hedging import HedgePolicy
+from services.message_history import to_message_history
+from services.prompt_catalog import PromptCatalog, SystemPrompt
+from services.router import Backend, ProviderRouter, is_retryable
+from services.tokens import TokenUsage
 
 logger = structlog.get_logger(__name__)
 
+# Prefix of the in-band message yielded when a stream fails
+STREAM_ERROR_PREFIX = "Error: "
+
+
+@dataclass
+class Completion:
+    """Result of a non-streaming completion"""
+
+    content: str
+    usage: TokenUsage = field(default_factory=TokenUsage)
+
+    def as_dict(self) -> dict:
+        """JSON-serializable form, used by caches"""
+        return {"content": self.content, "usage": self.usage.as_dict()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Completion":
+        return cls(data["content"], TokenUsage.from_dict(data["usage"]))
+
 
 class LLMService:
     """Handle LLM interactions via Pydantic AI
 
     Supports European and open-source models:
     - Mistral AI (France)
-    - Future: HuggingFace, local Ollama, etc.
+    - Any OpenAI-compatible server (vLLM, llama.cpp, Ollama, ...)
+
+    Each call goes to the best backend of the requested model according to
+    the router and fails over to the next one on timeouts, 429 and 5xx.
+    The system prompt of each call is a variant from the prompt catalog,
+    chosen per tenant or model; it is always the first message, byte for
+    byte identical between calls, so upstream prefix caches can reuse it.
+    With a context manager, chats longer than the model's budget are trimmed
+    (and, if enabled, summarized) before they are sent.
     """
 
-    def __init__(self, provider: str = None, system_prompt: str = None):
+    def __init__(
+        self,
+        provider: str = None,
+        system_prompt: str = None,
+        http_client: httpx.AsyncClient = None,
+        metrics: Metrics = None,
+        router: ProviderRouter = None,
+        hedging: HedgePolicy = None,
+        context: ContextManager = None,
+        prompts: PromptCatalog = None,
+    ):
         self.provider = provider or LLM_PROVIDER
-        self.system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
+        self.prompts = prompts or PromptCatalog(system_prompt or DEFAULT_SYSTEM_PROMPT)
+        self.system_prompt = self.prompts.default.text
+        self.http_client = http_client  # Shared upstream pool, owned by the caller
+        self.metrics = metrics
+        self.router = router or ProviderRouter(default_provider=self.provider, metrics=metrics)
+        self.hedging = hedging  # Optional hedged streams
+        self.context = context  # Optional history trimming
         self._validate_provider()
         self._agents = {}  # Cache agents by model
+        self.agent_cache_hits = 0
+        self.agent_cache_misses = 0
         logger.info("LLMService initialized", provider=self.provider)
 
     def _validate_provider(self):
@@ -33,28 +106,59 @@ class LLMService:
             raise ValueError("MISTRAL_API_KEY not configured")
         # Future providers will be added here
 
-    def _get_model_instance(self, model_name: str):
+    def _get_model_instance(self, model_name: str, provider: str = None):
         """Get the appropriate model instance based on provider"""
+        provider_name = provider or self.provider
         actual_model = MODEL_MAP.get(model_name, model_name)
 
-        if self.provider == "mistral":
-            return MistralModel(actual_model)
+        if provider_name == "mistral":
+            if self.http_client is None:
+                return MistralModel(actual_model)
+            provider = MistralProvider(
+                api_key=MISTRAL_API_KEY,
+                # The Mistral SDK adds the /v1 prefix itself
+                base_url=MISTRAL_API_URL.removesuffix("/v1"),
+                http_client=self.http_client,
+            )
+            return MistralModel(actual_model, provider=provider)
+        elif provider_name == "openai":
+            if not OPENAI_COMPAT_BASE_URL:
+                raise ValueError("OPENAI_COMPAT_BASE_URL not configured")
+            client = AsyncOpenAI(
+                base_url=OPENAI_COMPAT_BASE_URL,
+                api_key=OPENAI_COMPAT_API_KEY,
+                http_client=self.http_client,
+                max_retries=0,  # Retries are the router's job (failover)
+            )
+            return OpenAIChatModel(actual_model, provider=OpenAIProvider(openai_client=client))
         # Future: other European/open-source providers will be added here
         else:
-            raise ValueError(f"Unsupported provider: {self.provider}")
+            raise ValueError(f"Unsupported provider: {provider_name}")
 
-    def _get_agent(self, model_name: str) -> Agent:
-        """Get or create agent for model"""
-        cache_key = f"{self.provider}:{model_name}"
+    def _get_agent(
+        self, model_name: str, provider: str = None, prompt: SystemPrompt = None
+    ) -> Agent:
+        """Get or create agent for model and system prompt variant"""
+        provider = provider or self.provider
+        prompt = prompt or self.prompts.default
+        cache_key = f"{provider}:{model_name}:{prompt.name}"
 
-        if cache_key not in self._agents:
-            logger.debug("Creating new agent", provider=self.provider, model=model_name)
-            model = self._get_model_instance(model_name)
-            self._agents[cache_key] = Agent(model, system_prompt=self.system_prompt, retries=2)
-        else:
-            logger.debug("Using cached agent", provider=self.provider, model=model_name)
+        with tracer.start_as_current_span(
+            "llm.get_agent",
+            attributes={"llm.provider": provider, "gen_ai.request.model": model_name},
+        ) as span:
+            agent = self._agents.get(cache_key)
+            span.set_attribute("cache.hit", agent is not None)
+            if agent is None:
+                self.agent_cache_misses += 1
+                logger.debug("Creating new agent", provider=provider, model=model_name)
+                model = self._get_model_instance(model_name, provider)
+                agent = Agent(model, system_prompt=prompt.text, retries=2)
+                self._agents[cache_key] = agent
+            else:
+                self.agent_cache_hits += 1
 
-        return self._agents[cache_key]
+        return agent
 
     async def generate_completion(
         self,
@@ -62,22 +166,89 @@ class LLMService:
         model: str,
         temperature: float = 0.7,
         max_tokens: int = 4096,
-    ) -> str:
-        """Non-streaming completion"""
-        agent = self._get_agent(model)
+        tenant: str = None,
+    ) -> Completion:
+        """Non-streaming completion, with the token usage reported by the provider"""
+        system = self.prompts.select(model, tenant)
+        messages = await self._fit(messages, model, max_tokens, system)
+        return await self._complete(messages, model, temperature, max_tokens, system)
 
-        # Convert messages to prompt
-        if len(messages) == 1:
-            prompt = messages[0]["content"]
-        else:
-            # Build conversation context
-            prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+    async def _complete(
+        self,
+        messages: list[dict[str, str]],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        system: SystemPrompt,
+    ) -> Completion:
+        prompt, history = to_message_history(messages, system.text)
+        candidates = self.router.candidates(model)
 
-        result = await agent.run(
-            prompt, model_settings={"temperature": temperature, "max_tokens": max_tokens}
-        )
+        for index, backend in enumerate(candidates):
+            agent = self._get_agent(backend.model, backend.provider, system)
+            try:
+                with self.router.attempt(backend):
+                    result = await agent.run(
+                        prompt,
+                        message_history=history or None,
+                        model_settings={"temperature": temperature, "max_tokens": max_tokens},
+                    )
+            except Exception as e:
+                self._record_error(backend, e)
+                if index + 1 < len(candidates) and is_retryable(e):
+                    self.router.failover(backend, e)
+                    continue
+                raise
+
+            usage = TokenUsage()
+            usage.update(result.usage())
+            return Completion(result.output, usage)
+
+    async def generate_batch(
+        self,
+        requests: Iterable[dict],
+        concurrency: int = 8,
+        call: Callable[[dict], Awaitable[Completion]] = None,
+    ) -> AsyncGenerator[tuple[int, Completion | Exception], None]:
+        """
+        Run many non-streaming completions with bounded concurrency.
 
-        return result.data
+        Args:
+            requests: generate_completion keyword arguments, one dict per completion.
+            concurrency: Completions in flight at once.
+            call: Replaces generate_completion, e.g. to add admission control.
+
+        Yields:
+            The index of each request with its Completion, or the exception
+            it raised, in the order they finish.
+        """
+        call = call or (lambda request: self.generate_completion(**request))
+        pending = iter(enumerate(requests))
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            try:
+                for index, request in pending:
+                    try:
+                        results.put_nowait((index, await call(request)))
+                    except Exception as e:
+                        results.put_nowait((index, e))
+            finally:
+                results.put_nowait(None)
+
+        workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+        finished = 0
+        try:
+            while finished < len(workers):
+                result = await results.get()
+                if result is None:
+                    finished += 1
+                else:
+                    yield result
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
 
     async def stream_completion(
         self,
@@ -85,24 +256,121 @@ class LLMService:
         model: str,
         temperature: float = 0.7,
         max_tokens: int = 4096,
+        usage: TokenUsage = None,
+        tenant: str = None,
+        admit_hedge: Callable[[], Any] | None = None,
     ) -> AsyncGenerator[str, None]:
-        """Streaming completion - yields content chunks (deltas only)"""
-        agent = self._get_agent(model)
+        """Streaming completion - yields content chunks (deltas only)
 
-        # Convert messages to prompt
-        if len(messages) == 1:
-            prompt = messages[0]["content"]
-        else:
-            prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+        If `usage` is given, it is filled with the provider's token counts
+        once the stream has finished. Closing the generator (or cancelling
+        the task iterating it) closes the upstream stream at once.
+        `admit_hedge` grants the admission a hedge needs, or None to skip it.
+        """
+        system = self.prompts.select(model, tenant)
+        messages = await self._fit(messages, model, max_tokens, system)
+        prompt, history = to_message_history(messages, system.text)
+        settings = {"temperature": temperature, "max_tokens": max_tokens}
+        candidates = self.router.candidates(model, streaming=True)
 
-        try:
-            async with agent.run_stream(
-                prompt, model_settings={"temperature": temperature, "max_tokens": max_tokens}
-            ) as response:
-                async for chunk in response.stream_text(delta=True):
-                    # stream_text(delta=True) should give us only new content
-                    if chunk:
+        def open_stream(backend: Backend) -> AsyncGenerator[str, None]:
+            return self._stream_from(backend, system, prompt, history, settings, usage)
+
+        index = 0
+        while index < len(candidates):
+            backend = candidates[index]
+            opened = []
+            if index == 0 and self.hedging is not None:
+                # Hedge on the next backend, or on the same one if it is alone
+                alternate = candidates[1] if len(candidates) > 1 else backend
+                stream = self.hedging.race(
+                    model,
+                    partial(open_stream, backend),
+                    partial(open_stream, alternate),
+                    opened,
+                    admit_hedge,
+                )
+            else:
+                stream = open_stream(backend)
+
+            started = False
+            try:
+                async with aclosing(stream):
+                    async for chunk in stream:
+                        started = True
                         yield chunk
+                return
+            except Exception as e:
+                # Once deltas have been sent the stream cannot switch backends
+                # Skip the backends already tried: the hedge ran on the next one
+                tried = 2 if "hedge" in opened and len(candidates) > 1 else 1
+                if not started and index + tried < len(candidates) and is_retryable(e):
+                    self.router.failover(backend, e)
+                    index += tried
+                    continue
+                yield f"{STREAM_ERROR_PREFIX}{str(e)}"
+                return
+
+    async def _stream_from(
+        self,
+        backend: Backend,
+        system: SystemPrompt,
+        prompt: str | None,
+        history: list,
+        settings: dict,
+        usage: TokenUsage | None,
+    ) -> AsyncGenerator[str, None]:
+        """Stream from one backend, raising its errors"""
+        agent = self._get_agent(backend.model, backend.provider, system)
+        try:
+            with self.router.attempt(backend, streaming=True) as attempt:
+                async with agent.run_stream(
+                    prompt, message_history=history or None, model_settings=settings
+                ) as response:
+                    # No debouncing: deltas are forwarded as they arrive and
+                    # the API layer decides whether to coalesce them
+                    async for chunk in response.stream_text(delta=True, debounce_by=None):
+                        if chunk:
+                            attempt.first_token()
+                            yield chunk
+                    if usage is not None:
+                        usage.update(response.usage())
         except Exception as e:
-            logger.error("Streaming error", error=str(e), model=model, provider=self.provider)
-            yield f"Error: {str(e)}"
+            logger.error("Streaming error", error=str(e), backend=backend.name)
+            self._record_error(backend, e)
+            raise
+
+    async def _fit(
+        self, messages: list[dict[str, str]], model: str, max_tokens: int, system: SystemPrompt
+    ) -> list[dict[str, str]]:
+        """Messages trimmed to the model's budget by the context manager, if any"""
+        if self.context is None:
+            return messages
+        summarize = self._summarize if CONTEXT_SUMMARY_ENABLED else None
+        return await self.context.fit(messages, model, system.tokens, max_tokens, summarize)
+
+    async def _summarize(self, previous: str | None, messages: list[dict[str, str]]) -> str:
+        """Fold trimmed messages into the summary of the turns trimmed before them"""
+        transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        if previous:
+            transcript = f"Previous summary:\n{previous}\n\nNew messages:\n{transcript}"
+        completion = await self._complete(
+            [{"role": "user", "content": f"{SUMMARY_PROMPT}\n{transcript}"}],
+            CONTEXT_SUMMARY_MODEL,
+            temperature=0.0,
+            max_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+            system=self.prompts.default,
+        )
+        if self.metrics is not None:
+            self.metrics.record_usage(
+                "context_summary",
+                CONTEXT_SUMMARY_MODEL,
+                completion.usage.prompt_tokens,
+                completion.usage.completion_tokens,
+                completion.usage.cached_tokens,
+            )
+        return completion.content
+
+    def _record_error(self, backend: Backend, error: Exception):
+        if self.metrics is not None:
+            self.metrics.upstream_errors.inc(backend.provider, backend.model, type(error).__name__)
@@ -0,0 +1,63 @@
+"""Conversion of OpenAI-style chat messages to Pydantic AI message history"""
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelRequestPart,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    UserPromptPart,
+)
+
+
+def to_message_history(
+    messages: list[dict[str, str]], system_prompt: str
+) -> tuple[str | None, list[ModelMessage]]:
+    """
+    Split a chat transcript into the new user prompt and the history before it.
+
+    The transcript is walked once, by index, so nothing is sliced or joined.
+    Client `system` messages become real system parts placed after our own
+    system prompt, which keeps the head of every request byte-identical from
+    one turn to the next. Consecutive request-side messages share a single
+    ModelRequest, as Pydantic AI expects.
+
+    Args:
+        messages: Chat messages as `{"role": ..., "content": ...}` dicts.
+        system_prompt: Service system prompt, sent first.
+
+    Returns:
+        The trailing user message content (None if the transcript does not end
+        with a user turn) and the message history preceding it. The history is
+        empty when there is nothing before the prompt, in which case the agent
+        adds its own system prompt.
+    """
+    end = len(messages)
+    user_prompt = None
+    if end and messages[end - 1]["role"] == "user":
+        end -= 1
+        user_prompt = messages[end]["content"]
+
+    if not end:
+        return user_prompt, []
+
+    history: list[ModelMessage] = []
+    parts: list[ModelRequestPart] = [SystemPromptPart(system_prompt)]
+    for i in range(end):
+        role = messages[i]["role"]
+        content = messages[i]["content"]
+        if role == "assistant":
+            if parts:
+                history.append(ModelRequest(parts=parts))
+                parts = []
+            history.append(ModelResponse(parts=[TextPart(content)]))
+        elif role == "system":
+            parts.append(SystemPromptPart(content))
+        else:
+            parts.append(UserPromptPart(content))
+
+    if parts:
+        history.append(ModelRequest(parts=parts))
+
+    return user_prompt, history
@@ -0,0 +1,228 @@
+"""Model lists of /v1/models and /api/tags, encoded once with stable ETags"""
+
+import asyncio
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import UTC, datetime
+
+import httpx
+import structlog
+
+from config import (
+    AVAILABLE_MODELS,
+    LLM_PROVIDER,
+    MISTRAL_API_KEY,
+    MISTRAL_API_URL,
+    MODEL_BACKENDS,
+    MODEL_MAP,
+    OPENAI_COMPAT_API_KEY,
+    OPENAI_COMPAT_BASE_URL,
+)
+from services.router import ProviderRouter
+
+logger = structlog.get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class EncodedResponse:
+    """A JSON body rendered to bytes, with an ETag derived from its content
+
+    The ETag is a hash of the body, so every worker serving the same list
+    hands out the same tag and a client revalidating against any of them
+    gets a 304.
+    """
+
+    body: bytes
+    etag: str
+
+    @classmethod
+    def of(cls, payload: dict) -> "EncodedResponse":
+        body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+        return cls(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+    def matches(self, if_none_match: str | None) -> bool:
+        """Whether an If-None-Match header names this body (weak comparison)"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or self.etag in tags
+
+
+def provider_endpoints(providers: set[str]) -> dict[str, tuple[str, str]]:
+    """OpenAI-style API base URL and key of each configured provider"""
+    endpoints = {}
+    if "mistral" in providers and MISTRAL_API_KEY:
+        endpoints["mistral"] = (MISTRAL_API_URL, MISTRAL_API_KEY)
+    if "openai" in providers and OPENAI_COMPAT_BASE_URL:
+        endpoints["openai"] = (OPENAI_COMPAT_BASE_URL, OPENAI_COMPAT_API_KEY)
+    return endpoints
+
+
+def configured_providers() -> set[str]:
+    """LLM_PROVIDER and every provider named in MODEL_BACKENDS"""
+    providers = {LLM_PROVIDER}
+    for backends in MODEL_BACKENDS.values():
+        providers.update(backend.split(":", 1)[0] for backend in backends)
+    return providers
+
+
+def _timestamp(value: str) -> int:
+    try:
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+    except (AttributeError, ValueError):
+        return 0
+
+
+def _isoformat(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, UTC).isoformat().replace("+00:00", "Z")
+
+
+class ModelCatalog:
+    """Model lists served from pre-encoded bytes
+
+    The configured models (AVAILABLE_MODELS, with their MODEL_MAP upstream
+    name as `root`) are encoded once, with `created` taken from their
+    `modified_at` so the bytes and the ETag stay the same from one request
+    and one restart to the next. With provider endpoints and an interval,
+    a background task also lists the models each provider serves and merges
+    those not configured here into the lists; they are re-encoded only when
+    the merged list changes. Discovered models are registered with the
+    router, so that every listed model can be requested.
+    """
+
+    def __init__(
+        self,
+        models: list[dict] = None,
+        aliases: dict[str, str] = None,
+        endpoints: dict[str, tuple[str, str]] = None,
+        http_client: httpx.AsyncClient = None,
+        interval: float = 0.0,
+        router: ProviderRouter = None,
+    ):
+        self.models = AVAILABLE_MODELS if models is None else models
+        self.aliases = MODEL_MAP if aliases is None else aliases
+        self.endpoints = endpoints or {}
+        self.http_client = http_client
+        self.interval = interval
+        self.router = router
+        self.discovered: dict[str, list[dict]] = {}  # Provider -> OpenAI model objects
+        self._task: asyncio.Task | None = None
+        self._build()
+
+    def _build(self):
+        configured = [
+            {
+                "id": model["name"],
+                "object": "model",
+                "created": _timestamp(model.get("modified_at")),
+                "owned_by": "mistral-ai",
+                "root": self.aliases.get(model["name"], model["name"]),
+            }
+            for model in self.models
+        ]
+        # Upstream names already served under a configured name are not repeated
+        known = {model["id"] for model in configured} | {model["root"] for model in configured}
+        discovered = []
+        served: dict[str, list[str]] = {}  # Discovered model -> providers listing it
+        for provider in sorted(self.discovered):
+            for model in self.discovered[provider]:
+                if model["id"] in known:
+                    continue
+                if model["id"] not in served:
+                    discovered.append(model)
+                served.setdefault(model["id"], []).append(provider)
+        if self.router is not None:
+            for model, providers in served.items():
+                self.router.register(model, providers)
+
+        self.count = len(configured) + len(discovered)
+        self.openai = EncodedResponse.of({"object": "list", "data": configured + discovered})
+        self.ollama = EncodedResponse.of(
+            {
+                "models": self.models
+                + [
+                    {
+                        "name": model["id"],
+                        "model": model["id"],
+                        "modified_at": _isoformat(model["created"]),
+                        "size": 0,
+                        "digest": "",
+                        "details": {
+                            "parent_model": "",
+                            "format": "",
+                            "family": model["owned_by"],
+                            "families": [model["owned_by"]],
+                            "parameter_size": "",
+                            "quantization_level": "",
+                        },
+                    }
+                    for model in discovered
+                ]
+            }
+        )
+
+    async def _list(self, provider: str) -> list[dict]:
+        base_url, api_key = self.endpoints[provider]
+        response = await self.http_client.get(
+            f"{base_url.rstrip('/')}/models",
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=10.0,
+        )
+        response.raise_for_status()
+        return [
+            {
+                "id": model["id"],
+                "object": "model",
+                "created": int(model.get("created") or 0),
+                "owned_by": model.get("owned_by") or provider,
+            }
+            for model in response.json()["data"]
+            # Mistral also lists embedding and moderation models
+            if model.get("capabilities", {}).get("completion_chat", True)
+        ]
+
+    async def refresh(self) -> bool:
+        """List every provider's models; returns whether the lists changed
+
+        A provider that cannot be reached keeps its previous list.
+        """
+        discovered = dict(self.discovered)
+        for provider in self.endpoints:
+            try:
+                discovered[provider] = sorted(await self._list(provider), key=lambda m: m["id"])
+            except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+                logger.warning("Model discovery failed", provider=provider, error=str(e))
+        if discovered == self.discovered:
+            return False
+        self.discovered = discovered
+        self._build()
+        logger.info(
+            "Model list updated",
+            discovered={provider: len(models) for provider, models in discovered.items()},
+            etag=self.openai.etag,
+        )
+        return True
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Refresh in the background, when there is anything to discover"""
+        if self.endpoints and self.interval > 0 and self.http_client is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "models": self.count,
+            "discovered": {provider: len(models) for provider, models in self.discovered.items()},
+            "etag": self.openai.etag,
+        }
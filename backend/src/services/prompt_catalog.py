@@ -0,0 +1,102 @@
+"""System prompt variants, canonicalized and token-counted once at startup"""
+
+import hashlib
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+
+import structlog
+
+from config import MODEL_MAP
+from services.tokens import MESSAGE_OVERHEAD_TOKENS, TokenEstimator
+
+logger = structlog.get_logger(__name__)
+
+# Name of the variant used when no model or tenant rule applies
+DEFAULT_VARIANT = "default"
+
+
+def canonical(text: str) -> str:
+    """
+    Canonical byte layout of a prompt.
+
+    NFC-normalized, LF line endings, no trailing whitespace on any line and
+    no leading or trailing blank lines, so that the same prompt edited on
+    another machine or reformatted by an editor is sent byte for byte the
+    same and keeps hitting the upstream prefix cache.
+    """
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.split("\n")).strip("\n")
+
+
+@dataclass(frozen=True)
+class SystemPrompt:
+    """A system prompt variant with its precomputed cost"""
+
+    name: str
+    text: str
+    tokens: int  # Prompt tokens of the system message, template overhead included
+    digest: str  # Stable id of the text, used in cache keys
+
+    @classmethod
+    def build(cls, name: str, text: str, estimator: TokenEstimator) -> "SystemPrompt":
+        text = canonical(text)
+        return cls(
+            name,
+            text,
+            estimator.count(text) + MESSAGE_OVERHEAD_TOKENS,
+            hashlib.sha256(text.encode()).hexdigest()[:32],
+        )
+
+
+class PromptCatalog:
+    """System prompt of each request, chosen per tenant, then per model
+
+    Every variant is canonicalized and counted when the catalog is built, so
+    requests neither re-tokenize the prompt nor vary its bytes. The system
+    prompt always comes first in the upstream request, which makes it a
+    prefix shared by every request using the same variant.
+    """
+
+    def __init__(
+        self,
+        default: str,
+        variants: dict[str, str] = None,
+        models: dict[str, str] = None,
+        tenants: dict[str, str] = None,
+        estimator: TokenEstimator = None,
+    ):
+        estimator = estimator or TokenEstimator()
+        self.prompts = {DEFAULT_VARIANT: SystemPrompt.build(DEFAULT_VARIANT, default, estimator)}
+        for name, text in (variants or {}).items():
+            self.prompts[name] = SystemPrompt.build(name, text, estimator)
+        for rules in (models or {}, tenants or {}):
+            unknown = set(rules.values()) - self.prompts.keys()
+            if unknown:
+                raise ValueError(f"Unknown system prompt variants: {', '.join(sorted(unknown))}")
+        self.models = models or {}
+        self.tenants = tenants or {}
+        logger.info(
+            "System prompts loaded",
+            tokens={name: prompt.tokens for name, prompt in self.prompts.items()},
+        )
+
+    @classmethod
+    def from_files(cls, default: str, files: dict[str, str], **kwargs) -> "PromptCatalog":
+        """Catalog whose variants are read from text files (name -> path)"""
+        variants = {name: Path(path).read_text(encoding="utf-8") for name, path in files.items()}
+        return cls(default, variants, **kwargs)
+
+    @property
+    def default(self) -> SystemPrompt:
+        return self.prompts[DEFAULT_VARIANT]
+
+    def select(self, model: str, tenant: str | None = None) -> SystemPrompt:
+        """Variant of a tenant, else of the model (requested or upstream name), else default"""
+        name = (
+            (tenant is not None and self.tenants.get(tenant))
+            or self.models.get(model)
+            or self.models.get(MODEL_MAP.get(model, model))
+            or DEFAULT_VARIANT
+        )
+        return self.prompts[name]
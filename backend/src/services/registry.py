@@ -0,0 +1,132 @@
+"""Process-wide registry of warm LLM services"""
+
+import httpx
+import structlog
+
+from config import (
+    CONTEXT_MANAGER_ENABLED,
+    CONTEXT_SUMMARY_CACHE_SIZE,
+    CONTEXT_SUMMARY_MAX_TOKENS,
+    HEDGING_BUDGET,
+    HEDGING_ENABLED,
+    HEDGING_MIN_DELAY,
+    HEDGING_MIN_SAMPLES,
+    HEDGING_PERCENTILE,
+    LLM_PROVIDER,
+    MODEL_BACKENDS,
+    MODEL_CONTEXT_WINDOWS,
+    MODEL_HISTORY_BUDGETS,
+    ROUTER_COOLDOWN,
+    ROUTER_FAILURE_THRESHOLD,
+    ROUTER_LATENCY_SMOOTHING,
+    SYSTEM_PROMPT_MODELS,
+    SYSTEM_PROMPT_TENANTS,
+    SYSTEM_PROMPT_VARIANTS,
+)
+from core.http_client import create_http_client
+from core.metrics import Metrics
+from prompts import DEFAULT_SYSTEM_PROMPT
+from services.context import ContextManager
+from services.hedging import HedgePolicy
+from services.llm_service import LLMService
+from services.prompt_catalog import PromptCatalog
+from services.router import ProviderRouter
+from services.tokens import TokenEstimator
+
+logger = structlog.get_logger(__name__)
+
+
+class LLMServiceRegistry:
+    """Keep one LLMService per provider for the lifetime of the application
+
+    Each service caches one Agent per provider:model pair, so once a model
+    has been used the per-request cost of getting its agent is a dict lookup.
+    All services share one pooled upstream HTTP client, closed by aclose(),
+    and one provider router, so backend latency and health are tracked once.
+    They also share the prompt catalog, whose variants are loaded and counted
+    here, at startup. With a token estimator, they share one context manager,
+    which trims long chats to the budget of each model.
+    """
+
+    def __init__(
+        self,
+        system_prompt: str = None,
+        http_client: httpx.AsyncClient = None,
+        metrics: Metrics = None,
+        estimator: TokenEstimator = None,
+    ):
+        self.system_prompt = system_prompt
+        self.http_client = http_client or create_http_client()
+        self.metrics = metrics
+        self.router = ProviderRouter(
+            MODEL_BACKENDS,
+            default_provider=LLM_PROVIDER,
+            smoothing=ROUTER_LATENCY_SMOOTHING,
+            failure_threshold=ROUTER_FAILURE_THRESHOLD,
+            cooldown=ROUTER_COOLDOWN,
+            metrics=metrics,
+        )
+        self.hedging = (
+            HedgePolicy(
+                percentile=HEDGING_PERCENTILE,
+                budget=HEDGING_BUDGET,
+                min_delay=HEDGING_MIN_DELAY,
+                min_samples=HEDGING_MIN_SAMPLES,
+                metrics=metrics,
+            )
+            if HEDGING_ENABLED
+            else None
+        )
+        self.prompts = PromptCatalog.from_files(
+            system_prompt or DEFAULT_SYSTEM_PROMPT,
+            SYSTEM_PROMPT_VARIANTS,
+            models=SYSTEM_PROMPT_MODELS,
+            tenants=SYSTEM_PROMPT_TENANTS,
+            estimator=estimator,
+        )
+        self.context = (
+            ContextManager(
+                estimator,
+                MODEL_HISTORY_BUDGETS,
+                MODEL_CONTEXT_WINDOWS,
+                summary_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+                cache_size=CONTEXT_SUMMARY_CACHE_SIZE,
+                metrics=metrics,
+            )
+            if CONTEXT_MANAGER_ENABLED and estimator is not None
+            else None
+        )
+        self._services: dict[str, LLMService] = {}
+
+    def get(self, provider: str = None) -> LLMService:
+        """Get or create the service for a provider"""
+        provider = provider or LLM_PROVIDER
+        service = self._services.get(provider)
+        if service is None:
+            service = LLMService(
+                provider=provider,
+                system_prompt=self.system_prompt,
+                http_client=self.http_client,
+                metrics=self.metrics,
+                router=self.router,
+                hedging=self.hedging,
+                context=self.context,
+                prompts=self.prompts,
+            )
+            self._services[provider] = service
+        return service
+
+    def stats(self) -> dict[str, int]:
+        """Agent cache counters aggregated over all providers"""
+        services = self._services.values()
+        return {
+            "agents": sum(len(service._agents) for service in services),
+            "hits": sum(service.agent_cache_hits for service in services),
+            "misses": sum(service.agent_cache_misses for service in services),
+        }
+
+    async def aclose(self):
+        """Drop every cached service and agent, then close the upstream pool"""
+        logger.info("Closing LLM service registry", **self.stats())
+        self._services.clear()
+        await self.http_client.aclose()
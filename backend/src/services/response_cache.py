@@ -0,0 +1,172 @@
+"""Exact-match cache for completed LLM responses"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import AsyncGenerator
+from typing import Any
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+
+def request_key(
+    model: str,
+    messages: list[dict[str, str]],
+    temperature: float,
+    max_tokens: int,
+    system_prompt: str,
+) -> str:
+    """Canonical hash of everything that determines a completion"""
+    payload = json.dumps(
+        [model, messages, float(temperature), max_tokens, system_prompt],
+        ensure_ascii=False,
+        separators=(",", ":"),
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def replay_deltas(deltas: list[str], chunk_size: int = 0) -> AsyncGenerator[str, None]:
+    """
+    Replay recorded stream deltas.
+
+    Args:
+        deltas: Content deltas recorded from a finished stream.
+        chunk_size: Merge consecutive deltas until at least this many characters
+            are buffered. 0 replays the deltas exactly as recorded.
+    """
+    if chunk_size <= 0:
+        for delta in deltas:
+            yield delta
+        return
+
+    buffer = []
+    buffered = 0
+    for delta in deltas:
+        buffer.append(delta)
+        buffered += len(delta)
+        if buffered >= chunk_size:
+            yield "".join(buffer)
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+class ResponseCache:
+    """Two-tier LRU + TTL cache of JSON-serializable values
+
+    The in-memory tier is an OrderedDict used as an LRU. The optional disk tier
+    is a SQLite file that survives restarts; disk hits are promoted to memory.
+    At most every `purge_interval` seconds, the next `set` deletes the expired
+    rows and the oldest ones beyond `max_db_entries`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600,
+        db_path: str = None,
+        cache_sampled: bool = False,
+        max_db_entries: int = 65536,
+        purge_interval: float = 60,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_sampled = cache_sampled
+        self.max_db_entries = max_db_entries
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._db = self._open_db(db_path) if db_path else None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _open_db(db_path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+        return db
+
+    def accepts(self, temperature: float) -> bool:
+        """Sampled (temperature > 0) completions are only cached when allowed"""
+        return temperature <= 0 or self.cache_sampled
+
+    def get(self, key: str) -> Any | None:
+        """Return the cached value, or None on a miss"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] > time.time():
+                value = json.loads(row[0])
+                self._remember(key, value, row[1] - time.time())
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: Any):
+        """Store a value in every tier"""
+        self._remember(key, value, self.ttl)
+        if self._db is not None:
+            now = time.time()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl),
+            )
+            if now - self._purged_at >= self.purge_interval:
+                self.purge()
+
+    def purge(self):
+        """Delete expired rows and the oldest ones beyond max_db_entries from disk"""
+        self._purged_at = time.time()
+        expired = self._db.execute(
+            "DELETE FROM responses WHERE expires_at <= ?", (self._purged_at,)
+        ).rowcount
+        # Every row has the same TTL, so the earliest to expire are the oldest
+        evicted = self._db.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+            "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_db_entries,),
+        ).rowcount
+        if expired or evicted:
+            logger.info("Response cache purged", expired=expired, evicted=evicted)
+
+    def _remember(self, key: str, value: Any, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        """Hit and miss counters"""
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        """Purge the disk tier and close it"""
+        if self._db is not None:
+            self.purge()
+            self._db.close()
+            self._db = None
+        logger.info("Response cache closed", **self.stats())
@@ -0,0 +1,224 @@
+"""Provider router: latency-aware choice between backends of one logical model"""
+
+import time
+
+import httpx
+import structlog
+from pydantic_ai.exceptions import ModelHTTPError
+
+from config import MODEL_MAP
+from core.metrics import Metrics
+
+logger = structlog.get_logger(__name__)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Errors worth retrying on another backend: timeouts, transport errors, 429 and 5xx"""
+    if isinstance(error, ModelHTTPError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, httpx.TransportError | TimeoutError)
+
+
+class CircuitBreaker:
+    """Eject a backend after consecutive failures, probe it again after a cooldown"""
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        """Closed, or open long enough that probe calls may go through"""
+        return self.state != "open"
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            # A failed probe re-opens the breaker for another cooldown
+            self.opened_at = time.monotonic()
+
+
+class Backend:
+    """One upstream (provider, model) serving a logical model"""
+
+    def __init__(self, provider: str, model: str, breaker: CircuitBreaker):
+        self.provider = provider
+        self.model = model
+        self.breaker = breaker
+        # EWMAs of seconds for a whole non-streaming call and to a stream's
+        # first token: kept apart as they are not comparable
+        self.latency: float | None = None
+        self.ttft: float | None = None
+        self.in_flight = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+    def score(self, streaming: bool = False) -> float:
+        """Expected wait; untried backends score 0 so they get sampled"""
+        latency = self.ttft if streaming else self.latency
+        return (latency or 0.0) * (self.in_flight + 1)
+
+
+class Attempt:
+    """Context manager around one call to a backend
+
+    Tracks in-flight calls and feeds the outcome to the backend's latency (or
+    time to first token) average and circuit breaker. Cancellations and client
+    errors (4xx) say nothing about the backend's health and are not counted as
+    failures.
+    """
+
+    def __init__(self, router: "ProviderRouter", backend: Backend, streaming: bool = False):
+        self.router = router
+        self.backend = backend
+        self.streaming = streaming
+        self.started = 0.0
+        self.latency: float | None = None
+
+    def __enter__(self) -> "Attempt":
+        self.backend.in_flight += 1
+        self.started = time.perf_counter()
+        return self
+
+    def first_token(self):
+        """Record the time to first token of a stream"""
+        if self.latency is None:
+            self.latency = time.perf_counter() - self.started
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        backend = self.backend
+        backend.in_flight -= 1
+        if exc is None:
+            self.first_token()
+            self.router._observe(backend, self.latency, self.streaming)
+            backend.breaker.success()
+        elif isinstance(exc, Exception) and is_retryable(exc):
+            was_closed = backend.breaker.opened_at is None
+            backend.breaker.failure()
+            if was_closed and backend.breaker.opened_at is not None:
+                logger.warning(
+                    "Backend ejected", backend=backend.name, cooldown=backend.breaker.cooldown
+                )
+        return False
+
+
+class ProviderRouter:
+    """Order the backends of a logical model by expected latency
+
+    Backends come from `backends` (logical model -> ["provider:model", ...]),
+    looked up by the requested name and then by its MODEL_MAP target. Models
+    without an entry have a single backend on the default provider.
+    """
+
+    def __init__(
+        self,
+        backends: dict[str, list[str]] = None,
+        default_provider: str = "mistral",
+        smoothing: float = 0.3,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        metrics: Metrics = None,
+    ):
+        self.specs = dict(backends or {})
+        self.default_provider = default_provider
+        self.smoothing = smoothing
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.metrics = metrics
+        self._backends: dict[str, Backend] = {}  # Shared by every logical model using them
+        self._routes: dict[str, list[Backend]] = {}
+
+    def _backend(self, provider: str, model: str) -> Backend:
+        key = f"{provider}:{model}"
+        backend = self._backends.get(key)
+        if backend is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.cooldown)
+            backend = self._backends[key] = Backend(provider, model, breaker)
+        return backend
+
+    def backends(self, model: str) -> list[Backend]:
+        """Every backend registered for a logical model"""
+        route = self._routes.get(model)
+        if route is None:
+            upstream = MODEL_MAP.get(model, model)
+            specs = self.specs.get(model) or self.specs.get(upstream)
+            if specs:
+                route = [self._backend(*spec.split(":", 1)) for spec in specs]
+            else:
+                route = [self._backend(self.default_provider, upstream)]
+            self._routes[model] = route
+        return route
+
+    def register(self, model: str, providers: list[str]):
+        """
+        Route a model discovered upstream to the providers listing it.
+
+        Models with configured backends, or served by the default provider,
+        keep their route.
+        """
+        if model in self.specs or self.default_provider in providers:
+            return
+        self.specs[model] = [f"{provider}:{model}" for provider in providers]
+        self._routes.pop(model, None)
+
+    def candidates(self, model: str, streaming: bool = False) -> list[Backend]:
+        """
+        Backends to try in order: available ones by score, then ejected ones.
+
+        Streams are scored by time to first token, other calls by latency.
+
+        Ejected backends are kept as a last resort so that an outage of every
+        backend still gets a real upstream error rather than none at all.
+        """
+        backends = self.backends(model)
+        if len(backends) == 1:
+            return backends
+        available = [backend for backend in backends if backend.breaker.available()]
+        ejected = [backend for backend in backends if not backend.breaker.available()]
+        return sorted(available, key=lambda backend: backend.score(streaming)) + ejected
+
+    def attempt(self, backend: Backend, streaming: bool = False) -> Attempt:
+        """Track one call to a backend: `with router.attempt(backend) as attempt:`"""
+        return Attempt(self, backend, streaming)
+
+    def failover(self, backend: Backend, error: Exception):
+        """Record that a call moves on from a failed backend"""
+        logger.warning("Failing over to next backend", backend=backend.name, error=str(error))
+        if self.metrics is not None:
+            self.metrics.upstream_failovers.inc(backend.provider, backend.model)
+
+    def _observe(self, backend: Backend, latency: float, streaming: bool):
+        average = backend.ttft if streaming else backend.latency
+        if average is not None:
+            latency = average + self.smoothing * (latency - average)
+        if streaming:
+            backend.ttft = latency
+        else:
+            backend.latency = latency
+
+    def stats(self) -> dict[str, dict]:
+        """Latency, load and breaker state of every backend"""
+        return {
+            name: {
+                "latency": backend.latency,
+                "ttft": backend.ttft,
+                "in_flight": backend.in_flight,
+                "state": backend.breaker.state,
+            }
+            for name, backend in self._backends.items()
+        }
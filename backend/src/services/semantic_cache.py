@@ -0,0 +1,197 @@
+"""Semantic cache: answer near-duplicate questions from a local vector index"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+from collections.abc import Callable
+
+import numpy as np
+import structlog
+from tokenizers import Tokenizer
+
+logger = structlog.get_logger(__name__)
+
+_SAFETENSORS_DTYPES = {"F32": np.float32, "F16": np.float16}
+
+
+def _load_safetensors_matrix(path: str) -> np.ndarray:
+    """Memory-map the embedding matrix stored in a safetensors file"""
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    name = "embeddings" if "embeddings" in header else next(iter(header))
+    tensor = header[name]
+    start, _ = tensor["data_offsets"]
+    return np.memmap(
+        path,
+        dtype=_SAFETENSORS_DTYPES[tensor["dtype"]],
+        mode="r",
+        offset=8 + header_size + start,
+        shape=tuple(tensor["shape"]),
+    )
+
+
+class StaticEmbedder:
+    """Sentence embeddings from a static token embedding table
+
+    Works with model2vec-style models (tokenizer.json + model.safetensors):
+    a sentence vector is the normalized mean of its token vectors, which
+    takes microseconds on CPU and needs no deep learning runtime.
+    """
+
+    def __init__(self, tokenizer_path: str, weights_path: str):
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.vectors = _load_safetensors_matrix(weights_path)
+        self.dim = self.vectors.shape[1]
+
+    @classmethod
+    def from_pretrained(cls, repo_id: str) -> "StaticEmbedder":
+        """Load a model from the Hugging Face Hub (or its local cache)"""
+        from huggingface_hub import hf_hub_download
+
+        return cls(
+            hf_hub_download(repo_id, "tokenizer.json"),
+            hf_hub_download(repo_id, "model.safetensors"),
+        )
+
+    def __call__(self, text: str) -> np.ndarray:
+        ids = self.tokenizer.encode(text, add_special_tokens=False).ids
+        if not ids:
+            return np.zeros(self.dim, dtype=np.float32)
+        vector = self.vectors[ids].astype(np.float32).mean(axis=0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def semantic_query(
+    model: str, messages: list[dict[str, str]], system_prompt: str
+) -> tuple[str, str] | None:
+    """
+    Scope and question for a semantic lookup.
+
+    Only fresh questions qualify: a single user turn, optionally preceded by
+    system messages. Answers in a longer conversation depend on its history.
+
+    Returns:
+        The scope (hash of model and system prompts) and the user question,
+        or None if the request is not eligible.
+    """
+    question = None
+    scope = hashlib.sha256(f"{model}\0{system_prompt}".encode())
+    for message in messages:
+        if message["role"] == "system":
+            scope.update(f"\0{message['content']}".encode())
+        elif message["role"] == "user" and question is None:
+            question = message["content"]
+        else:
+            return None
+    if question is None:
+        return None
+    return scope.hexdigest(), question
+
+
+class SemanticCache:
+    """Nearest-neighbour answer cache over a NumPy vector index
+
+    Vectors live in a fixed-size ring buffer. With a path, the buffer is a
+    memory-mapped file next to a SQLite file holding the answers, so the
+    index is available immediately after a restart without re-embedding.
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[str], np.ndarray],
+        dim: int,
+        path: str = None,
+        capacity: int = 10000,
+        threshold: float = 0.92,
+    ):
+        self.embed = embed
+        self.dim = dim
+        self.capacity = capacity
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._scopes = np.zeros(capacity, dtype=np.int64)
+        self._vectors = self._open_vectors(path)
+        self._db = sqlite3.connect(
+            f"{path}.db" if path else ":memory:", check_same_thread=False, isolation_level=None
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers "
+            "(slot INTEGER PRIMARY KEY, scope INTEGER NOT NULL, answer TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        for slot, scope in self._db.execute("SELECT slot, scope FROM answers"):
+            self._scopes[slot] = scope
+        self.size = self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'next_slot'").fetchone()
+        self._next_slot = row[0] if row else 0
+        logger.info("Semantic cache loaded", entries=self.size, persistent=bool(path))
+
+    def _open_vectors(self, path: str | None) -> np.ndarray:
+        shape = (self.capacity, self.dim)
+        if path is None:
+            return np.zeros(shape, dtype=np.float32)
+
+        vectors_path = f"{path}.f32"
+        expected_size = self.capacity * self.dim * np.dtype(np.float32).itemsize
+        if os.path.exists(vectors_path) and os.path.getsize(vectors_path) != expected_size:
+            logger.warning("Semantic index shape changed, rebuilding", path=vectors_path)
+            os.remove(vectors_path)
+            if os.path.exists(f"{path}.db"):
+                os.remove(f"{path}.db")
+        mode = "r+" if os.path.exists(vectors_path) else "w+"
+        return np.memmap(vectors_path, dtype=np.float32, mode=mode, shape=shape)
+
+    @staticmethod
+    def _scope_id(scope: str) -> int:
+        digest = hashlib.blake2b(scope.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little", signed=True)
+
+    def lookup(self, scope: str, question: str) -> tuple[str, float] | None:
+        """Best stored answer within the similarity threshold, with its score"""
+        if not self.size:
+            self.misses += 1
+            return None
+
+        scores = self._vectors[: self.size] @ self.embed(question)
+        scores[self._scopes[: self.size] != self._scope_id(scope)] = -1.0
+        slot = int(np.argmax(scores))
+        score = float(scores[slot])
+        if score < self.threshold:
+            self.misses += 1
+            return None
+
+        row = self._db.execute("SELECT answer FROM answers WHERE slot = ?", (slot,)).fetchone()
+        self.hits += 1
+        return row[0], score
+
+    def add(self, scope: str, question: str, answer: str):
+        """Index an answered question, overwriting the oldest entry when full"""
+        slot = self._next_slot
+        self._vectors[slot] = self.embed(question)
+        self._scopes[slot] = self._scope_id(scope)
+        self._db.execute(
+            "INSERT OR REPLACE INTO answers (slot, scope, answer) VALUES (?, ?, ?)",
+            (slot, self._scopes[slot].item(), answer),
+        )
+        self._next_slot = (slot + 1) % self.capacity
+        self._db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_slot', ?)", (self._next_slot,)
+        )
+        self.size = min(self.size + 1, self.capacity)
+
+    def stats(self) -> dict[str, int]:
+        """Hit and miss counters"""
+        return {"entries": self.size, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        """Flush the vector file and close the answer store"""
+        if isinstance(self._vectors, np.memmap):
+            self._vectors.flush()
+        self._db.close()
+        logger.info("Semantic cache closed", **self.stats())
@@ -0,0 +1,178 @@
+"""Request coalescing: identical in-flight requests share one upstream call"""
+
+import asyncio
+from collections.abc import AsyncGenerator, AsyncIterator, Awaitable, Callable
+from typing import Any, TypeVar
+
+import structlog
+
+logger = structlog.get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class StreamBroadcast:
+    """Fan one upstream stream out to any number of subscribers
+
+    Every chunk is kept in a buffer, so a subscriber that joins late first
+    replays the stream from the start and then follows it live. The upstream
+    is cancelled as soon as the last subscriber goes away.
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[str],
+        on_done: Callable[["StreamBroadcast"], None] = None,
+        state: Any = None,
+    ):
+        self.state = state  # Filled by the source, shared with every subscriber
+        self._chunks: list[str] = []
+        self._error: Exception | None = None
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self._on_done = on_done
+        self.done = False
+        self._task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self._chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            self._error = e
+        finally:
+            self.done = True
+            self._notify()
+            if self._on_done is not None:
+                self._on_done(self)
+
+    def _notify(self):
+        # Wake current waiters; later waiters get a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def subscribe(self) -> "Subscription":
+        """Iterate the stream from its first chunk"""
+        self._subscribers += 1
+        return Subscription(self)
+
+    def _unsubscribe(self):
+        self._subscribers -= 1
+        if not self._subscribers and not self.done:
+            self._task.cancel()
+
+    async def _follow(self) -> AsyncGenerator[str, None]:
+        position = 0
+        while True:
+            while position < len(self._chunks):
+                yield self._chunks[position]
+                position += 1
+            if self.done:
+                if self._error is not None:
+                    raise self._error
+                return
+            await self._changed.wait()
+
+
+class Subscription:
+    """One subscriber of a StreamBroadcast, holding its place until it ends
+
+    The place is given up when the stream is exhausted, fails or is closed,
+    and also when the subscription is dropped without ever being iterated
+    (e.g. the client left before the response started): a generator that
+    never started runs no cleanup code, so that case needs a finalizer.
+    """
+
+    def __init__(self, broadcast: StreamBroadcast):
+        self._broadcast = broadcast
+        self._chunks = broadcast._follow()
+        self._released = False
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self._chunks.__anext__()
+        except BaseException:
+            self._release()
+            raise
+
+    async def aclose(self):
+        try:
+            await self._chunks.aclose()
+        finally:
+            self._release()
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._broadcast._unsubscribe()
+
+    def __del__(self):
+        self._release()
+
+
+class SingleFlight:
+    """Deduplicate identical concurrent completions by canonical request key"""
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+        self._streams: dict[str, StreamBroadcast] = {}
+        self.shared = 0  # Requests served by joining an in-flight call
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run fn once for all concurrent callers with the same key"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(self._calls, key, task))
+        else:
+            self.shared += 1
+            logger.debug("Joining in-flight completion", key=key)
+        # A caller giving up must not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def stream(
+        self, key: str, factory: Callable[[], AsyncIterator[str]], state: Any = None
+    ) -> tuple[Subscription, Any]:
+        """
+        Subscribe to the in-flight stream for key, starting it if needed.
+
+        Args:
+            key: Canonical request key.
+            factory: Opens the upstream stream; only called when starting.
+            state: Object the stream fills as it runs (e.g. token usage).
+
+        Returns:
+            The subscription, and the state of the stream actually joined:
+            the caller's own state if it started the stream, the starter's
+            otherwise.
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = StreamBroadcast(
+                factory(),
+                on_done=lambda done: self._forget(self._streams, key, done),
+                state=state,
+            )
+            self._streams[key] = broadcast
+        else:
+            self.shared += 1
+            logger.debug("Joining in-flight stream", key=key)
+        return broadcast.subscribe(), broadcast.state
+
+    def in_flight(self, key: str) -> bool:
+        """Whether a call or stream for key is running and can be joined"""
+        return key in self._calls or key in self._streams
+
+    @staticmethod
+    def _forget(flights: dict, key: str, flight):
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def stats(self) -> dict[str, int]:
+        """In-flight and shared request counters"""
+        return {"in_flight": len(self._calls) + len(self._streams), "shared": self.shared}
@@ -0,0 +1,100 @@
+"""Token usage accounting and local token estimation"""
+
+import math
+from dataclasses import dataclass
+
+import structlog
+from pydantic_ai.usage import RunUsage
+from tokenizers import Tokenizer
+
+logger = structlog.get_logger(__name__)
+
+# Per-message overhead of the chat template (role and control tokens)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Characters per token used when no tokenizer is available
+FALLBACK_CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class TokenUsage:
+    """Token counts of one completion, in OpenAI terms"""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0  # Prompt tokens read from the provider's prefix cache
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def update(self, usage: RunUsage):
+        """Copy the counts reported by a Pydantic AI run"""
+        self.prompt_tokens = usage.input_tokens
+        self.completion_tokens = usage.output_tokens
+        self.cached_tokens = usage.cache_read_tokens
+
+    @classmethod
+    def from_dict(cls, data: dict[str, int]) -> "TokenUsage":
+        details = data.get("prompt_tokens_details") or {}
+        return cls(
+            data["prompt_tokens"], data["completion_tokens"], details.get("cached_tokens", 0)
+        )
+
+    def as_dict(self) -> dict[str, int]:
+        """OpenAI `usage` object, with cached prompt tokens when there are any"""
+        usage = {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+        }
+        if self.cached_tokens:
+            usage["prompt_tokens_details"] = {"cached_tokens": self.cached_tokens}
+        return usage
+
+
+class TokenEstimator:
+    """Fast local token counts for pre-flight budget checks
+
+    Uses the Mistral tokenizer (tokenizers, Rust) when one is configured and
+    falls back to a characters-per-token heuristic otherwise.
+    """
+
+    def __init__(self, tokenizer: Tokenizer = None):
+        self.tokenizer = tokenizer
+
+    @classmethod
+    def load(cls, path: str = None, repo_id: str = None) -> "TokenEstimator":
+        """Load a tokenizer.json from a local path or a Hugging Face repo"""
+        try:
+            if path:
+                return cls(Tokenizer.from_file(path))
+            if repo_id:
+                return cls(Tokenizer.from_pretrained(repo_id))
+        except Exception as e:
+            logger.warning("Tokenizer unavailable, estimating tokens", error=str(e))
+        return cls()
+
+    def count(self, text: str) -> int:
+        """Number of tokens in a text"""
+        if self.tokenizer is None:
+            return math.ceil(len(text) / FALLBACK_CHARS_PER_TOKEN)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_messages(self, messages: list[dict[str, str]], system_prompt: str = "") -> int:
+        """Prompt tokens of a chat request, system prompt included"""
+        total = self.count(system_prompt) + MESSAGE_OVERHEAD_TOKENS if system_prompt else 0
+        for message in messages:
+            total += self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        return total
+
+    def estimate_usage(
+        self, messages: list[dict[str, str]], system_tokens: int, completion: str
+    ) -> TokenUsage:
+        """Usage of a completion that did not come from the provider
+
+        `system_tokens` is the precomputed cost of the service system prompt.
+        """
+        return TokenUsage(
+            prompt_tokens=self.count_messages(messages) + system_tokens,
+            completion_tokens=self.count(completion),
+        )
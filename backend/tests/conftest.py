@@ -2,11 +2,13 @@
 
 import os
 import sys
+from functools import partial
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from fastapi.testclient import TestClient
+from pydantic_ai.usage import RunUsage
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
@@ -32,7 +34,8 @@ def mock_agent():
 
     # Mock run() for non-streaming
     mock_result = MagicMock()
-    mock_result.data = "Mocked LLM response"
+    mock_result.output = "Mocked LLM response"
+    mock_result.usage = MagicMock(return_value=RunUsage(input_tokens=12, output_tokens=3))
     mock.run = AsyncMock(return_value=mock_result)
 
     # Mock run_stream() for streaming
@@ -43,12 +46,15 @@ def mock_agent():
         async def __aexit__(self, *args):
             pass
 
-        async def stream_text(self, delta=False):
+        async def stream_text(self, delta=False, debounce_by=0.1):
             """Stream text chunks"""
             chunks = ["Hello", " ", "World", "!"]
             for chunk in chunks:
                 yield chunk
 
+        def usage(self):
+            return RunUsage(input_tokens=12, output_tokens=4)
+
     mock.run_stream = MagicMock(return_value=MockStreamResponse())
 
     return mock
@@ -72,34 +78,45 @@ def mock_mistral_model():
 @pytest.fixture
 def mock_llm_service(mock_agent):
     """Mock LLMService for API tests"""
-    with patch("services.llm_service.LLMService") as mock_service_class:
-        mock_instance = MagicMock()
+    from services.llm_service import Completion, LLMService
+    from services.prompt_catalog import PromptCatalog
+    from services.tokens import TokenUsage
 
-        # Mock generate_completion to return the mocked data
-        async def mock_generate(*args, **kwargs):
-            return "Mocked LLM response"
+    mock_instance = MagicMock()
+    mock_instance.system_prompt = "Mocked system prompt"
+    mock_instance.context = None  # Keep the pre-flight context length check
+    mock_instance.prompts = PromptCatalog(mock_instance.system_prompt)
 
-        mock_instance.generate_completion = AsyncMock(side_effect=mock_generate)
+    # Mock generate_completion to return the mocked data
+    async def mock_generate(*args, **kwargs):
+        return Completion("Mocked LLM response", TokenUsage(prompt_tokens=12, completion_tokens=3))
 
-        # Mock stream_completion
-        async def mock_stream(*args, **kwargs):
-            chunks = ["Hello", " ", "World", "!"]
-            for chunk in chunks:
-                yield chunk
+    mock_instance.generate_completion = AsyncMock(side_effect=mock_generate)
+
+    # Mock stream_completion
+    async def mock_stream(*args, usage=None, **kwargs):
+        chunks = ["Hello", " ", "World", "!"]
+        for chunk in chunks:
+            yield chunk
+        if usage is not None:
+            usage.prompt_tokens, usage.completion_tokens = 12, 4
 
-        mock_instance.stream_completion = mock_stream
+    mock_instance.stream_completion = mock_stream
+    mock_instance.generate_batch = partial(LLMService.generate_batch, mock_instance)
 
-        mock_service_class.return_value = mock_instance
-        yield mock_service_class
+    yield mock_instance
 
 
 @pytest.fixture
 def client(mock_env, mock_llm_service):
     """FastAPI test client with mocked LLM"""
-    # Import after mocking to ensure mocks are in place
+    from api.dependencies import get_llm_service
     from src.main import app
 
-    return TestClient(app)
+    app.dependency_overrides[get_llm_service] = lambda: mock_llm_service
+    with TestClient(app) as test_client:
+        yield test_client
+    app.dependency_overrides.clear()
 
 
 @pytest.fixture
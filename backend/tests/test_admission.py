@@ -0,0 +1,222 @@
+"""Unit tests for admission control"""
+
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from src.core.metrics import Metrics
+from src.services.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    SharedTokenBucket,
+    TokenBucket,
+)
+
+
+class TestTokenBucket:
+    """Test the per-minute budget"""
+
+    def test_reserve_within_budget(self):
+        """Test that reservations within the budget need no wait"""
+        bucket = TokenBucket(60)
+
+        assert bucket.reserve(30) == 0
+        assert bucket.reserve(30) == 0
+
+    def test_deficit_gives_wait_time(self):
+        """Test the wait needed to cover an overdraft"""
+        bucket = TokenBucket(60)  # One per second
+        bucket.reserve(60)
+
+        assert bucket.reserve(2) == pytest.approx(2, abs=0.01)
+
+    def test_refund(self):
+        """Test that unused reservations are given back"""
+        bucket = TokenBucket(60)
+        bucket.reserve(60)
+        bucket.refund(60)
+
+        assert bucket.reserve(60) == 0
+
+
+class TestSharedTokenBucket:
+    """Test the budget shared by worker processes"""
+
+    def test_workers_draw_from_one_budget(self, tmp_path):
+        """Test that two buckets on the same file share their level"""
+        path = str(tmp_path / "ratelimits.db")
+        first = SharedTokenBucket(60, path, "rpm")
+        second = SharedTokenBucket(60, path, "rpm")
+
+        assert first.reserve(60) == 0
+        assert second.reserve(2) == pytest.approx(2, abs=0.05)
+
+        second.refund(62)
+        assert first.reserve(60) == 0
+        first.close()
+        second.close()
+
+    def test_busy_file_does_not_block(self, tmp_path):
+        """Test that a locked file defers the change instead of waiting"""
+        path = str(tmp_path / "ratelimits.db")
+        first = SharedTokenBucket(60, path, "rpm")
+        second = SharedTokenBucket(60, path, "rpm")
+        lock = sqlite3.connect(path, isolation_level=None)
+        lock.execute("BEGIN IMMEDIATE")
+
+        started = time.monotonic()
+        assert first.reserve(30) == 0
+        assert time.monotonic() - started < 0.5
+        lock.execute("ROLLBACK")
+
+        assert first.reserve(10) == 0  # Carries the deferred 30 over
+        assert second.reserve(22) == pytest.approx(2, abs=0.05)
+        lock.close()
+        first.close()
+        second.close()
+
+    def test_buckets_are_independent_by_name(self, tmp_path):
+        path = str(tmp_path / "ratelimits.db")
+        rpm = SharedTokenBucket(60, path, "rpm")
+        tpm = SharedTokenBucket(60, path, "tpm")
+
+        rpm.reserve(60)
+
+        assert tpm.reserve(60) == 0
+        rpm.close()
+        tpm.close()
+
+    def test_controller_uses_shared_buckets(self, tmp_path):
+        admission = AdmissionController(rpm=60, tpm=0, shared_db=str(tmp_path / "rl.db"))
+
+        assert isinstance(admission.rpm, SharedTokenBucket)
+        assert admission.tpm is None
+        admission.close()
+
+
+class TestAdmissionController:
+    """Test slots, queueing and load shedding"""
+
+    @pytest.mark.asyncio
+    async def test_admits_up_to_limit(self):
+        """Test that requests within the limit are admitted immediately"""
+        controller = AdmissionController(max_concurrency=2)
+
+        first = await controller.acquire("m")
+        await controller.acquire("m")
+
+        assert controller.stats()["m"] == {"active": 2, "limit": 2, "queued": 0}
+        first.release()
+        first.release()  # Idempotent
+        assert controller.stats()["m"]["active"] == 1
+
+    @pytest.mark.asyncio
+    async def test_queue_respects_priority(self):
+        """Test that freed slots go to the highest priority, then FIFO"""
+        controller = AdmissionController(max_concurrency=1)
+        holder = await controller.acquire("m")
+        order = []
+
+        async def wait(name, priority):
+            admission = await controller.acquire("m", priority=priority)
+            order.append(name)
+            admission.release()
+
+        tasks = [
+            asyncio.create_task(wait("low", 0)),
+            asyncio.create_task(wait("high", 5)),
+            asyncio.create_task(wait("low-2", 0)),
+        ]
+        await asyncio.sleep(0)
+        assert controller.stats()["m"]["queued"] == 3
+
+        holder.release()
+        await asyncio.gather(*tasks)
+
+        assert order == ["high", "low", "low-2"]
+        assert controller.stats()["m"] == {"active": 0, "limit": 1, "queued": 0}
+
+    @pytest.mark.asyncio
+    async def test_models_have_separate_limits(self):
+        """Test per-model slot overrides"""
+        controller = AdmissionController(max_concurrency=1, model_limits={"big": 2})
+
+        await controller.acquire("big")
+        await controller.acquire("big")
+        await controller.acquire("small")
+
+        assert controller.stats()["big"]["active"] == 2
+        assert controller.stats()["small"]["active"] == 1
+
+    @pytest.mark.asyncio
+    async def test_sheds_when_queue_full(self):
+        """Test immediate rejection once the queue is full"""
+        metrics = Metrics()
+        controller = AdmissionController(max_concurrency=1, max_queue=0, metrics=metrics)
+        await controller.acquire("m")
+
+        with pytest.raises(AdmissionRejected) as exc_info:
+            await controller.acquire("m")
+
+        assert exc_info.value.reason == "queue_full"
+        assert exc_info.value.retry_after >= 1
+        assert metrics.admission_rejections.values == {("m", "queue_full"): 1}
+
+    @pytest.mark.asyncio
+    async def test_rejects_after_max_wait(self):
+        """Test that queued requests give up after max_wait"""
+        controller = AdmissionController(max_concurrency=1, max_wait=0.01)
+        await controller.acquire("m")
+
+        with pytest.raises(AdmissionRejected) as exc_info:
+            await controller.acquire("m")
+
+        assert exc_info.value.reason == "timeout"
+        assert controller.stats()["m"]["queued"] == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_leaves_queue(self):
+        """Test that a caller going away does not keep its place or a slot"""
+        controller = AdmissionController(max_concurrency=1)
+        holder = await controller.acquire("m")
+        waiter = asyncio.create_task(controller.acquire("m"))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        holder.release()
+
+        assert controller.stats()["m"] == {"active": 0, "limit": 1, "queued": 0}
+
+    @pytest.mark.asyncio
+    async def test_rate_limited_beyond_budget(self):
+        """Test rejection when the token budget cannot cover the request in time"""
+        controller = AdmissionController(tpm=600, max_wait=1)
+        admission = await controller.acquire("m", tokens=600)
+
+        with pytest.raises(AdmissionRejected) as exc_info:
+            await controller.acquire("m", tokens=100)
+
+        assert exc_info.value.reason == "rate_limited"
+        assert exc_info.value.retry_after == 10
+        assert controller.stats()["m"]["active"] == 1
+
+        admission.release(used_tokens=100)  # Unused reservation is refunded
+        await controller.acquire("m", tokens=100)
+
+    @pytest.mark.asyncio
+    async def test_try_acquire_never_waits(self):
+        """Test that try_acquire admits only when a slot and budget are free"""
+        controller = AdmissionController(max_concurrency=1, tpm=600)
+
+        hedge = controller.try_acquire("m", tokens=100)
+        assert hedge is not None
+        assert controller.try_acquire("m", tokens=100) is None  # No slot left
+        hedge.release(used_tokens=100)
+
+        assert controller.try_acquire("m", tokens=1000) is None  # Beyond the budget
+        assert controller.stats()["m"]["active"] == 0
+        assert controller.tpm.level == pytest.approx(500, abs=1)
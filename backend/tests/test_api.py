@@ -1,6 +1,14 @@
 """Integration tests for API endpoints"""
 
+import asyncio
 import json
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from services.llm_service import Completion
+from services.tokens import TokenUsage
 
 
 class TestHealthEndpoints:
@@ -28,6 +36,47 @@ class TestHealthEndpoints:
         assert data["status"] == "healthy"
         assert "api" in data
         assert data["api"]["mistral"] is True
+        assert set(data["agents"]) == {"agents", "hits", "misses"}
+
+    def test_request_id_generated(self, client, mock_env):
+        first = client.get("/").headers["x-request-id"]
+
+        assert first
+        assert client.get("/").headers["x-request-id"] != first
+
+    def test_request_id_from_client(self, client, mock_env):
+        response = client.get("/", headers={"X-Request-Id": "req-42"})
+
+        assert response.headers["x-request-id"] == "req-42"
+
+
+class TestMetricsEndpoint:
+    """Test /metrics endpoint"""
+
+    def test_metrics_after_stream(self, client, mock_env):
+        """Test that a stream is reflected in the Prometheus metrics"""
+        client.post(
+            "/v1/chat/completions",
+            json={
+                "model": "mistral-large",
+                "messages": [{"role": "user", "content": "Hello"}],
+                "stream": True,
+                "temperature": 0,
+            },
+        )
+
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        labels = 'endpoint="chat_completions",model="mistral-large"'
+        assert f'kairn_requests_total{{{labels},stream="true"}} 1' in response.text
+        assert f"kairn_time_to_first_token_seconds_count{{{labels}}} 1" in response.text
+        assert f"kairn_active_streams{{{labels}}} 0" in response.text
+        assert f'kairn_cache_lookups_total{{{labels},cache="exact",result="miss"}} 1' in (
+            response.text
+        )
+        assert f'kairn_tokens_total{{{labels},type="completion"}} 4' in response.text
 
 
 class TestModelsEndpoint:
@@ -72,6 +121,23 @@ class TestModelsEndpoint:
         assert "mistral-large" in model_ids
         assert "mistral-medium" in model_ids
 
+    def test_models_revalidated_with_etag(self, client, mock_env):
+        """Test that a client holding the current list gets a 304"""
+        response = client.get("/v1/models")
+        etag = response.headers["etag"]
+
+        assert "max-age=" in response.headers["cache-control"]
+        assert client.get("/v1/models").content == response.content
+        cached = client.get("/v1/models", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert cached.headers["etag"] == etag
+
+    def test_ollama_tags_revalidated_with_etag(self, client, mock_env):
+        etag = client.get("/api/tags").headers["etag"]
+
+        assert client.get("/api/tags", headers={"If-None-Match": etag}).status_code == 304
+
 
 class TestChatCompletionsEndpoint:
     """Test /v1/chat/completions endpoint (OpenAI format)"""
@@ -171,6 +237,261 @@ class TestChatCompletionsEndpoint:
         data = response.json()
         assert data["object"] == "chat.completion"
 
+    def test_chat_non_streaming_cache(self, client, mock_env, mock_llm_service):
+        """Test that identical deterministic requests are served from the cache"""
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Suggest a title"}],
+            "stream": False,
+            "temperature": 0,
+        }
+
+        first = client.post("/v1/chat/completions", json=request_data)
+        second = client.post("/v1/chat/completions", json=request_data)
+
+        assert first.headers["X-Cache"] == "MISS"
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.json()["choices"][0]["message"]["content"] == "Mocked LLM response"
+        assert mock_llm_service.generate_completion.call_count == 1
+
+        health = client.get("/health").json()
+        assert health["response_cache"]["hits"] == 1
+        assert health["response_cache"]["misses"] == 1
+
+    def test_chat_cache_scoped_by_system_prompt(self, client, mock_env, mock_llm_service):
+        """Test that tenants with their own system prompt get their own answers"""
+        from services.prompt_catalog import PromptCatalog
+
+        mock_llm_service.prompts = PromptCatalog(
+            "Mocked system prompt", {"acme": "Acme prompt"}, tenants={"acme": "acme"}
+        )
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Suggest a name"}],
+            "stream": False,
+            "temperature": 0,
+        }
+
+        client.post("/v1/chat/completions", json=request_data)
+        response = client.post(
+            "/v1/chat/completions", json=request_data, headers={"X-Tenant-Id": "acme"}
+        )
+
+        assert response.headers["X-Cache"] == "MISS"
+        assert mock_llm_service.generate_completion.call_args.kwargs["tenant"] == "acme"
+
+    def test_chat_non_streaming_cache_bypass(self, client, mock_env, mock_llm_service):
+        """Test that sampled requests bypass the cache"""
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Tell me a story"}],
+            "stream": False,
+            "temperature": 0.7,
+        }
+
+        client.post("/v1/chat/completions", json=request_data)
+        response = client.post("/v1/chat/completions", json=request_data)
+
+        assert response.headers["X-Cache"] == "BYPASS"
+        assert mock_llm_service.generate_completion.call_count == 2
+
+    def test_chat_streaming_replay(self, client, mock_env, mock_llm_service):
+        """Test that a finished deterministic stream is replayed on the next request"""
+        calls = []
+
+        async def mock_stream(*args, **kwargs):
+            calls.append(kwargs)
+            for chunk in ["Hello", " ", "World", "!"]:
+                yield chunk
+
+        mock_llm_service.stream_completion = mock_stream
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Say hello"}],
+            "stream": True,
+            "temperature": 0,
+        }
+
+        first = client.post("/v1/chat/completions", json=request_data)
+        second = client.post("/v1/chat/completions", json=request_data)
+
+        assert first.headers["X-Cache"] == "MISS"
+        assert second.headers["X-Cache"] == "HIT"
+        assert len(calls) == 1
+        assert first.text.count("data: ") == second.text.count("data: ")
+        assert "World" in second.text
+        assert second.text.endswith("data: [DONE]\n\n")
+
+    def test_chat_streaming_error_not_replayed(self, client, mock_env, mock_llm_service):
+        """Test that failed streams are not recorded"""
+        calls = []
+
+        async def mock_stream(*args, **kwargs):
+            calls.append(kwargs)
+            yield "Error: upstream unavailable"
+
+        mock_llm_service.stream_completion = mock_stream
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Say hello"}],
+            "stream": True,
+            "temperature": 0,
+        }
+
+        client.post("/v1/chat/completions", json=request_data)
+        response = client.post("/v1/chat/completions", json=request_data)
+
+        assert response.headers["X-Cache"] == "MISS"
+        assert len(calls) == 2
+
+    def test_coalesced_stream_error_not_replayed(
+        self, client, mock_env, mock_llm_service, monkeypatch
+    ):
+        """Test that a mid-stream error is recognized when deltas are coalesced"""
+        import api.openai_routes
+
+        monkeypatch.setattr(api.openai_routes, "STREAM_COALESCE_MAX_CHARS", 64)
+        calls = []
+
+        async def mock_stream(*args, **kwargs):
+            calls.append(kwargs)
+            yield "partial answer "
+            yield "Error: upstream 500"
+
+        mock_llm_service.stream_completion = mock_stream
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Say hello"}],
+            "stream": True,
+            "temperature": 0,
+        }
+
+        client.post("/v1/chat/completions", json=request_data)
+        response = client.post("/v1/chat/completions", json=request_data)
+
+        assert response.headers["X-Cache"] == "MISS"
+        assert len(calls) == 2
+
+    def test_chat_semantic_cache(self, client, mock_env, mock_llm_service):
+        """Test that a reworded question is answered by the semantic cache"""
+        from src.services.semantic_cache import SemanticCache
+
+        def embed(text):
+            return np.array([1.0, 0.0] if "cloud" in text else [0.0, 1.0], dtype=np.float32)
+
+        client.app.state.semantic_cache = SemanticCache(embed, 2, threshold=0.9)
+        request_data = {"model": "mistral-large", "stream": False}
+
+        first = client.post(
+            "/v1/chat/completions",
+            json={**request_data, "messages": [{"role": "user", "content": "What is cloud?"}]},
+        )
+        second = client.post(
+            "/v1/chat/completions",
+            json={**request_data, "messages": [{"role": "user", "content": "Explain cloud"}]},
+        )
+
+        assert first.headers["X-Cache"] == "MISS"
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.headers["X-Cache-Similarity"] == "1.000"
+        assert mock_llm_service.generate_completion.call_count == 1
+
+    def test_chat_non_streaming_usage(self, client, mock_env):
+        """Test that the provider's token usage is reported"""
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Hello"}],
+            "stream": False,
+        }
+
+        response = client.post("/v1/chat/completions", json=request_data)
+
+        assert response.json()["usage"] == {
+            "prompt_tokens": 12,
+            "completion_tokens": 3,
+            "total_tokens": 15,
+        }
+
+    def test_chat_streaming_include_usage(self, client, mock_env):
+        """Test the final usage chunk requested with stream_options"""
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Hello"}],
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+        response = client.post("/v1/chat/completions", json=request_data)
+
+        data_lines = [line for line in response.text.split("\n") if line.startswith("data: ")]
+        usage_chunk = json.loads(data_lines[-2][6:])
+        assert usage_chunk["choices"] == []
+        assert usage_chunk["usage"] == {
+            "prompt_tokens": 12,
+            "completion_tokens": 4,
+            "total_tokens": 16,
+        }
+
+    def test_chat_streaming_usage_omitted_by_default(self, client, mock_env):
+        """Test that no usage chunk is sent unless requested"""
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Hello"}],
+            "stream": True,
+        }
+
+        response = client.post("/v1/chat/completions", json=request_data)
+
+        assert '"usage"' not in response.text
+
+    def test_chat_context_length_exceeded(self, client, mock_env, mock_llm_service):
+        """Test that requests larger than the context window are rejected up front"""
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "word " * 110000}],
+            "stream": False,
+            "max_tokens": 32000,
+        }
+
+        response = client.post("/v1/chat/completions", json=request_data)
+
+        assert response.status_code == 400
+        assert response.json()["error"]["code"] == "context_length_exceeded"
+        mock_llm_service.generate_completion.assert_not_called()
+
+    def test_chat_shed_when_queue_full(self, client, mock_env, mock_llm_service):
+        """Test the 429 returned when admission control sheds a request"""
+        # Same module as the application's exception handler
+        from services.admission import AdmissionController
+
+        client.app.state.admission = AdmissionController(max_concurrency=0, max_queue=0)
+        request_data = {
+            "model": "mistral-large",
+            "messages": [{"role": "user", "content": "Hello"}],
+            "stream": True,
+        }
+
+        response = client.post("/v1/chat/completions", json=request_data)
+
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        assert response.json()["error"]["code"] == "rate_limit_exceeded"
+
+    def test_chat_releases_admission(self, client, mock_env):
+        """Test that slots are returned once completions finish"""
+        for stream in (False, True):
+            client.post(
+                "/v1/chat/completions",
+                json={
+                    "model": "mistral-large",
+                    "messages": [{"role": "user", "content": "Hello"}],
+                    "stream": stream,
+                },
+            )
+
+        admission = client.get("/health").json()["admission"]
+        assert admission["mistral-large-latest"]["active"] == 0
+
     def test_chat_validation_error(self, client, mock_env):
         """Test chat completions with missing required fields"""
         request_data = {
@@ -182,6 +503,334 @@ class TestChatCompletionsEndpoint:
         assert response.status_code == 422  # Validation error
 
 
+class TestSharedCompletion:
+    """Test that the admission ticket of a shared call is held while it runs"""
+
+    class Ticket:
+        def __init__(self):
+            self.released = []
+
+        def release(self, used_tokens=None):
+            self.released.append(used_tokens)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_leader_keeps_ticket_until_call_ends(self):
+        """Test that the slot stays taken while followers still wait for the call"""
+        from api.openai_routes import shared_completion
+        from services.singleflight import SingleFlight
+
+        flights = SingleFlight()
+        ticket = self.Ticket()
+        finish = asyncio.Event()
+
+        async def call():
+            await finish.wait()
+            return Completion("Hi", TokenUsage(prompt_tokens=3, completion_tokens=2))
+
+        leader = asyncio.create_task(shared_completion(flights, "key", ticket, call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(shared_completion(flights, "key", None, call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+
+        assert ticket.released == []
+        finish.set()
+        assert (await follower).content == "Hi"
+        assert ticket.released == [5]
+
+    @pytest.mark.asyncio
+    async def test_ticket_returned_when_joining(self):
+        """Test that a ticket whose call never ran is given back unused"""
+        from api.openai_routes import shared_completion
+        from services.singleflight import SingleFlight
+
+        flights = SingleFlight()
+        finish = asyncio.Event()
+
+        async def call():
+            await finish.wait()
+            return Completion("Hi", TokenUsage())
+
+        first = asyncio.create_task(shared_completion(flights, "key", None, call))
+        await asyncio.sleep(0)
+        ticket = self.Ticket()
+        second = asyncio.create_task(shared_completion(flights, "key", ticket, call))
+        await asyncio.sleep(0)
+        finish.set()
+        await asyncio.gather(first, second)
+
+        assert ticket.released == [0]
+
+
+class TestOllamaEndpoints:
+    """Test the Ollama-compatible /api endpoints"""
+
+    def test_tags(self, client, mock_env):
+        response = client.get("/api/tags")
+
+        assert response.status_code == 200
+        names = [model["name"] for model in response.json()["models"]]
+        assert "mistral-large" in names
+
+    def test_chat_streaming(self, client, mock_env):
+        """Test that /api/chat streams one JSON object per line"""
+        response = client.post(
+            "/api/chat",
+            json={"model": "mistral-large", "messages": [{"role": "user", "content": "Salut"}]},
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert "".join(line["message"]["content"] for line in lines) == "Hello World!"
+        assert not any(line["done"] for line in lines[:-1])
+        assert lines[-1]["done"] is True
+        assert lines[-1]["prompt_eval_count"] == 12
+        assert lines[-1]["eval_count"] == 4
+
+    def test_chat_non_streaming(self, client, mock_env, mock_llm_service):
+        response = client.post(
+            "/api/chat",
+            json={
+                "model": "mistral-large",
+                "messages": [{"role": "user", "content": "Salut"}],
+                "stream": False,
+                "options": {"temperature": 0.2, "num_predict": 64},
+            },
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["message"] == {"role": "assistant", "content": "Mocked LLM response"}
+        assert data["done"] is True
+        assert data["eval_count"] == 3
+        kwargs = mock_llm_service.generate_completion.call_args.kwargs
+        assert kwargs["temperature"] == 0.2
+        assert kwargs["max_tokens"] == 64
+
+    def test_generate_streaming(self, client, mock_env):
+        response = client.post("/api/generate", json={"model": "mistral-large", "prompt": "Salut"})
+
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert "".join(line["response"] for line in lines) == "Hello World!"
+        assert lines[-1]["done"] is True
+
+    def test_generate_system(self, client, mock_env, mock_llm_service):
+        """Test that the system field is sent before the prompt"""
+        client.post(
+            "/api/generate",
+            json={"prompt": "Salut", "system": "Réponds en français", "stream": False},
+        )
+
+        messages = mock_llm_service.generate_completion.call_args.kwargs["messages"]
+        assert messages == [
+            {"role": "system", "content": "Réponds en français"},
+            {"role": "user", "content": "Salut"},
+        ]
+
+    def test_chat_stream_error(self, client, mock_env, mock_llm_service):
+        """Test that an upstream failure is sent as content, as on /v1/chat/completions"""
+
+        async def failing_stream(*args, **kwargs):
+            yield "Hello"
+            yield "Error: upstream unavailable"
+
+        mock_llm_service.stream_completion = failing_stream
+
+        response = client.post(
+            "/api/chat", json={"messages": [{"role": "user", "content": "Salut"}]}
+        )
+
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        content = "".join(line["message"]["content"] for line in lines)
+        assert content == "HelloError: upstream unavailable"
+        assert lines[-1]["done"] is True
+
+
+class TestBatchesEndpoint:
+    """Test the JSONL batch completions endpoint"""
+
+    @staticmethod
+    def batch_payload(*custom_ids):
+        return "\n".join(
+            json.dumps(
+                {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": "mistral-large",
+                        "messages": [{"role": "user", "content": f"Ticket {custom_id}"}],
+                    },
+                }
+            )
+            for custom_id in custom_ids
+        )
+
+    def test_batch_streams_results(self, client, mock_env, mock_llm_service):
+        """Test that every item comes back as a JSONL result line"""
+        response = client.post("/v1/batches", content=self.batch_payload("a", "b", "c"))
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted(line["custom_id"] for line in lines) == ["a", "b", "c"]
+        body = lines[0]["response"]["body"]
+        assert body["object"] == "chat.completion"
+        assert body["choices"][0]["message"]["content"] == "Mocked LLM response"
+        assert mock_llm_service.generate_completion.call_count == 3
+
+    def test_batch_resumes_from_checkpoint(self, client, mock_env, mock_llm_service):
+        """Test that a resubmitted batch only runs the unfinished items"""
+        client.post("/v1/batches", content=self.batch_payload("a", "b"), params={"batch_id": "b1"})
+        mock_llm_service.generate_completion.reset_mock()
+
+        response = client.post(
+            "/v1/batches", content=self.batch_payload("a", "b", "c"), params={"batch_id": "b1"}
+        )
+
+        assert response.headers["X-Batch-Id"] == "b1"
+        assert len(response.text.splitlines()) == 3
+        assert mock_llm_service.generate_completion.call_count == 1
+
+    def test_batch_failed_items_are_retried(self, client, mock_env, mock_llm_service):
+        """Test that errors are reported per item and not checkpointed"""
+        mock_llm_service.generate_completion.side_effect = TimeoutError("upstream timeout")
+        payload = self.batch_payload("a")
+
+        first = json.loads(client.post("/v1/batches", content=payload).text)
+        mock_llm_service.generate_completion.side_effect = None
+        mock_llm_service.generate_completion.return_value = Completion(
+            "Done", TokenUsage(prompt_tokens=5, completion_tokens=1)
+        )
+        second = json.loads(client.post("/v1/batches", content=payload).text)
+
+        assert first["error"]["code"] == "TimeoutError"
+        assert second["error"] is None
+
+    def test_batch_invalid_input(self, client, mock_env):
+        """Test that malformed input is rejected before anything runs"""
+        response = client.post("/v1/batches", content="not json")
+
+        assert response.status_code == 400
+        assert response.json()["error"]["code"] == "invalid_batch"
+
+
+class TestJobsEndpoint:
+    """Test asynchronous completion jobs"""
+
+    request_data = {"model": "mistral-large", "messages": [{"role": "user", "content": "Hello"}]}
+
+    def test_job_submit_and_poll(self, client, mock_env, mock_llm_service):
+        """Test that a job id comes back right away and the result later"""
+        with patch.object(client.app.state.llm_registry, "get", return_value=mock_llm_service):
+            response = client.post("/v1/jobs", json=self.request_data)
+            assert response.status_code == 202
+            job = response.json()
+            assert job["id"].startswith("job_")
+            assert job["status"] in ("queued", "running", "succeeded")
+
+            job = client.get(f"/v1/jobs/{job['id']}", params={"wait": 5}).json()
+
+        assert job["status"] == "succeeded"
+        assert job["result"]["object"] == "chat.completion"
+        assert job["result"]["choices"][0]["message"]["content"] == "Mocked LLM response"
+        assert job["result"]["usage"]["total_tokens"] == 15
+
+    def test_job_not_found(self, client, mock_env):
+        response = client.get("/v1/jobs/job_missing")
+
+        assert response.status_code == 404
+        assert response.json()["error"]["code"] == "job_not_found"
+
+    def test_job_cancel(self, client, mock_env):
+        """Test that a queued job can be cancelled"""
+        store = client.app.state.jobs.store
+        with patch.object(store, "claim", return_value=None):  # Keep it queued
+            job = store.submit({**self.request_data, "max_tokens": 10})
+            response = client.delete(f"/v1/jobs/{job['id']}")
+
+        assert response.status_code == 200
+        assert response.json()["status"] == "cancelled"
+
+
+class TestConversations:
+    """Test continuing stored conversations with only the new messages"""
+
+    def test_conversation_sends_only_new_messages(self, client, mock_env, mock_llm_service):
+        """Test that earlier turns and answers are rebuilt server-side"""
+        first = client.post(
+            "/v1/chat/completions",
+            json={
+                "messages": [{"role": "user", "content": "Hello!"}],
+                "stream": False,
+                "conversation_id": "conv-1",
+            },
+        )
+        second = client.post(
+            "/v1/chat/completions",
+            json={
+                "messages": [{"role": "user", "content": "And then?"}],
+                "stream": False,
+                "conversation_id": "conv-1",
+            },
+        )
+
+        assert first.headers["X-Conversation-Prefix"] != second.headers["X-Conversation-Prefix"]
+        messages = mock_llm_service.generate_completion.call_args.kwargs["messages"]
+        assert messages == [
+            {"role": "user", "content": "Hello!"},
+            {"role": "assistant", "content": "Mocked LLM response"},
+            {"role": "user", "content": "And then?"},
+        ]
+
+    def test_streamed_answer_is_stored(self, client, mock_env):
+        """Test that a streamed answer extends the conversation once it ends"""
+        response = client.post(
+            "/v1/chat/completions",
+            json={"messages": [{"role": "user", "content": "Hi"}], "conversation_id": "conv-2"},
+        )
+        request_prefix = response.headers["X-Conversation-Prefix"]
+
+        head, messages = client.app.state.conversations.resolve(conversation_id="conv-2")
+
+        assert head != request_prefix
+        assert messages[-1] == {"role": "assistant", "content": "Hello World!"}
+
+    def test_failed_turn_is_not_stored(self, client, mock_env, mock_llm_service):
+        """Test that a retry after an upstream error does not repeat the user message"""
+        body = {"messages": [{"role": "user", "content": "Hi"}], "conversation_id": "conv-3"}
+        healthy = mock_llm_service.stream_completion
+
+        async def failing(*args, **kwargs):
+            yield "Error: upstream unavailable"
+
+        mock_llm_service.stream_completion = failing
+        client.post("/v1/chat/completions", json=body)
+        assert client.app.state.conversations.resolve(conversation_id="conv-3") == ("", [])
+
+        mock_llm_service.stream_completion = healthy
+        client.post("/v1/chat/completions", json=body)
+        _, messages = client.app.state.conversations.resolve(conversation_id="conv-3")
+
+        assert messages == [
+            {"role": "user", "content": "Hi"},
+            {"role": "assistant", "content": "Hello World!"},
+        ]
+
+    def test_unknown_prefix(self, client, mock_env, mock_llm_service):
+        """Test that an expired prefix asks the client for the whole conversation"""
+        response = client.post(
+            "/v1/chat/completions",
+            json={"messages": [{"role": "user", "content": "Hi"}], "prefix": "0" * 32},
+        )
+
+        assert response.status_code == 400
+        assert response.json()["error"]["code"] == "unknown_prefix"
+        mock_llm_service.generate_completion.assert_not_called()
+
+
 class TestCORS:
     """Test CORS configuration"""
 
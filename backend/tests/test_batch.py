@@ -0,0 +1,117 @@
+"""Unit tests for batch parsing and checkpoints"""
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+from src.services.batch import BatchStore, batch_id, parse_batch, result_line
+
+
+def batch_line(custom_id, content="Hello", **extra):
+    return json.dumps(
+        {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {"model": "mistral-large", "messages": [{"role": "user", "content": content}]},
+            **extra,
+        }
+    )
+
+
+class TestParseBatch:
+    """Test parsing of batch input files"""
+
+    def test_parses_requests(self):
+        """Test that each line becomes a non-streaming chat request"""
+        payload = f"{batch_line('a')}\n\n{batch_line('b', 'Bye')}\n".encode()
+
+        items = parse_batch(payload)
+
+        assert [item.custom_id for item in items] == ["a", "b"]
+        assert items[1].request.messages[0].content == "Bye"
+        assert items[0].request.stream is False
+
+    def test_invalid_line_reports_line_number(self):
+        """Test that errors point at the offending line"""
+        payload = f"{batch_line('a')}\nnot json\n".encode()
+
+        with pytest.raises(ValueError, match="Line 2"):
+            parse_batch(payload)
+
+    def test_rejects_duplicate_custom_id(self):
+        """Test that custom_ids must be unique, since they key the checkpoints"""
+        payload = f"{batch_line('a')}\n{batch_line('a')}".encode()
+
+        with pytest.raises(ValueError, match="duplicate"):
+            parse_batch(payload)
+
+    def test_rejects_other_endpoints(self):
+        """Test that only chat completions can be batched"""
+        payload = batch_line("a", url="/v1/embeddings").encode()
+
+        with pytest.raises(ValueError, match="unsupported url"):
+            parse_batch(payload)
+
+    def test_batch_id_is_stable(self):
+        """Test that resubmitting the same file gives the same id"""
+        payload = batch_line("a").encode()
+
+        assert batch_id(payload) == batch_id(payload)
+        assert batch_id(payload) != batch_id(batch_line("b").encode())
+
+
+class TestResultLine:
+    """Test batch output lines"""
+
+    def test_success(self):
+        line = result_line("a", {"object": "chat.completion"})
+
+        assert line["id"].startswith("batch_req_")
+        assert line["response"] == {"status_code": 200, "body": {"object": "chat.completion"}}
+        assert line["error"] is None
+
+    def test_error(self):
+        line = result_line("a", error=TimeoutError("too slow"))
+
+        assert line["response"] is None
+        assert line["error"] == {"code": "TimeoutError", "message": "too slow"}
+
+
+class TestBatchStore:
+    """Test result checkpoints"""
+
+    def test_round_trip(self):
+        """Test that saved lines are returned for their batch only"""
+        store = BatchStore()
+        store.save("batch_1", "a", '{"custom_id": "a"}')
+        store.save("batch_2", "b", '{"custom_id": "b"}')
+
+        assert store.completed("batch_1") == {"a": '{"custom_id": "a"}'}
+        store.close()
+
+    def test_idle_batches_are_purged(self):
+        """Test that saving prunes batches idle for longer than the retention"""
+        with patch("src.services.batch.time.time", return_value=0):
+            store = BatchStore(retention=100, purge_interval=10)
+            store.save("batch_1", "a", "{}")
+        with patch("src.services.batch.time.time", return_value=50):
+            store.save("batch_2", "a", "{}")
+        with patch("src.services.batch.time.time", return_value=120):
+            store.save("batch_2", "b", "{}")
+
+        assert store.completed("batch_1") == {}
+        assert store.completed("batch_2") == {"a": "{}", "b": "{}"}
+        store.close()
+
+    def test_survives_restart(self, tmp_path):
+        """Test that checkpoints on disk outlive the process"""
+        path = str(tmp_path / "batches.db")
+        store = BatchStore(path)
+        store.save("batch_1", "a", "{}")
+        store.close()
+
+        reopened = BatchStore(path)
+        assert reopened.completed("batch_1") == {"a": "{}"}
+        reopened.close()
@@ -0,0 +1,177 @@
+"""Unit tests for context-window management"""
+
+import pytest
+
+from src.core.metrics import Metrics
+from src.services.context import SUMMARY_HEADER, ContextManager
+from src.services.tokens import TokenEstimator
+
+# Without a tokenizer a 36-character message costs 9 + 4 overhead tokens
+TEXT = "x" * 36
+SYSTEM_TOKENS = 7  # Cost of the service system prompt
+
+
+def chat(turns: int) -> list[dict[str, str]]:
+    """Alternating user/assistant turns ending with a user turn"""
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"{i:02d}{TEXT[2:]}"}
+        for i in range(2 * turns - 1)
+    ]
+
+
+def manager(budget: int = 60, **kwargs) -> ContextManager:
+    return ContextManager(TokenEstimator(), {"test-model": budget}, **kwargs)
+
+
+class Summaries:
+    """Summarizer recording its calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, previous, messages):
+        self.calls.append((previous, [m["content"][:2] for m in messages]))
+        return f"summary of {len(self.calls)}"
+
+
+class TestBudget:
+    """Test the per-model budget"""
+
+    def test_capped_by_context_window(self):
+        context = ContextManager(TokenEstimator(), {"m": 1000}, {"m": 800})
+
+        assert context.budget("m", max_tokens=300) == 500
+        assert context.budget("m", max_tokens=100) == 700
+
+    def test_window_only(self):
+        assert ContextManager(TokenEstimator(), windows={"m": 800}).budget("m", 300) == 500
+
+    def test_unknown_model(self):
+        assert manager().budget("other", 100) is None
+
+
+class TestTrimming:
+    """Test truncation to the most recent turns"""
+
+    @pytest.mark.asyncio
+    async def test_fitting_chat_unchanged(self):
+        messages = chat(2)
+
+        assert (
+            await manager(budget=1000).fit(messages, "test-model", SYSTEM_TOKENS, 100) is messages
+        )
+
+    @pytest.mark.asyncio
+    async def test_drops_oldest_turns(self):
+        """Test that the most recent turns within the budget are kept"""
+        messages = chat(5)  # 9 messages, 13 tokens each
+
+        fitted = await manager().fit(messages, "test-model", SYSTEM_TOKENS, 100)
+
+        # 60 - 7 (system prompt) = 53 tokens: four messages, starting with a user turn
+        assert [m["content"][:2] for m in fitted] == ["06", "07", "08"]
+
+    @pytest.mark.asyncio
+    async def test_keeps_system_messages_and_last_message(self):
+        messages = [{"role": "system", "content": "Be brief"}, *chat(5)]
+        messages[-1] = {"role": "user", "content": "z" * 400}  # Over budget by itself
+
+        fitted = await manager().fit(messages, "test-model", SYSTEM_TOKENS, 100)
+
+        assert fitted == [messages[0], messages[-1]]
+
+    @pytest.mark.asyncio
+    async def test_counts_dropped_tokens(self):
+        metrics = Metrics()
+
+        await manager(metrics=metrics).fit(chat(5), "test-model", SYSTEM_TOKENS, 100)
+
+        assert metrics.context_dropped_tokens.values[("test-model",)] == 6 * 13
+
+
+class TestSummaries:
+    """Test rolling summaries of dropped turns"""
+
+    @pytest.mark.asyncio
+    async def test_summary_replaces_dropped_turns(self):
+        summarize = Summaries()
+
+        fitted = await manager(budget=100, summary_tokens=10).fit(
+            chat(8), "test-model", SYSTEM_TOKENS, 100, summarize
+        )
+
+        assert fitted[0] == {"role": "system", "content": SUMMARY_HEADER + "summary of 1"}
+        assert summarize.calls[0][0] is None
+        # Kept turns follow the summarized ones without overlap
+        assert summarize.calls[0][1][-1] < fitted[1]["content"][:2]
+
+    @pytest.mark.asyncio
+    async def test_summary_reused_by_next_turn(self):
+        """Test that the next request of a conversation does not summarize again"""
+        metrics = Metrics()
+        context = manager(budget=100, summary_tokens=10, metrics=metrics)
+        summarize = Summaries()
+        messages = chat(8)
+
+        await context.fit(messages, "test-model", SYSTEM_TOKENS, 100, summarize)
+        messages += [
+            {"role": "assistant", "content": TEXT},
+            {"role": "user", "content": TEXT},
+        ]
+        fitted = await context.fit(messages, "test-model", SYSTEM_TOKENS, 100, summarize)
+
+        assert len(summarize.calls) == 1
+        assert fitted[0]["content"] == SUMMARY_HEADER + "summary of 1"
+        assert (
+            metrics.context_summaries.values[
+                (
+                    "test-model",
+                    "hit",
+                )
+            ]
+            == 1
+        )
+
+    @pytest.mark.asyncio
+    async def test_summary_extended_with_new_turns_only(self):
+        """Test that a longer chat folds only the newly dropped turns into the summary"""
+        context = manager(budget=100, summary_tokens=10)
+        summarize = Summaries()
+        messages = chat(8)
+
+        await context.fit(messages, "test-model", SYSTEM_TOKENS, 100, summarize)
+        first = summarize.calls[0][1]
+        for _ in range(4):
+            messages += [
+                {"role": "assistant", "content": TEXT},
+                {"role": "user", "content": TEXT},
+            ]
+        fitted = await context.fit(messages, "test-model", SYSTEM_TOKENS, 100, summarize)
+
+        previous, new = summarize.calls[1]
+        assert previous == "summary of 1"
+        assert not set(new) & set(first)
+        assert fitted[0]["content"] == SUMMARY_HEADER + "summary of 2"
+
+    @pytest.mark.asyncio
+    async def test_summarizer_failure_falls_back_to_truncation(self):
+        metrics = Metrics()
+
+        async def fail(previous, messages):
+            raise TimeoutError("upstream timeout")
+
+        fitted = await manager(budget=100, summary_tokens=10, metrics=metrics).fit(
+            chat(8), "test-model", SYSTEM_TOKENS, 100, fail
+        )
+
+        assert all(m["role"] != "system" for m in fitted)
+        assert fitted[0]["role"] == "user"
+        assert (
+            metrics.context_summaries.values[
+                (
+                    "test-model",
+                    "error",
+                )
+            ]
+            == 1
+        )
@@ -0,0 +1,108 @@
+"""Unit tests for the conversation prefix store"""
+
+from unittest.mock import patch
+
+import pytest
+
+from src.services.conversations import ConversationStore, UnknownPrefix, prefix_id
+
+FIRST_TURN = [
+    {"role": "user", "content": "Hello!"},
+    {"role": "assistant", "content": "Hi there!"},
+]
+
+
+class TestConversationStore:
+    """Test storing and rebuilding message prefixes"""
+
+    def test_extend_and_resolve(self):
+        """Test that a stored prefix rebuilds the same messages"""
+        store = ConversationStore()
+        prefix = store.extend("", FIRST_TURN)
+
+        resolved, messages = store.resolve(prefix)
+
+        assert resolved == prefix
+        assert messages == FIRST_TURN
+
+    def test_prefix_ids_are_content_addressed(self):
+        """Test that identical beginnings share nodes"""
+        store = ConversationStore()
+        first = store.extend("", FIRST_TURN)
+        second = store.extend("", FIRST_TURN)
+        branch = store.extend(first, [{"role": "user", "content": "Bye"}])
+
+        assert first == second
+        assert first == prefix_id(prefix_id("", "user", "Hello!"), "assistant", "Hi there!")
+        assert store.stats()["prefixes"] == 3
+        assert store.resolve(branch)[1][-1]["content"] == "Bye"
+
+    def test_head_matches_extend_without_storing(self):
+        store = ConversationStore()
+        head = store.head("", FIRST_TURN)
+
+        assert store.stats()["prefixes"] == 0
+        assert store.extend("", FIRST_TURN) == head
+
+    def test_conversation_id_tracks_latest_prefix(self):
+        """Test that a conversation continues from its last stored message"""
+        store = ConversationStore()
+        store.extend("", FIRST_TURN, conversation_id="c1")
+        head, _ = store.resolve(conversation_id="c1")
+        store.extend(head, [{"role": "user", "content": "How are you?"}], conversation_id="c1")
+
+        _, messages = store.resolve(conversation_id="c1")
+
+        assert [message["content"] for message in messages] == [
+            "Hello!",
+            "Hi there!",
+            "How are you?",
+        ]
+
+    def test_unknown_conversation_starts_empty(self):
+        assert ConversationStore().resolve(conversation_id="new") == ("", [])
+
+    def test_unknown_prefix(self):
+        store = ConversationStore()
+
+        with pytest.raises(UnknownPrefix):
+            store.resolve("0" * 32)
+        with pytest.raises(UnknownPrefix):
+            store.extend("0" * 32, FIRST_TURN)
+
+    def test_expired_chain_resets_conversation(self):
+        """Test that a partly purged prefix is refused and its conversation reset"""
+        store = ConversationStore(ttl=60)
+        with patch("src.services.conversations.time.time", return_value=0):
+            root = store.extend("", FIRST_TURN[:1])
+        store.extend(root, FIRST_TURN[1:], conversation_id="c1")
+        store.purge()
+
+        with pytest.raises(UnknownPrefix):
+            store.resolve(conversation_id="c1")
+        assert store.resolve(conversation_id="c1") == ("", [])
+
+    def test_resolve_keeps_chain_alive(self):
+        """Test that using a conversation refreshes all of its messages"""
+        store = ConversationStore(ttl=60)
+        with patch("src.services.conversations.time.time", return_value=0):
+            prefix = store.extend("", FIRST_TURN)
+        store.resolve(prefix)
+        store.purge()
+
+        assert store.resolve(prefix)[1] == FIRST_TURN
+
+    def test_expired_chain_purged_while_running(self):
+        """Test that storing messages purges expired ones, at most every purge_interval"""
+        with patch("src.services.conversations.time.time", return_value=0):
+            store = ConversationStore(ttl=60, purge_interval=30)
+            store.extend("", FIRST_TURN, conversation_id="old")
+        with patch("src.services.conversations.time.time", return_value=20):
+            store.extend("", [{"role": "user", "content": "Bye"}])
+        assert store.stats() == {"prefixes": 3, "conversations": 1}
+
+        with patch("src.services.conversations.time.time", return_value=100):
+            store.extend("", [{"role": "user", "content": "New"}])
+
+        assert store.stats() == {"prefixes": 1, "conversations": 0}
+        assert store.resolve(conversation_id="old") == ("", [])
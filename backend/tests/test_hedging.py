@@ -0,0 +1,211 @@
+"""Unit tests for hedged streams"""
+
+import asyncio
+
+import pytest
+
+from src.core.metrics import Metrics
+from src.services.hedging import HedgePolicy
+
+
+async def stream(chunks, delay=0.0, error=None, events=None, name=""):
+    try:
+        if delay:
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        for chunk in chunks:
+            yield chunk
+    except asyncio.CancelledError:
+        if events is not None:
+            events.append(f"{name} cancelled")
+        raise
+
+
+def warmed_policy(ttft=0.01, **kwargs) -> HedgePolicy:
+    policy = HedgePolicy(min_samples=1, min_delay=0.0, **kwargs)
+    policy.observe("m", ttft)
+    policy.credits = 1
+    return policy
+
+
+async def collect(agen):
+    return [chunk async for chunk in agen]
+
+
+class TestHedgePolicy:
+    """Test the hedge delay and budget"""
+
+    def test_no_delay_until_warmed_up(self):
+        """Test that hedging waits for enough samples"""
+        policy = HedgePolicy(min_samples=3)
+        policy.observe("m", 0.5)
+
+        assert policy.delay("m") is None
+        assert policy.delay("other") is None
+
+    def test_delay_is_percentile(self):
+        """Test the percentile of recent times to first token"""
+        policy = HedgePolicy(percentile=90, min_samples=1, min_delay=0.0)
+        for value in range(1, 101):
+            policy.observe("m", value / 100)
+
+        assert policy.delay("m") == pytest.approx(0.91)
+
+    def test_min_delay(self):
+        """Test the floor of the hedge delay"""
+        policy = HedgePolicy(min_samples=1, min_delay=0.2)
+        policy.observe("m", 0.01)
+
+        assert policy.delay("m") == 0.2
+
+
+class TestRace:
+    """Test racing a primary stream against a hedge"""
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_is_not_hedged(self):
+        """Test that no hedge is sent when the first token is on time"""
+        policy = warmed_policy(ttft=1.0)
+        opened = []
+
+        def hedge():
+            opened.append("hedge")
+            return stream(["hedge"])
+
+        reported = []
+        chunks = await collect(policy.race("m", lambda: stream(["a", "b"]), hedge, reported))
+
+        assert chunks == ["a", "b"]
+        assert opened == []
+        assert reported == ["primary"]
+
+    @pytest.mark.asyncio
+    async def test_hedge_wins_and_primary_is_cancelled(self):
+        """Test that the first stream to produce a token wins"""
+        metrics = Metrics()
+        policy = warmed_policy(metrics=metrics)
+        events = []
+
+        reported = []
+        chunks = await collect(
+            policy.race(
+                "m",
+                lambda: stream(["slow"], delay=1.0, events=events, name="primary"),
+                lambda: stream(["fast", "!"]),
+                reported,
+            )
+        )
+
+        assert chunks == ["fast", "!"]
+        assert reported == ["primary", "hedge"]
+        assert events == ["primary cancelled"]
+        assert metrics.hedged_streams.values == {("m", "hedge"): 1}
+
+    @pytest.mark.asyncio
+    async def test_budget_caps_hedges(self):
+        """Test that hedging stops once the budget is spent"""
+        policy = warmed_policy(budget=0.0)
+        policy.credits = 0
+        opened = []
+
+        def hedge():
+            opened.append("hedge")
+            return stream(["hedge"])
+
+        chunks = await collect(policy.race("m", lambda: stream(["late"], delay=0.05), hedge))
+
+        assert chunks == ["late"]
+        assert opened == []
+
+    @pytest.mark.asyncio
+    async def test_no_hedge_without_admission(self):
+        """Test that the hedge is skipped, keeping its credit, when not admitted"""
+        policy = warmed_policy()
+        reported = []
+
+        chunks = await collect(
+            policy.race(
+                "m",
+                lambda: stream(["late"], delay=0.05),
+                lambda: stream(["hedge"]),
+                reported,
+                admit=lambda: None,
+            )
+        )
+
+        assert chunks == ["late"]
+        assert reported == ["primary"]
+        assert policy.credits == pytest.approx(1 + policy.budget)
+
+    @pytest.mark.asyncio
+    async def test_hedge_admission_released_when_it_ends(self):
+        """Test that an admitted hedge frees its ticket once its stream ends"""
+        released = []
+
+        class Ticket:
+            def release(self):
+                released.append(True)
+
+        chunks = await collect(
+            warmed_policy().race(
+                "m",
+                lambda: stream(["slow"], delay=1.0),
+                lambda: stream(["fast"]),
+                admit=Ticket,
+            )
+        )
+
+        assert chunks == ["fast"]
+        assert released == [True]
+
+    @pytest.mark.asyncio
+    async def test_failed_racer_drops_out(self):
+        """Test that a racer failing before its first token does not win"""
+        policy = warmed_policy()
+
+        chunks = await collect(
+            policy.race(
+                "m",
+                lambda: stream([], delay=0.05, error=RuntimeError("primary down")),
+                lambda: stream(["ok"], delay=0.1),
+            )
+        )
+
+        assert chunks == ["ok"]
+
+    @pytest.mark.asyncio
+    async def test_all_racers_fail(self):
+        """Test that the primary's error is raised when every racer fails"""
+        policy = warmed_policy()
+
+        with pytest.raises(RuntimeError, match="primary down"):
+            await collect(
+                policy.race(
+                    "m",
+                    lambda: stream([], delay=0.05, error=RuntimeError("primary down")),
+                    lambda: stream([], delay=0.06, error=RuntimeError("hedge down")),
+                )
+            )
+
+    @pytest.mark.asyncio
+    async def test_consumer_leaving_cancels_winner(self):
+        """Test that closing the race cancels the winning stream too"""
+        policy = warmed_policy(ttft=1.0)
+        events = []
+
+        async def endless():
+            try:
+                while True:
+                    yield "tick"
+                    await asyncio.sleep(0.01)
+            except asyncio.CancelledError:
+                events.append("cancelled")
+                raise
+
+        race = policy.race("m", endless, endless)
+        assert await race.__anext__() == "tick"
+        await race.aclose()
+        await asyncio.sleep(0)
+
+        assert events == ["cancelled"]
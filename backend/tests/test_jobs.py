@@ -0,0 +1,194 @@
+"""Unit tests for the asynchronous job queue"""
+
+import asyncio
+import os
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+from src.services.jobs import JobQueue, JobStore
+from src.services.llm_service import Completion
+from src.services.tokens import TokenUsage
+
+REQUEST = {"messages": [{"role": "user", "content": "Hello"}], "model": "mistral-large"}
+
+
+async def complete(request):
+    return Completion(f"Answer to {request['messages'][0]['content']}", TokenUsage(5, 2))
+
+
+class TestJobStore:
+    """Test job persistence and state transitions"""
+
+    def test_claim_oldest_first(self):
+        """Test that jobs are claimed once each, in submission order"""
+        store = JobStore()
+        first = store.submit(REQUEST)
+        second = store.submit(REQUEST)
+
+        assert store.claim()["id"] == first["id"]
+        assert store.claim()["id"] == second["id"]
+        assert store.claim() is None
+        assert store.counts() == {"running": 2}
+
+    def test_finish_stores_result(self):
+        store = JobStore()
+        job = store.submit(REQUEST)
+        store.claim()
+
+        store.finish(job["id"], Completion("Done", TokenUsage(5, 2)))
+
+        finished = store.get(job["id"])
+        assert finished["status"] == "succeeded"
+        assert finished["result"]["content"] == "Done"
+        assert finished["finished_at"] is not None
+
+    def test_cancel_only_queued(self):
+        """Test that running jobs cannot be cancelled"""
+        store = JobStore()
+        running = store.submit(REQUEST)
+        store.claim()
+        queued = store.submit(REQUEST)
+
+        assert store.cancel(queued["id"])
+        assert not store.cancel(running["id"])
+        assert store.get(queued["id"])["status"] == "cancelled"
+
+    def test_recover_requeues_jobs_of_dead_process(self, tmp_path):
+        """Test that jobs survive a crash of the process running them"""
+        path = str(tmp_path / "jobs.db")
+        store = JobStore(path)
+        job = store.submit(REQUEST)
+        with patch("src.services.jobs.os.getpid", return_value=2**22 + 1):
+            store.claim()
+        store.close()
+
+        reopened = JobStore(path)
+        assert reopened.recover(max_attempts=3) == 1
+        assert reopened.get(job["id"])["status"] == "queued"
+
+    def test_recover_skips_live_process(self):
+        """Test that jobs of another live worker are left alone"""
+        store = JobStore()
+        job = store.submit(REQUEST)
+        with patch("src.services.jobs.os.getpid", return_value=os.getppid()):
+            store.claim()
+
+        assert store.recover(max_attempts=3) == 0
+        assert store.get(job["id"])["status"] == "running"
+
+    def test_recover_fails_after_max_attempts(self):
+        """Test that a job that keeps crashing its worker is given up"""
+        store = JobStore()
+        job = store.submit(REQUEST)
+        for _ in range(3):
+            store.claim()
+            store.recover(max_attempts=3)
+
+        assert store.get(job["id"])["status"] == "failed"
+
+    def test_purge_finished(self):
+        store = JobStore()
+        done = store.submit(REQUEST)
+        store.claim()
+        store.fail(done["id"], "boom")
+        pending = store.submit(REQUEST)
+
+        assert store.purge(older_than=-1) == 1
+        assert store.get(done["id"]) is None
+        assert store.get(pending["id"]) is not None
+
+
+class TestJobQueue:
+    """Test the worker pool and long polling"""
+
+    @pytest.mark.asyncio
+    async def test_runs_submitted_jobs(self):
+        """Test that a submitted job is run and its result can be awaited"""
+        queue = JobQueue(JobStore(), complete, concurrency=2)
+        queue.start()
+        try:
+            job = queue.submit(REQUEST)
+            finished = await queue.wait(job["id"], timeout=1)
+        finally:
+            await queue.stop()
+
+        assert finished["status"] == "succeeded"
+        assert finished["result"]["content"] == "Answer to Hello"
+
+    @pytest.mark.asyncio
+    async def test_records_failures(self):
+        async def fail(request):
+            raise TimeoutError("upstream timeout")
+
+        queue = JobQueue(JobStore(), fail)
+        queue.start()
+        try:
+            job = queue.submit(REQUEST)
+            finished = await queue.wait(job["id"], timeout=1)
+        finally:
+            await queue.stop()
+
+        assert finished["status"] == "failed"
+        assert finished["error"] == "upstream timeout"
+
+    @pytest.mark.asyncio
+    async def test_worker_survives_store_errors(self):
+        """Test that a failing store call does not stop the worker"""
+        store = JobStore()
+        queue = JobQueue(store, complete, concurrency=1, poll_interval=0.01)
+        claim = store.claim
+        errors = [sqlite3.OperationalError("database is locked")]
+
+        def flaky_claim():
+            if errors:
+                raise errors.pop()
+            return claim()
+
+        queue.start()
+        try:
+            with patch.object(store, "claim", flaky_claim):
+                job = queue.submit(REQUEST)
+                finished = await queue.wait(job["id"], timeout=1)
+        finally:
+            await queue.stop()
+
+        assert finished["status"] == "succeeded"
+
+    @pytest.mark.asyncio
+    async def test_wait_times_out_with_current_state(self):
+        """Test that long polling returns the unfinished job after the timeout"""
+        queue = JobQueue(JobStore(), complete, poll_interval=0.01)
+
+        job = queue.submit(REQUEST)  # No workers started
+        current = await queue.wait(job["id"], timeout=0.05)
+
+        assert current["status"] == "queued"
+        assert await queue.wait("job_missing", timeout=0) is None
+
+    @pytest.mark.asyncio
+    async def test_stop_requeues_running_jobs(self, tmp_path):
+        """Test that jobs interrupted by a shutdown run again after a restart"""
+        path = str(tmp_path / "jobs.db")
+        started = asyncio.Event()
+
+        async def slow(request):
+            started.set()
+            await asyncio.sleep(10)
+
+        queue = JobQueue(JobStore(path), slow)
+        queue.start()
+        job = queue.submit(REQUEST)
+        await started.wait()
+        await queue.stop()
+
+        restarted = JobQueue(JobStore(path), complete)
+        restarted.start()
+        try:
+            finished = await restarted.wait(job["id"], timeout=2)
+        finally:
+            await restarted.stop()
+
+        assert finished["status"] == "succeeded"
+        assert finished["attempts"] == 1
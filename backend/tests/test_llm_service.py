@@ -1,10 +1,28 @@
 """Unit tests for LLMService"""
 
-from unittest.mock import MagicMock, patch
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
 
+import httpx
 import pytest
-
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    UserPromptPart,
+)
+from pydantic_ai.usage import RunUsage
+
+from src.core.metrics import Metrics
+from src.services.context import SUMMARY_HEADER, ContextManager
+from src.services.hedging import HedgePolicy
 from src.services.llm_service import LLMService
+from src.services.message_history import to_message_history
+from src.services.prompt_catalog import PromptCatalog
+from src.services.registry import LLMServiceRegistry
+from src.services.router import ProviderRouter
+from src.services.tokens import TokenEstimator, TokenUsage
 
 
 class TestLLMServiceInitialization:
@@ -51,6 +69,15 @@ class TestLLMServiceModelManagement:
         service._get_model_instance("custom-model")
         mock_mistral_model.assert_called_with("custom-model")
 
+    def test_get_model_instance_with_shared_client(self, mock_env, mock_mistral_model):
+        """Test that a shared HTTP client is injected into the provider"""
+        http_client = httpx.AsyncClient()
+        service = LLMService(provider="mistral", http_client=http_client)
+        service._get_model_instance("mistral-large")
+
+        provider = mock_mistral_model.call_args.kwargs["provider"]
+        assert provider.client.sdk_configuration.async_client is http_client
+
     def test_agent_caching(self, mock_env):
         """Test that agents are cached per provider:model"""
         with patch("src.services.llm_service.Agent") as mock_agent_class:
@@ -72,6 +99,8 @@ class TestLLMServiceModelManagement:
 
             # Agent class should be called twice (once for each unique model)
             assert mock_agent_class.call_count == 2
+            assert service.agent_cache_hits == 1
+            assert service.agent_cache_misses == 2
 
 
 class TestLLMServiceGeneration:
@@ -88,7 +117,12 @@ class TestLLMServiceGeneration:
             messages=sample_single_message, model="mistral-large", temperature=0.7, max_tokens=4096
         )
 
-        assert result == "Mocked LLM response"
+        assert result.content == "Mocked LLM response"
+        assert result.usage.as_dict() == {
+            "prompt_tokens": 12,
+            "completion_tokens": 3,
+            "total_tokens": 15,
+        }
         mock_agent.run.assert_called_once()
 
         # Check that prompt was extracted correctly
@@ -108,14 +142,34 @@ class TestLLMServiceGeneration:
             messages=sample_chat_messages, model="mistral-large", temperature=0.5, max_tokens=2000
         )
 
-        assert result == "Mocked LLM response"
+        assert result.content == "Mocked LLM response"
 
-        # Check that messages were concatenated
+        # Last user turn is the prompt, earlier turns are structured history
         call_args = mock_agent.run.call_args
-        prompt = call_args[0][0]
-        assert "user: Hello!" in prompt
-        assert "assistant: Hi there!" in prompt
-        assert "user: How are you?" in prompt
+        assert call_args[0][0] == "How are you?"
+        history = call_args[1]["message_history"]
+        assert isinstance(history[0], ModelRequest)
+        assert history[0].parts[0].content == service.system_prompt
+        assert history[0].parts[1].content == "Hello!"
+        assert isinstance(history[1], ModelResponse)
+        assert history[1].parts[0].content == "Hi there!"
+
+    @pytest.mark.asyncio
+    async def test_tenant_system_prompt_variant(
+        self, mock_env, mock_agent_class, mock_agent, sample_chat_messages
+    ):
+        """Test that a tenant's variant is sent first, by an agent of its own"""
+        prompts = PromptCatalog("Default", {"acme": "Acme prompt"}, tenants={"acme": "acme"})
+        service = LLMService(provider="mistral", prompts=prompts)
+
+        await service.generate_completion(
+            messages=sample_chat_messages, model="mistral-large", tenant="acme"
+        )
+
+        history = mock_agent.run.call_args[1]["message_history"]
+        assert history[0].parts[0].content == "Acme prompt"
+        assert mock_agent_class.call_args.kwargs["system_prompt"] == "Acme prompt"
+        assert list(service._agents) == ["mistral:mistral-large-latest:acme"]
 
     @pytest.mark.asyncio
     async def test_stream_completion_single_message(
@@ -133,6 +187,49 @@ class TestLLMServiceGeneration:
         assert chunks == ["Hello", " ", "World", "!"]
         mock_agent.run_stream.assert_called_once()
 
+    @pytest.mark.asyncio
+    async def test_stream_completion_reports_usage(
+        self, mock_env, mock_agent_class, mock_agent, sample_single_message
+    ):
+        """Test that streamed usage is filled once the stream ends"""
+        service = LLMService(provider="mistral")
+        usage = TokenUsage()
+
+        async for _ in service.stream_completion(
+            messages=sample_single_message, model="mistral-large", usage=usage
+        ):
+            pass
+
+        assert (usage.prompt_tokens, usage.completion_tokens) == (12, 4)
+
+    @pytest.mark.asyncio
+    async def test_closing_stream_closes_upstream(self, mock_env, sample_single_message):
+        """Test that a stream given up by its consumer stops the upstream call"""
+        closed = []
+
+        class Response:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                closed.append(True)
+
+            async def stream_text(self, delta=False, debounce_by=0.1):
+                while True:
+                    yield "token"
+
+        with patch("src.services.llm_service.Agent") as mock_agent_class:
+            mock_agent_class.return_value.run_stream = MagicMock(return_value=Response())
+            service = LLMService(provider="mistral")
+
+            stream = service.stream_completion(
+                messages=sample_single_message, model="mistral-large"
+            )
+            assert await anext(stream) == "token"
+            await stream.aclose()
+
+        assert closed == [True]
+
     @pytest.mark.asyncio
     async def test_stream_completion_error_handling(self, mock_env, sample_single_message):
         """Test streaming error handling"""
@@ -153,6 +250,47 @@ class TestLLMServiceGeneration:
             assert len(chunks) == 1
             assert "Error: API Error" in chunks[0]
 
+    @pytest.mark.asyncio
+    async def test_upstream_errors_are_counted(self, mock_env, sample_single_message):
+        """Test that failed upstream calls are counted by error type"""
+        with patch("src.services.llm_service.Agent") as mock_agent_class:
+            error_agent = MagicMock()
+            error_agent.run = AsyncMock(side_effect=TimeoutError("upstream timeout"))
+            mock_agent_class.return_value = error_agent
+            metrics = Metrics()
+            service = LLMService(provider="mistral", metrics=metrics)
+
+            with pytest.raises(TimeoutError):
+                await service.generate_completion(
+                    messages=sample_single_message, model="mistral-large"
+                )
+
+            assert metrics.upstream_errors.values == {
+                ("mistral", "mistral-large-latest", "TimeoutError"): 1
+            }
+
+    @pytest.mark.asyncio
+    async def test_long_chat_summarized_before_sending(
+        self, mock_env, mock_agent_class, mock_agent
+    ):
+        """Test that turns over the model's budget are replaced by a summary"""
+        context = ContextManager(TokenEstimator(), {"mistral-large-latest": 60}, summary_tokens=10)
+        service = LLMService(provider="mistral", system_prompt="Be brief", context=context)
+        messages = [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"Turn {i} " + "x" * 40}
+            for i in range(9)
+        ]
+
+        with patch("src.services.llm_service.CONTEXT_SUMMARY_ENABLED", True):
+            await service.generate_completion(messages=messages, model="mistral-large")
+
+        summary_call, answer_call = mock_agent.run.call_args_list
+        assert "Turn 0" in summary_call[0][0]
+        assert summary_call[1]["model_settings"]["temperature"] == 0.0
+        assert answer_call[0][0] == messages[-1]["content"]
+        system_parts = answer_call[1]["message_history"][0].parts
+        assert system_parts[1].content == SUMMARY_HEADER + "Mocked LLM response"
+
     @pytest.mark.asyncio
     async def test_custom_parameters(
         self, mock_env, mock_agent_class, mock_agent, sample_single_message
@@ -169,6 +307,266 @@ class TestLLMServiceGeneration:
         assert call_args[1]["model_settings"]["max_tokens"] == 500
 
 
+class TestLLMServiceFailover:
+    """Test failover between the backends of a logical model"""
+
+    @staticmethod
+    def make_service(agents):
+        router = ProviderRouter({"mistral-large": ["mistral:primary", "mistral:secondary"]})
+        service = LLMService(provider="mistral", router=router)
+        service._agents = {f"mistral:{name}:default": agent for name, agent in agents.items()}
+        return service
+
+    @staticmethod
+    def streaming_agent(chunks, error=None, delay=0.0):
+        class Response:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                pass
+
+            async def stream_text(self, delta=False, debounce_by=0.1):
+                await asyncio.sleep(delay)
+                for chunk in chunks:
+                    yield chunk
+                if error is not None:
+                    raise error
+
+            def usage(self):
+                return RunUsage(input_tokens=1, output_tokens=len(chunks))
+
+        agent = MagicMock()
+        agent.run_stream = MagicMock(return_value=Response())
+        return agent
+
+    @pytest.mark.asyncio
+    async def test_fails_over_on_server_error(self, mock_env, mock_agent, sample_single_message):
+        """Test that a 5xx moves the call to the next backend"""
+        failing = MagicMock()
+        failing.run = AsyncMock(side_effect=ModelHTTPError(503, "primary"))
+        service = self.make_service({"primary": failing, "secondary": mock_agent})
+
+        result = await service.generate_completion(sample_single_message, "mistral-large")
+
+        assert result.content == "Mocked LLM response"
+        assert service.router.backends("mistral-large")[0].breaker.failures == 1
+
+    @pytest.mark.asyncio
+    async def test_client_error_is_not_retried(self, mock_env, mock_agent, sample_single_message):
+        """Test that a 4xx is raised without trying other backends"""
+        failing = MagicMock()
+        failing.run = AsyncMock(side_effect=ModelHTTPError(400, "primary"))
+        service = self.make_service({"primary": failing, "secondary": mock_agent})
+
+        with pytest.raises(ModelHTTPError):
+            await service.generate_completion(sample_single_message, "mistral-large")
+
+        mock_agent.run.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_stream_fails_over_before_first_token(self, mock_env, sample_single_message):
+        """Test stream failover while nothing has been sent yet"""
+        service = self.make_service(
+            {
+                "primary": self.streaming_agent([], httpx.ConnectError("refused")),
+                "secondary": self.streaming_agent(["Hello", "!"]),
+            }
+        )
+
+        chunks = [
+            chunk
+            async for chunk in service.stream_completion(sample_single_message, "mistral-large")
+        ]
+
+        assert chunks == ["Hello", "!"]
+
+    @pytest.mark.asyncio
+    async def test_stream_does_not_fail_over_after_first_token(
+        self, mock_env, sample_single_message
+    ):
+        """Test that a stream failing midway reports the error"""
+        secondary = self.streaming_agent(["Other"])
+        service = self.make_service(
+            {
+                "primary": self.streaming_agent(["Hel"], httpx.ReadTimeout("slow")),
+                "secondary": secondary,
+            }
+        )
+
+        chunks = [
+            chunk
+            async for chunk in service.stream_completion(sample_single_message, "mistral-large")
+        ]
+
+        assert chunks == ["Hel", "Error: slow"]
+        secondary.run_stream.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_slow_stream_is_hedged(self, mock_env, sample_single_message):
+        """Test that a late first token races the next backend"""
+        hedging = HedgePolicy(min_samples=1, min_delay=0.0)
+        hedging.observe("mistral-large", 0.01)
+        hedging.credits = 1
+        service = self.make_service(
+            {
+                "primary": self.streaming_agent(["slow"], delay=1.0),
+                "secondary": self.streaming_agent(["fast"]),
+            }
+        )
+        service.hedging = hedging
+
+        chunks = [
+            chunk
+            async for chunk in service.stream_completion(sample_single_message, "mistral-large")
+        ]
+
+        assert chunks == ["fast"]
+        assert [backend.in_flight for backend in service.router.backends("mistral-large")] == [
+            0,
+            0,
+        ]
+
+    @pytest.mark.asyncio
+    async def test_stream_fails_over_before_hedge_delay(self, mock_env, sample_single_message):
+        """Test that a primary failing before any hedge was sent still fails over"""
+        service = self.make_service(
+            {
+                "primary": self.streaming_agent([], httpx.ConnectError("refused")),
+                "secondary": self.streaming_agent(["Hello"]),
+            }
+        )
+        service.hedging = HedgePolicy()  # Not warmed up: never hedges
+
+        chunks = [
+            chunk
+            async for chunk in service.stream_completion(sample_single_message, "mistral-large")
+        ]
+
+        assert chunks == ["Hello"]
+
+
+class TestLLMServiceBatch:
+    """Test bounded-concurrency batch completions"""
+
+    @pytest.mark.asyncio
+    async def test_runs_every_request_within_concurrency(self, mock_env):
+        """Test that no more than `concurrency` completions are in flight"""
+        service = LLMService(provider="mistral")
+        running = 0
+        peak = 0
+
+        async def call(request):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return request["n"]
+
+        results = [
+            result
+            async for result in service.generate_batch(
+                ({"n": n} for n in range(10)), concurrency=3, call=call
+            )
+        ]
+
+        assert sorted(results) == [(n, n) for n in range(10)]
+        assert peak == 3
+
+    @pytest.mark.asyncio
+    async def test_yields_errors_in_completion_order(self, mock_env):
+        """Test that a failing item is reported without stopping the others"""
+        service = LLMService(provider="mistral")
+
+        async def call(request):
+            await asyncio.sleep(request["delay"])
+            if request.get("fail"):
+                raise ValueError("bad item")
+            return "ok"
+
+        requests = [{"delay": 0.03}, {"delay": 0.0, "fail": True}, {"delay": 0.01}]
+        results = [result async for result in service.generate_batch(requests, call=call)]
+
+        assert [index for index, _ in results] == [1, 2, 0]
+        assert isinstance(results[0][1], ValueError)
+        assert results[2] == (0, "ok")
+
+    @pytest.mark.asyncio
+    async def test_uses_generate_completion_by_default(
+        self, mock_env, mock_agent_class, sample_single_message
+    ):
+        """Test that requests are generate_completion keyword arguments"""
+        service = LLMService(provider="mistral")
+
+        results = [
+            result
+            async for result in service.generate_batch(
+                [{"messages": sample_single_message, "model": "mistral-large"}]
+            )
+        ]
+
+        assert results[0][0] == 0
+        assert results[0][1].content == "Mocked LLM response"
+
+
+class TestMessageHistory:
+    """Test conversion of chat messages to Pydantic AI message history"""
+
+    def test_single_user_message_has_no_history(self, sample_single_message):
+        """Test that a lone user turn is sent as a plain prompt"""
+        prompt, history = to_message_history(sample_single_message, "SYS")
+
+        assert prompt == "Tell me a joke"
+        assert history == []
+
+    def test_client_system_prompt_becomes_system_part(self):
+        """Test that client system messages are real system parts"""
+        messages = [
+            {"role": "system", "content": "Answer in French"},
+            {"role": "user", "content": "Hello"},
+        ]
+
+        prompt, history = to_message_history(messages, "SYS")
+
+        assert prompt == "Hello"
+        assert len(history) == 1
+        assert [type(part) for part in history[0].parts] == [SystemPromptPart, SystemPromptPart]
+        assert [part.content for part in history[0].parts] == ["SYS", "Answer in French"]
+
+    def test_history_prefix_is_stable_across_turns(self, sample_chat_messages):
+        """Test that adding a turn leaves the earlier history unchanged"""
+        next_turn = [
+            *sample_chat_messages,
+            {"role": "assistant", "content": "Fine"},
+            {"role": "user", "content": "Good"},
+        ]
+
+        _, before = to_message_history(sample_chat_messages, "SYS")
+        _, after = to_message_history(next_turn, "SYS")
+
+        def contents(history):
+            return [[part.content for part in message.parts] for message in history]
+
+        assert contents(after)[: len(before)] == contents(before)
+        assert [type(message) for message in after] == [
+            ModelRequest,
+            ModelResponse,
+            ModelRequest,
+            ModelResponse,
+        ]
+        assert isinstance(after[2].parts[0], UserPromptPart)
+
+    def test_transcript_not_ending_with_user(self):
+        """Test that a trailing non-user turn stays in the history"""
+        messages = [{"role": "user", "content": "Hi"}, {"role": "system", "content": "Be brief"}]
+
+        prompt, history = to_message_history(messages, "SYS")
+
+        assert prompt is None
+        assert [part.content for part in history[0].parts] == ["SYS", "Hi", "Be brief"]
+
+
 class TestLLMServiceProviderValidation:
     """Test provider validation logic"""
 
@@ -177,3 +575,45 @@ class TestLLMServiceProviderValidation:
         service = LLMService(provider="mistral")
         # Should not raise
         service._validate_provider()
+
+
+class TestLLMServiceRegistry:
+    """Test the process-wide service registry"""
+
+    def test_get_returns_same_service(self, mock_env):
+        """Test that the registry hands out one service per provider"""
+        registry = LLMServiceRegistry()
+
+        assert registry.get() is registry.get("mistral")
+
+    def test_agents_survive_across_requests(self, mock_env):
+        """Test that agents built for one request are reused by the next"""
+        with (
+            patch("services.llm_service.Agent") as mock_agent_class,
+            patch("services.llm_service.MistralModel"),
+        ):
+            registry = LLMServiceRegistry()
+
+            first = registry.get()._get_agent("mistral-large")
+            second = registry.get()._get_agent("mistral-large")
+
+            assert first is second
+            assert mock_agent_class.call_count == 1
+            assert registry.stats() == {"agents": 1, "hits": 1, "misses": 1}
+
+    def test_services_share_http_client(self, mock_env):
+        """Test that every service uses the registry's pooled client"""
+        registry = LLMServiceRegistry()
+
+        assert registry.get().http_client is registry.http_client
+
+    @pytest.mark.asyncio
+    async def test_aclose_releases_resources(self, mock_env):
+        """Test that closing the registry drops services and the HTTP pool"""
+        registry = LLMServiceRegistry()
+        service = registry.get()
+
+        await registry.aclose()
+
+        assert registry.http_client.is_closed
+        assert registry.get() is not service
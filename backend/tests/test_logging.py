@@ -0,0 +1,74 @@
+"""Unit tests for the logging pipeline"""
+
+import io
+import json
+
+import pytest
+import structlog
+
+from src.core.logger import flush_logging, sample_events, setup_logging
+
+LOGGER = "tests.logging"
+
+
+@pytest.fixture
+def json_logs():
+    """JSON logging into a buffer; console logging is restored afterwards"""
+    stream = io.StringIO()
+    setup_logging("INFO", "json", {"Sampled out": 0.0, "Kept": 1.0}, stream)
+    yield stream
+    setup_logging("INFO", "console", {})
+
+
+def lines(stream: io.StringIO) -> list[dict]:
+    flush_logging()
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestSampling:
+    """Test per-event sampling"""
+
+    def test_unlisted_events_kept(self):
+        event = {"event": "Other"}
+
+        assert sample_events({"Sampled": 0.0})(None, "info", event) is event
+
+    def test_events_dropped_at_rate(self):
+        with pytest.raises(structlog.DropEvent):
+            sample_events({"Sampled": 0.0})(None, "info", {"event": "Sampled"})
+
+    def test_kept_events_carry_rate(self):
+        event = sample_events({"Sampled": 1.0})(None, "info", {"event": "Sampled"})
+
+        assert event["sample_rate"] == 1.0
+
+
+class TestJsonLogging:
+    """Test the queued JSON renderer"""
+
+    def test_one_json_object_per_line(self, json_logs):
+        logger = structlog.get_logger(LOGGER)
+        with structlog.contextvars.bound_contextvars(request_id="abc"):
+            logger.info("Hello", model="mistral-large", text="souveraineté")
+        logger.debug("Below the level")
+        logger.info("Sampled out")
+        logger.info("Kept")
+
+        first, kept = lines(json_logs)
+        assert first["event"] == "Hello"
+        assert first["level"] == "info"
+        assert first["request_id"] == "abc"
+        assert first["text"] == "souveraineté"
+        assert "timestamp" in first
+        assert kept["event"] == "Kept"
+        assert kept["sample_rate"] == 1.0
+
+    def test_exception_rendered(self, json_logs):
+        logger = structlog.get_logger(LOGGER)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.error("Failed", exc_info=True)
+
+        (line,) = lines(json_logs)
+        assert "ValueError: boom" in line["exception"]
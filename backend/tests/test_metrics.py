@@ -0,0 +1,186 @@
+"""Unit tests for the metrics instruments and Prometheus exposition"""
+
+import json
+import os
+import time
+
+import pytest
+
+from src.core.metrics import Histogram, Metrics, MetricsSnapshotter
+
+
+def sample(text: str, line_prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(line_prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line_prefix} not found")
+
+
+class TestInstruments:
+    """Test counters, gauges and histograms"""
+
+    def test_counter_renders_labels(self):
+        """Test a labeled counter sample"""
+        metrics = Metrics()
+        metrics.requests.inc("chat_completions", "mistral-large", "true")
+        metrics.requests.inc("chat_completions", "mistral-large", "true")
+
+        text = metrics.render()
+
+        assert "# TYPE kairn_requests_total counter" in text
+        labels = 'endpoint="chat_completions",model="mistral-large",stream="true"'
+        assert sample(text, f"kairn_requests_total{{{labels}}}") == 2
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test bucket boundaries, sum and count"""
+        histogram = Histogram("latency", "Latency", ("model",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value, "m")
+        metrics = Metrics()
+        metrics.instruments = [histogram]
+
+        text = metrics.render()
+
+        assert sample(text, 'latency_bucket{model="m",le="0.1"}') == 2
+        assert sample(text, 'latency_bucket{model="m",le="1"}') == 3
+        assert sample(text, 'latency_bucket{model="m",le="+Inf"}') == 4
+        assert sample(text, 'latency_count{model="m"}') == 4
+        assert sample(text, 'latency_sum{model="m"}') == pytest.approx(3.65)
+
+    def test_label_values_are_escaped(self):
+        """Test that label values cannot break the exposition format"""
+        metrics = Metrics()
+        metrics.upstream_errors.inc("mistral", 'bad"model', "HTTPError")
+
+        assert 'model="bad\\"model"' in metrics.render()
+
+    def test_stream_timer(self):
+        """Test time to first token, inter-token latency and the active gauge"""
+        metrics = Metrics()
+        timer = metrics.track_stream("chat_completions", "m")
+        assert metrics.active_streams.values[("chat_completions", "m")] == 1
+
+        for _ in range(3):
+            timer.token()
+        timer.finish(completion_tokens=10)
+
+        labels = ("chat_completions", "m")
+        assert metrics.active_streams.values[labels] == 0
+        assert sum(metrics.time_to_first_token.values[labels][:-1]) == 1
+        assert sum(metrics.inter_token_latency.values[labels][:-1]) == 2
+        assert sum(metrics.stream_duration.values[labels][:-1]) == 1
+        assert sum(metrics.tokens_per_second.values[labels][:-1]) == 1
+
+    def test_stream_cancellation_saving(self):
+        """Test that the saving is the average completion length minus what was generated"""
+        metrics = Metrics()
+        metrics.record_stream_cancelled("chat_completions", "m", generated=5, max_tokens=500)
+        metrics.record_usage("chat_completions", "m", prompt_tokens=10, completion_tokens=300)
+
+        saved = metrics.record_stream_cancelled("chat_completions", "m", 100, max_tokens=250)
+
+        labels = ("chat_completions", "m")
+        assert saved == 150  # Capped by max_tokens
+        assert metrics.stream_cancellations.values[labels] == 2
+        assert metrics.stream_tokens_saved.values[labels] == 150
+
+
+class TestAggregation:
+    """Test multi-worker aggregation through snapshots"""
+
+    def test_render_sums_snapshots(self):
+        """Test that other workers' samples are added to live values"""
+        worker = Metrics()
+        worker.requests.inc("chat_completions", "m", "false")
+        worker.request_duration.observe(0.2, "chat_completions", "m")
+        other = Metrics()
+        other.requests.inc("chat_completions", "m", "false", amount=2)
+        other.request_duration.observe(0.3, "chat_completions", "m")
+
+        text = worker.render([json.loads(json.dumps(other.snapshot()))])
+
+        labels = 'endpoint="chat_completions",model="m"'
+        assert sample(text, f'kairn_requests_total{{{labels},stream="false"}}') == 3
+        assert sample(text, f"kairn_request_duration_seconds_count{{{labels}}}") == 2
+        assert sample(text, f"kairn_request_duration_seconds_sum{{{labels}}}") == pytest.approx(0.5)
+
+    def test_snapshotter_reads_other_workers(self, tmp_path):
+        """Test that each worker sees the others' snapshots but not its own"""
+        metrics = Metrics()
+        metrics.requests.inc("chat_completions", "m", "true")
+        snapshotter = MetricsSnapshotter(metrics, str(tmp_path))
+        snapshotter.write()
+        (tmp_path / "worker-1.json").write_text(json.dumps(metrics.snapshot()))
+
+        others = snapshotter.others()
+
+        assert len(others) == 1
+        assert others[0]["kairn_requests_total"] == [[["chat_completions", "m", "true"], 1]]
+
+    def test_stale_workers_keep_counters(self, tmp_path):
+        """Test that a dead worker's counters stay in the sums, without its gauges"""
+        snapshotter = MetricsSnapshotter(Metrics(), str(tmp_path), interval=1)
+        dead = Metrics()
+        dead.requests.inc("chat_completions", "m", "true")
+        dead.active_streams.inc("chat_completions", "m")
+        stale = tmp_path / "worker-1.json"
+        stale.write_text(json.dumps(dead.snapshot()))
+        past = time.time() - 10
+        os.utime(stale, (past, past))
+
+        [snapshot] = snapshotter.others()
+
+        assert snapshot["kairn_requests_total"] == [[["chat_completions", "m", "true"], 1]]
+        assert "kairn_active_streams" not in snapshot
+
+    @pytest.mark.asyncio
+    async def test_stopped_worker_totals_do_not_drop(self, tmp_path):
+        """Test that a worker's final counters are retired on shutdown, not removed"""
+        metrics = Metrics()
+        snapshotter = MetricsSnapshotter(metrics, str(tmp_path))
+        snapshotter.start()
+        metrics.requests.inc("chat_completions", "m", "false")
+        other = MetricsSnapshotter(Metrics(), str(tmp_path))
+        labels = 'endpoint="chat_completions",model="m",stream="false"'
+
+        await snapshotter.stop()
+
+        assert not os.path.exists(snapshotter.path)
+        text = other.metrics.render(other.others())
+        assert sample(text, f"kairn_requests_total{{{labels}}}") == 1
+
+    @pytest.mark.asyncio
+    async def test_leftover_file_of_same_pid_is_retired(self, tmp_path):
+        """Test that a new worker reusing a dead worker's pid keeps its counters"""
+        dead = Metrics()
+        dead.requests.inc("chat_completions", "m", "false", amount=3)
+        snapshotter = MetricsSnapshotter(Metrics(), str(tmp_path))
+        with open(snapshotter.path, "w") as f:
+            json.dump(dead.snapshot(), f)
+
+        snapshotter.start()
+        others = snapshotter.others()
+        await snapshotter.stop()
+
+        assert [snapshot["kairn_requests_total"] for snapshot in others] == [
+            [[["chat_completions", "m", "false"], 3]]
+        ]
+
+    def test_exited_workers_share_one_file(self, tmp_path):
+        """Test that retired counters are accumulated in a single snapshot"""
+        for amount in (1, 2):
+            metrics = Metrics()
+            metrics.requests.inc("chat_completions", "m", "false", amount=amount)
+            metrics.active_streams.inc("chat_completions", "m")
+            snapshotter = MetricsSnapshotter(metrics, str(tmp_path))
+            snapshotter.write()
+            snapshotter.retire()
+
+        [retired] = MetricsSnapshotter(Metrics(), str(tmp_path)).others()
+
+        assert sorted(entry.name for entry in os.scandir(tmp_path)) == [
+            "retired.json",
+            "retired.lock",
+        ]
+        assert retired["kairn_requests_total"] == [[["chat_completions", "m", "false"], 3]]
+        assert "kairn_active_streams" not in retired
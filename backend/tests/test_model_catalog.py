@@ -0,0 +1,133 @@
+"""Unit tests for the pre-encoded model lists"""
+
+import json
+
+import httpx
+import pytest
+
+from src.services.model_catalog import EncodedResponse, ModelCatalog
+from src.services.router import ProviderRouter
+
+MODELS = [
+    {"name": "mistral-large", "model": "mistral-large", "modified_at": "2024-01-01T00:00:00Z"},
+]
+ALIASES = {"mistral-large": "mistral-large-latest"}
+
+
+def upstream(models: list[dict], status: int = 200) -> httpx.AsyncClient:
+    """Client whose GET /models answers with `models`"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/v1/models"
+        return httpx.Response(status, json={"object": "list", "data": models})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def catalog(client: httpx.AsyncClient = None) -> ModelCatalog:
+    return ModelCatalog(
+        MODELS,
+        ALIASES,
+        endpoints={"mistral": ("http://upstream/v1", "key")},
+        http_client=client,
+        interval=60,
+    )
+
+
+class TestEncodedResponse:
+    """Test ETag matching"""
+
+    def test_etag_is_stable(self):
+        assert EncodedResponse.of({"a": 1}).etag == EncodedResponse.of({"a": 1}).etag
+        assert EncodedResponse.of({"a": 1}).etag != EncodedResponse.of({"a": 2}).etag
+
+    def test_matches_if_none_match(self):
+        encoded = EncodedResponse.of({"a": 1})
+
+        assert encoded.matches(encoded.etag)
+        assert encoded.matches(f'"other", W/{encoded.etag}')
+        assert encoded.matches("*")
+        assert not encoded.matches('"other"')
+        assert not encoded.matches(None)
+
+
+class TestModelCatalog:
+    """Test the configured and discovered model lists"""
+
+    def test_configured_models(self):
+        """Test that created comes from modified_at, so the bytes never change"""
+        data = json.loads(ModelCatalog(MODELS, ALIASES).openai.body)["data"]
+
+        assert data == [
+            {
+                "id": "mistral-large",
+                "object": "model",
+                "created": 1704067200,
+                "owned_by": "mistral-ai",
+                "root": "mistral-large-latest",
+            }
+        ]
+        assert ModelCatalog(MODELS, ALIASES).openai == ModelCatalog(MODELS, ALIASES).openai
+
+    @pytest.mark.asyncio
+    async def test_refresh_merges_discovered_models(self):
+        """Test that new upstream models are added, aliased and non-chat ones are not"""
+        client = upstream(
+            [
+                {"id": "mistral-large-latest", "created": 1, "owned_by": "mistralai"},
+                {"id": "codestral-latest", "created": 2, "owned_by": "mistralai"},
+                {"id": "mistral-embed", "capabilities": {"completion_chat": False}},
+            ]
+        )
+        models = catalog(client)
+        etag = models.openai.etag
+
+        assert await models.refresh()
+
+        ids = [model["id"] for model in json.loads(models.openai.body)["data"]]
+        assert ids == ["mistral-large", "codestral-latest"]
+        tags = [model["name"] for model in json.loads(models.ollama.body)["models"]]
+        assert tags == ["mistral-large", "codestral-latest"]
+        assert models.openai.etag != etag
+
+    @pytest.mark.asyncio
+    async def test_unchanged_refresh_keeps_etag(self):
+        models = catalog(upstream([{"id": "codestral-latest"}]))
+        await models.refresh()
+        etag = models.openai.etag
+
+        assert not await models.refresh()
+        assert models.openai.etag == etag
+
+    @pytest.mark.asyncio
+    async def test_failed_refresh_keeps_previous_list(self):
+        models = catalog(upstream([], status=503))
+
+        assert not await models.refresh()
+        assert models.count == 1
+
+    @pytest.mark.asyncio
+    async def test_discovered_models_are_routed(self):
+        """Test that a model listed by another provider than the default can be requested"""
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            ids = ["codestral-latest"] if request.url.host == "mistral" else ["gpt-oss-120b"]
+            return httpx.Response(200, json={"data": [{"id": id} for id in ids]})
+
+        router = ProviderRouter(default_provider="mistral")
+        models = ModelCatalog(
+            MODELS,
+            ALIASES,
+            endpoints={"mistral": ("http://mistral/v1", "key"), "openai": ("http://oss/v1", "key")},
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+            router=router,
+        )
+        router.candidates("gpt-oss-120b")  # Requested before it was discovered
+
+        await models.refresh()
+
+        assert "gpt-oss-120b" in [model["id"] for model in json.loads(models.openai.body)["data"]]
+        assert [backend.name for backend in router.candidates("gpt-oss-120b")] == [
+            "openai:gpt-oss-120b"
+        ]
+        assert router.candidates("codestral-latest")[0].provider == "mistral"
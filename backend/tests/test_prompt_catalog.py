@@ -0,0 +1,64 @@
+"""Unit tests for system prompt variants"""
+
+import pytest
+
+from src.services.prompt_catalog import PromptCatalog, canonical
+from src.services.tokens import MESSAGE_OVERHEAD_TOKENS, TokenEstimator
+
+
+class TestCanonical:
+    """Test the canonical byte layout of prompts"""
+
+    def test_layout_independent_of_editor(self):
+        """Test that line endings, trailing spaces and blank edges do not matter"""
+        assert canonical("\n\nBe brief.  \r\nBe kind.\t\n\n") == "Be brief.\nBe kind."
+
+    def test_unicode_normalized(self):
+        assert canonical("souverain\u0065\u0301") == "souverain\u00e9"
+
+    def test_inner_layout_kept(self):
+        assert canonical("- one\n\n  - two") == "- one\n\n  - two"
+
+
+class TestPromptCatalog:
+    """Test variant selection and precomputed counts"""
+
+    def test_tokens_counted_once(self):
+        """Test that each variant is counted when the catalog is built"""
+        catalog = PromptCatalog("abcdefgh", {"short": "abcd"}, estimator=TokenEstimator())
+
+        assert catalog.default.tokens == 2 + MESSAGE_OVERHEAD_TOKENS
+        assert catalog.prompts["short"].tokens == 1 + MESSAGE_OVERHEAD_TOKENS
+
+    def test_select_by_tenant_then_model(self):
+        catalog = PromptCatalog(
+            "Default",
+            {"small": "Small", "acme": "Acme"},
+            models={"mistral-small": "small"},
+            tenants={"acme": "acme"},
+        )
+
+        assert catalog.select("mistral-small").name == "small"
+        assert catalog.select("mistral-small", "acme").name == "acme"
+        assert catalog.select("mistral-large", "other").name == "default"
+
+    def test_select_by_upstream_model(self):
+        """Test that rules may name the model behind MODEL_MAP"""
+        catalog = PromptCatalog(
+            "Default", {"large": "Large"}, models={"mistral-large-latest": "large"}
+        )
+
+        assert catalog.select("mistral-large").text == "Large"
+
+    def test_unknown_variant_rejected(self):
+        with pytest.raises(ValueError, match="missing"):
+            PromptCatalog("Default", models={"mistral-large": "missing"})
+
+    def test_variants_from_files(self, tmp_path):
+        path = tmp_path / "concise.md"
+        path.write_text("Answer in one sentence.\r\n", encoding="utf-8")
+
+        catalog = PromptCatalog.from_files("Default", {"concise": str(path)})
+
+        assert catalog.prompts["concise"].text == "Answer in one sentence."
+        assert catalog.prompts["concise"].digest != catalog.default.digest
@@ -0,0 +1,110 @@
+"""Unit tests for the response cache"""
+
+from unittest.mock import patch
+
+import pytest
+
+from src.services.response_cache import ResponseCache, replay_deltas, request_key
+
+
+class TestRequestKey:
+    """Test canonical request hashing"""
+
+    def test_same_request_same_key(self, sample_chat_messages):
+        """Test that equal requests hash equally"""
+        first = request_key("mistral-large", sample_chat_messages, 0, 100, "SYS")
+        second = request_key("mistral-large", list(sample_chat_messages), 0.0, 100, "SYS")
+
+        assert first == second
+
+    def test_any_parameter_changes_key(self, sample_chat_messages):
+        """Test that every parameter is part of the key"""
+        base = request_key("mistral-large", sample_chat_messages, 0, 100, "SYS")
+
+        assert base != request_key("mistral-medium", sample_chat_messages, 0, 100, "SYS")
+        assert base != request_key("mistral-large", sample_chat_messages[:1], 0, 100, "SYS")
+        assert base != request_key("mistral-large", sample_chat_messages, 0.5, 100, "SYS")
+        assert base != request_key("mistral-large", sample_chat_messages, 0, 200, "SYS")
+        assert base != request_key("mistral-large", sample_chat_messages, 0, 100, "OTHER")
+
+
+class TestResponseCache:
+    """Test memory and disk tiers"""
+
+    def test_get_set(self):
+        """Test a miss followed by a hit"""
+        cache = ResponseCache()
+
+        assert cache.get("key") is None
+        cache.set("key", "value")
+
+        assert cache.get("key") == "value"
+        assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first"""
+        cache = ResponseCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_ttl_expiry(self):
+        """Test that expired entries are misses"""
+        cache = ResponseCache(ttl=10)
+        with patch("src.services.response_cache.time.monotonic", return_value=0):
+            cache.set("key", "value")
+        with patch("src.services.response_cache.time.monotonic", return_value=11):
+            assert cache.get("key") is None
+
+    def test_accepts_sampled_only_when_configured(self):
+        """Test the temperature bypass rule"""
+        assert ResponseCache().accepts(0)
+        assert not ResponseCache().accepts(0.7)
+        assert ResponseCache(cache_sampled=True).accepts(0.7)
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        """Test that entries are reloaded from the SQLite tier"""
+        db_path = str(tmp_path / "cache.db")
+        cache = ResponseCache(db_path=db_path)
+        cache.set("key", {"content": "value"})
+        cache.close()
+
+        restarted = ResponseCache(db_path=db_path)
+
+        assert restarted.get("key") == {"content": "value"}
+        restarted.close()
+
+    def test_disk_tier_is_purged_and_capped(self, tmp_path):
+        """Test that expired and excess rows are deleted while running"""
+        cache = ResponseCache(db_path=str(tmp_path / "cache.db"), ttl=100, max_db_entries=2)
+        for now, key in [(0, "expired"), (1000, "a"), (1001, "b"), (1002, "c"), (1070, "d")]:
+            with patch("src.services.response_cache.time.time", return_value=now):
+                cache.set(key, key)
+
+        rows = cache._db.execute("SELECT key FROM responses ORDER BY key").fetchall()
+        assert rows == [("c",), ("d",)]
+        cache.close()
+
+
+class TestReplayDeltas:
+    """Test replay of recorded streams"""
+
+    @pytest.mark.asyncio
+    async def test_replay_as_recorded(self):
+        """Test that deltas are replayed unchanged by default"""
+        chunks = [chunk async for chunk in replay_deltas(["Hel", "lo", " ", "World"])]
+
+        assert chunks == ["Hel", "lo", " ", "World"]
+
+    @pytest.mark.asyncio
+    async def test_replay_coalesced(self):
+        """Test that deltas are merged up to the chunk size"""
+        chunks = [chunk async for chunk in replay_deltas(["Hel", "lo", " ", "World"], 4)]
+
+        assert chunks == ["Hello", " World"]
+        assert "".join(chunks) == "Hello World"
@@ -0,0 +1,160 @@
+"""Unit tests for the provider router"""
+
+import time
+
+import httpx
+from pydantic_ai.exceptions import ModelHTTPError
+
+from src.core.metrics import Metrics
+from src.services.router import CircuitBreaker, ProviderRouter, is_retryable
+
+
+class TestRetryable:
+    """Test which errors trigger a failover"""
+
+    def test_retryable_errors(self):
+        assert is_retryable(ModelHTTPError(503, "m"))
+        assert is_retryable(ModelHTTPError(429, "m"))
+        assert is_retryable(httpx.ConnectTimeout("timeout"))
+        assert is_retryable(TimeoutError())
+
+    def test_client_errors_are_final(self):
+        assert not is_retryable(ModelHTTPError(400, "m"))
+        assert not is_retryable(ValueError("bad request"))
+
+
+class TestCircuitBreaker:
+    """Test ejection and recovery"""
+
+    def test_opens_after_threshold(self):
+        """Test that consecutive failures eject the backend"""
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=30)
+
+        breaker.failure()
+        assert breaker.state == "closed"
+        breaker.failure()
+        assert breaker.state == "open"
+        assert not breaker.available()
+
+    def test_half_open_after_cooldown(self):
+        """Test that a probe is allowed after the cooldown and success closes it"""
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+        breaker.failure()
+        breaker.opened_at = time.monotonic() - 31
+
+        assert breaker.state == "half_open"
+        assert breaker.available()
+        breaker.success()
+        assert breaker.state == "closed"
+
+    def test_failed_probe_reopens(self):
+        """Test that a failing probe starts a new cooldown"""
+        breaker = CircuitBreaker(failure_threshold=3, cooldown=30)
+        for _ in range(3):
+            breaker.failure()
+        breaker.opened_at = time.monotonic() - 31
+
+        breaker.failure()
+
+        assert breaker.state == "open"
+
+
+class TestProviderRouter:
+    """Test backend selection"""
+
+    def test_default_backend(self):
+        """Test that unlisted models use the default provider and MODEL_MAP"""
+        router = ProviderRouter(default_provider="mistral")
+
+        [backend] = router.candidates("mistral-large")
+
+        assert backend.name == "mistral:mistral-large-latest"
+
+    def test_backends_by_alias_target(self):
+        """Test that backends registered for a MODEL_MAP target serve its aliases"""
+        router = ProviderRouter(
+            {"mistral-large-latest": ["mistral:mistral-large-latest", "openai:local"]}
+        )
+
+        names = [backend.name for backend in router.backends("mistral-large:latest")]
+
+        assert names == ["mistral:mistral-large-latest", "openai:local"]
+        assert router.backends("mistral-large")[1] is router.backends("mistral-large:latest")[1]
+
+    def test_register_keeps_existing_routes(self):
+        """Test that discovered models do not override configured or default routes"""
+        backends = {"local": ["openai:local"]}
+        router = ProviderRouter(backends, default_provider="mistral")
+
+        router.register("local", ["vllm"])
+        router.register("codestral-latest", ["mistral", "openai"])
+        router.register("gpt-oss", ["openai"])
+
+        assert router.backends("local")[0].name == "openai:local"
+        assert router.backends("codestral-latest")[0].name == "mistral:codestral-latest"
+        assert router.backends("gpt-oss")[0].name == "openai:gpt-oss"
+        assert backends == {"local": ["openai:local"]}
+
+    def test_prefers_lower_latency_and_load(self):
+        """Test ordering by EWMA latency weighted by in-flight calls"""
+        router = ProviderRouter({"m": ["mistral:fast", "openai:slow"]})
+        fast, slow = router.backends("m")
+        fast.latency, slow.latency = 0.2, 0.5
+
+        assert router.candidates("m") == [fast, slow]
+
+        fast.in_flight = 3  # 0.2 * 4 > 0.5
+        assert router.candidates("m") == [slow, fast]
+
+    def test_ejected_backends_go_last(self):
+        """Test that open breakers are only tried as a last resort"""
+        router = ProviderRouter({"m": ["mistral:a", "openai:b"]}, failure_threshold=1)
+        a, b = router.backends("m")
+        a.latency, b.latency = 0.1, 5.0
+
+        with_failure = router.attempt(a)
+        with_failure.__enter__()
+        with_failure.__exit__(ModelHTTPError, ModelHTTPError(502, "a"), None)
+
+        assert router.candidates("m") == [b, a]
+        assert router.stats()["mistral:a"]["state"] == "open"
+
+    def test_attempt_updates_latency(self):
+        """Test the latency average and in-flight count"""
+        router = ProviderRouter({"m": ["mistral:a", "openai:b"]}, smoothing=0.5)
+        backend = router.backends("m")[0]
+
+        with router.attempt(backend) as attempt:
+            assert backend.in_flight == 1
+            attempt.latency = 1.0
+        with router.attempt(backend) as attempt:
+            attempt.latency = 3.0
+
+        assert backend.in_flight == 0
+        assert backend.latency == 2.0
+
+    def test_streams_and_calls_are_scored_apart(self):
+        """Test that time to first token and whole-call latency are not mixed"""
+        router = ProviderRouter({"m": ["mistral:a", "openai:b"]})
+        a, b = router.backends("m")
+        with router.attempt(a, streaming=True) as attempt:
+            attempt.latency = 0.3  # First token
+        with router.attempt(b) as attempt:
+            attempt.latency = 2.0  # Whole completion
+        with router.attempt(a) as attempt:
+            attempt.latency = 4.0
+
+        assert (a.ttft, a.latency, b.ttft, b.latency) == (0.3, 4.0, None, 2.0)
+        assert router.candidates("m") == [b, a]
+        assert router.candidates("m", streaming=True) == [b, a]  # b's streams are untried
+        b.ttft = 0.5
+        assert router.candidates("m", streaming=True) == [a, b]
+
+    def test_failover_is_counted(self):
+        """Test the failover metric"""
+        metrics = Metrics()
+        router = ProviderRouter({"m": ["mistral:a", "openai:b"]}, metrics=metrics)
+
+        router.failover(router.backends("m")[0], TimeoutError())
+
+        assert metrics.upstream_failovers.values == {("mistral", "a"): 1}
@@ -0,0 +1,54 @@
+"""Unit tests for the application runner"""
+
+import os
+
+from run import available_cpus, configure_workers
+
+
+class TestConfigureWorkers:
+    """Test worker sizing and shared state setup"""
+
+    def test_defaults_to_available_cpus(self, tmp_path):
+        environ = {"SHARED_STATE_DIR": str(tmp_path)}
+
+        workers = configure_workers(environ)
+
+        assert workers == available_cpus()
+        assert environ["WEB_CONCURRENCY"] == str(workers)
+
+    def test_available_cpus_follows_affinity(self, monkeypatch):
+        """Test that a container limited to some CPUs gets one worker per allowed CPU"""
+        monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0, 1}, raising=False)
+        monkeypatch.setattr(os, "cpu_count", lambda: 64)
+
+        assert available_cpus() == 2
+
+        monkeypatch.delattr(os, "sched_getaffinity")
+        assert available_cpus() == 64
+
+    def test_single_worker_keeps_state_in_process(self):
+        environ = {"WEB_CONCURRENCY": "1"}
+
+        assert configure_workers(environ) == 1
+        assert "JOBS_DB_PATH" not in environ
+        assert "METRICS_MULTIPROC_DIR" not in environ
+
+    def test_workers_share_state_directory(self, tmp_path):
+        """Test that shared state defaults to files in one directory"""
+        environ = {"WEB_CONCURRENCY": "4", "SHARED_STATE_DIR": str(tmp_path)}
+
+        assert configure_workers(environ) == 4
+        assert environ["JOBS_DB_PATH"] == str(tmp_path / "jobs.db")
+        assert environ["RATE_LIMIT_DB_PATH"] == str(tmp_path / "ratelimits.db")
+        assert environ["METRICS_MULTIPROC_DIR"] == str(tmp_path / "metrics")
+
+    def test_explicit_paths_are_kept(self, tmp_path):
+        environ = {
+            "WEB_CONCURRENCY": "2",
+            "SHARED_STATE_DIR": str(tmp_path),
+            "JOBS_DB_PATH": "/data/jobs.db",
+        }
+
+        configure_workers(environ)
+
+        assert environ["JOBS_DB_PATH"] == "/data/jobs.db"
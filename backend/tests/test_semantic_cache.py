@@ -0,0 +1,116 @@
+"""Unit tests for the semantic cache"""
+
+import json
+import struct
+
+import numpy as np
+import pytest
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+
+from src.services.semantic_cache import SemanticCache, StaticEmbedder, semantic_query
+
+VOCAB = ["[UNK]", "what", "is", "sovereign", "cloud", "a", "explain", "pricing", "gpu"]
+
+
+@pytest.fixture
+def embedder(tmp_path):
+    """Static embedder over a tiny one-hot vocabulary"""
+    tokenizer = Tokenizer(WordLevel({word: i for i, word in enumerate(VOCAB)}, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    tokenizer.save(str(tmp_path / "tokenizer.json"))
+
+    matrix = np.eye(len(VOCAB), dtype=np.float32)
+    header = json.dumps(
+        {
+            "embeddings": {
+                "dtype": "F32",
+                "shape": list(matrix.shape),
+                "data_offsets": [0, matrix.nbytes],
+            }
+        }
+    ).encode()
+    with open(tmp_path / "model.safetensors", "wb") as f:
+        f.write(struct.pack("<Q", len(header)) + header + matrix.tobytes())
+
+    return StaticEmbedder(str(tmp_path / "tokenizer.json"), str(tmp_path / "model.safetensors"))
+
+
+class TestStaticEmbedder:
+    """Test sentence embeddings from a static table"""
+
+    def test_embeddings_are_normalized(self, embedder):
+        """Test that sentence vectors have unit length"""
+        vector = embedder("what is sovereign cloud")
+
+        assert embedder.dim == len(VOCAB)
+        assert np.linalg.norm(vector) == pytest.approx(1.0)
+
+    def test_similar_sentences_are_close(self, embedder):
+        """Test that rewordings score higher than unrelated questions"""
+        question = embedder("what is sovereign cloud")
+
+        assert question @ embedder("explain sovereign cloud") > question @ embedder("gpu pricing")
+
+
+class TestSemanticQuery:
+    """Test which requests are eligible for semantic lookup"""
+
+    def test_single_question_is_eligible(self):
+        """Test that a fresh question yields a scope and the question"""
+        messages = [{"role": "system", "content": "Be brief"}, {"role": "user", "content": "Hi"}]
+
+        scope, question = semantic_query("mistral-large", messages, "SYS")
+
+        assert question == "Hi"
+        assert scope != semantic_query("mistral-medium", messages, "SYS")[0]
+
+    def test_conversation_is_not_eligible(self, sample_chat_messages):
+        """Test that answers depending on history are never shared"""
+        assert semantic_query("mistral-large", sample_chat_messages, "SYS") is None
+
+
+class TestSemanticCache:
+    """Test lookups in the vector index"""
+
+    def test_near_duplicate_hit(self, embedder):
+        """Test that a reworded question gets the stored answer"""
+        cache = SemanticCache(embedder, embedder.dim, threshold=0.7)
+        cache.add("scope", "what is sovereign cloud", "Sovereign cloud is...")
+
+        answer, similarity = cache.lookup("scope", "what is a sovereign cloud")
+
+        assert answer == "Sovereign cloud is..."
+        assert similarity >= 0.7
+        assert cache.lookup("scope", "gpu pricing") is None
+        assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+    def test_scopes_are_isolated(self, embedder):
+        """Test that answers are not shared across models or system prompts"""
+        cache = SemanticCache(embedder, embedder.dim, threshold=0.7)
+        cache.add("a" * 64, "what is sovereign cloud", "answer")
+
+        assert cache.lookup("b" * 64, "what is sovereign cloud") is None
+
+    def test_ring_buffer_overwrites_oldest(self, embedder):
+        """Test that the oldest entry is replaced when the index is full"""
+        cache = SemanticCache(embedder, embedder.dim, capacity=1, threshold=0.9)
+        cache.add("scope", "sovereign cloud", "old")
+        cache.add("scope", "gpu pricing", "new")
+
+        assert cache.lookup("scope", "sovereign cloud") is None
+        assert cache.lookup("scope", "gpu pricing")[0] == "new"
+
+    def test_index_survives_restart(self, embedder, tmp_path):
+        """Test that the memory-mapped index reloads without re-embedding"""
+        path = str(tmp_path / "index")
+        cache = SemanticCache(embedder, embedder.dim, path=path, threshold=0.9)
+        cache.add("scope", "sovereign cloud", "answer")
+        cache.close()
+
+        restarted = SemanticCache(embedder, embedder.dim, path=path, threshold=0.9)
+
+        assert restarted.size == 1
+        assert restarted.lookup("scope", "sovereign cloud")[0] == "answer"
+        restarted.close()
@@ -0,0 +1,163 @@
+"""Unit tests for request coalescing"""
+
+import asyncio
+
+import pytest
+
+from src.services.singleflight import SingleFlight
+
+
+class TestSingleFlightDo:
+    """Test coalescing of non-streaming calls"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_upstream_call(self):
+        """Test that identical concurrent requests run once"""
+        flights = SingleFlight()
+        calls = 0
+
+        async def generate():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(flights.do("key", generate) for _ in range(5)))
+
+        assert results == ["answer"] * 5
+        assert calls == 1
+        assert flights.stats() == {"in_flight": 0, "shared": 4}
+
+    @pytest.mark.asyncio
+    async def test_errors_reach_every_caller(self):
+        """Test that an upstream failure is reported to all waiters"""
+        flights = SingleFlight()
+
+        async def generate():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(
+            flights.do("key", generate), flights.do("key", generate), return_exceptions=True
+        )
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    @pytest.mark.asyncio
+    async def test_finished_calls_are_not_reused(self):
+        """Test that sequential requests each reach upstream"""
+        flights = SingleFlight()
+        calls = 0
+
+        async def generate():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        assert await flights.do("key", generate) == 1
+        assert await flights.do("key", generate) == 2
+
+
+class TestSingleFlightStream:
+    """Test fan-out of streaming calls"""
+
+    @staticmethod
+    def make_stream(opened: list, chunks: list[str], delay: float = 0.01):
+        async def stream():
+            opened.append(True)
+            for chunk in chunks:
+                await asyncio.sleep(delay)
+                yield chunk
+
+        return stream
+
+    @pytest.mark.asyncio
+    async def test_subscribers_share_one_stream(self):
+        """Test that concurrent streams are fanned out from one upstream stream"""
+        flights = SingleFlight()
+        opened = []
+        factory = self.make_stream(opened, ["Hello", " ", "World"])
+
+        async def collect():
+            subscription, _ = flights.stream("key", factory)
+            return [chunk async for chunk in subscription]
+
+        results = await asyncio.gather(collect(), collect(), collect())
+
+        assert results == [["Hello", " ", "World"]] * 3
+        assert len(opened) == 1
+
+    @pytest.mark.asyncio
+    async def test_late_joiner_replays_from_start(self):
+        """Test that a subscriber joining mid-stream still gets every chunk"""
+        flights = SingleFlight()
+        opened = []
+        factory = self.make_stream(opened, ["a", "b", "c", "d"])
+
+        first, _ = flights.stream("key", factory)
+        assert await anext(first) == "a"
+        assert await anext(first) == "b"
+
+        late_subscription, _ = flights.stream("key", factory)
+        late = [chunk async for chunk in late_subscription]
+        rest = [chunk async for chunk in first]
+
+        assert late == ["a", "b", "c", "d"]
+        assert rest == ["c", "d"]
+        assert len(opened) == 1
+
+    @pytest.mark.asyncio
+    async def test_joiners_share_the_starters_state(self):
+        """Test that state filled by the upstream stream reaches every subscriber"""
+        flights = SingleFlight()
+        factory = self.make_stream([], ["a"])
+
+        leader, leader_state = flights.stream("key", factory, state={"owner": "leader"})
+        joiner, joiner_state = flights.stream("key", factory, state={"owner": "joiner"})
+
+        assert joiner_state is leader_state
+        assert [chunk async for chunk in leader] == [chunk async for chunk in joiner]
+
+    @pytest.mark.asyncio
+    async def test_upstream_cancelled_when_last_subscriber_leaves(self):
+        """Test that the shared stream stops once nobody listens"""
+        flights = SingleFlight()
+        closed = asyncio.Event()
+
+        async def stream():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield "token"
+            finally:
+                closed.set()
+
+        subscriber, _ = flights.stream("key", stream)
+        await anext(subscriber)
+        await subscriber.aclose()
+
+        await asyncio.wait_for(closed.wait(), timeout=1)
+        assert flights.stats()["in_flight"] == 0
+
+    @pytest.mark.asyncio
+    async def test_unstarted_subscription_releases_its_place(self):
+        """Test that a follower dropped before iterating does not keep the stream alive"""
+        flights = SingleFlight()
+        closed = asyncio.Event()
+
+        async def stream():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield "token"
+            finally:
+                closed.set()
+
+        leader, _ = flights.stream("key", stream)
+        follower, _ = flights.stream("key", stream)
+        await anext(leader)
+        await leader.aclose()
+        del follower  # Client gone before its response started
+
+        await asyncio.wait_for(closed.wait(), timeout=1)
+        assert flights.stats()["in_flight"] == 0
@@ -0,0 +1,267 @@
+"""Unit tests for stream encoding and delta coalescing"""
+
+import asyncio
+import json
+
+import pytest
+from starlette.background import BackgroundTask
+
+from src.api.streaming import (
+    DONE_EVENT,
+    CancellableStreamingResponse,
+    ChatChunkEncoder,
+    OllamaChunkEncoder,
+    coalesce_deltas,
+)
+
+
+def parse_event(event: bytes) -> dict:
+    assert event.startswith(b"data: ") and event.endswith(b"\n\n")
+    return json.loads(event[6:-2])
+
+
+async def source(deltas, delay=0.0):
+    for delta in deltas:
+        if delay:
+            await asyncio.sleep(delay)
+        yield delta
+
+
+class TestChatChunkEncoder:
+    """Test pre-rendered SSE frames"""
+
+    def test_delta_is_valid_openai_chunk(self):
+        """Test that a delta frame matches the OpenAI chunk format"""
+        encoder = ChatChunkEncoder("mistral-large")
+
+        chunk = parse_event(encoder.delta('Say "bonjour"\n'))
+
+        assert chunk["id"] == encoder.id
+        assert chunk["object"] == "chat.completion.chunk"
+        assert chunk["created"] == encoder.created
+        assert chunk["model"] == "mistral-large"
+        assert chunk["choices"] == [
+            {
+                "index": 0,
+                "delta": {"role": "assistant", "content": 'Say "bonjour"\n'},
+                "finish_reason": None,
+            }
+        ]
+
+    def test_role_only_on_first_delta(self):
+        """Test that later deltas carry only content"""
+        encoder = ChatChunkEncoder("mistral-large")
+        encoder.delta("Hello")
+
+        chunk = parse_event(encoder.delta(" World"))
+
+        assert chunk["choices"][0]["delta"] == {"content": " World"}
+
+    def test_non_ascii_is_not_escaped(self):
+        """Test that accented text is sent as UTF-8, not \\u escapes"""
+        event = ChatChunkEncoder("mistral-large").delta("souveraineté")
+
+        assert "souveraineté".encode() in event
+        assert parse_event(event)["choices"][0]["delta"]["content"] == "souveraineté"
+
+    def test_final_ends_stream(self):
+        """Test the closing chunk and [DONE] marker"""
+        encoder = ChatChunkEncoder("mistral-large")
+
+        final, done = encoder.final().split(b"\n\n", 1)
+
+        chunk = parse_event(final + b"\n\n")
+        assert chunk["choices"][0]["finish_reason"] == "stop"
+        assert chunk["choices"][0]["delta"] == {}
+        assert done == DONE_EVENT
+
+    def test_final_with_usage(self):
+        """Test the usage chunk sent before [DONE]"""
+        encoder = ChatChunkEncoder("mistral-large")
+        usage = {"prompt_tokens": 5, "completion_tokens": 2, "total_tokens": 7}
+
+        final, usage_event, done = encoder.final(usage).split(b"\n\n", 2)
+
+        assert parse_event(final + b"\n\n")["choices"][0]["finish_reason"] == "stop"
+        chunk = parse_event(usage_event + b"\n\n")
+        assert chunk["id"] == encoder.id
+        assert chunk["choices"] == []
+        assert chunk["usage"] == usage
+        assert done == DONE_EVENT
+
+
+class TestOllamaChunkEncoder:
+    """Test pre-rendered NDJSON lines"""
+
+    def test_chat_delta(self):
+        encoder = OllamaChunkEncoder("mistral-large")
+
+        line = encoder.delta('Dites "bonjour"\n')
+
+        assert line.endswith(b"\n") and line.count(b"\n") == 1
+        assert json.loads(line) == {
+            "model": "mistral-large",
+            "created_at": encoder.created_at,
+            "message": {"role": "assistant", "content": 'Dites "bonjour"\n'},
+            "done": False,
+        }
+
+    def test_generate_delta(self):
+        line = OllamaChunkEncoder("mistral-large", chat=False).delta("souveraineté")
+
+        assert "souveraineté".encode() in line
+        assert json.loads(line)["response"] == "souveraineté"
+
+    def test_final_with_stats(self):
+        """Test the closing line with done set and the counters"""
+        final = json.loads(OllamaChunkEncoder("mistral-large").final({"eval_count": 2}))
+
+        assert final["message"] == {"role": "assistant", "content": ""}
+        assert final["done"] is True
+        assert final["done_reason"] == "stop"
+        assert final["eval_count"] == 2
+
+
+class TestCoalesceDeltas:
+    """Test merging of deltas into fewer events"""
+
+    @pytest.mark.asyncio
+    async def test_passthrough_by_default(self):
+        """Test that deltas are untouched without limits"""
+        merged = [delta async for delta in coalesce_deltas(source(["a", "b", "c"]))]
+
+        assert merged == ["a", "b", "c"]
+
+    @pytest.mark.asyncio
+    async def test_merge_by_size(self):
+        """Test that deltas are flushed once enough characters are buffered"""
+        merged = [
+            delta async for delta in coalesce_deltas(source(["ab", "c", "de", "f"]), max_chars=3)
+        ]
+
+        assert merged == ["abc", "def"]
+
+    @pytest.mark.asyncio
+    async def test_merge_by_window(self):
+        """Test that fast deltas are merged within the time window"""
+        merged = [delta async for delta in coalesce_deltas(source(list("abcdef")), window=0.05)]
+
+        assert merged == ["abcdef"]
+
+    @pytest.mark.asyncio
+    async def test_window_flushes_when_source_stalls(self):
+        """Test that buffered text is not held back by a slow source"""
+
+        async def stalled():
+            yield "a"
+            yield "b"
+            await asyncio.sleep(0.2)
+            yield "c"
+
+        merged = [delta async for delta in coalesce_deltas(stalled(), window=0.02)]
+
+        assert merged == ["ab", "c"]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("limits", [{"max_chars": 64}, {"window": 0.05, "max_chars": 64}])
+    async def test_error_is_never_merged(self, limits):
+        """Test that an error delta follows buffered text on its own"""
+        deltas = source(["partial answer ", "Error: upstream 500"])
+
+        merged = [delta async for delta in coalesce_deltas(deltas, **limits)]
+
+        assert merged == ["partial answer ", "Error: upstream 500"]
+
+    @pytest.mark.asyncio
+    async def test_window_close_closes_source(self):
+        """Test that closing the coalescer closes the source at once"""
+        closed = []
+
+        async def endless():
+            try:
+                while True:
+                    yield "a"
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.append(True)
+
+        merged = coalesce_deltas(endless(), window=0.02)
+        await anext(merged)
+        await merged.aclose()
+
+        assert closed == [True]
+
+
+class TestCancellableStreamingResponse:
+    """Test that a disconnected client stops the body generator"""
+
+    @staticmethod
+    def endless(closed: list):
+        async def body():
+            try:
+                while True:
+                    await asyncio.sleep(0.01)
+                    yield b"data: x\n\n"
+            finally:
+                closed.append(True)
+
+        return body()
+
+    @staticmethod
+    async def disconnect_after(delay: float):
+        await asyncio.sleep(delay)
+        return {"type": "http.disconnect"}
+
+    @pytest.mark.asyncio
+    async def test_body_closed_on_disconnect(self):
+        closed = []
+        sent = []
+        response = CancellableStreamingResponse(self.endless(closed))
+
+        async def send(message):
+            sent.append(message)
+
+        await asyncio.wait_for(
+            response({"type": "http"}, lambda: self.disconnect_after(0.05), send), timeout=1
+        )
+
+        assert closed == [True]
+        assert len(sent) > 1
+
+    @pytest.mark.asyncio
+    async def test_body_closed_while_send_blocks(self):
+        """Test that a generator suspended between chunks is closed too"""
+        closed = []
+        blocked = asyncio.Event()
+        response = CancellableStreamingResponse(self.endless(closed))
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                blocked.set()
+                await asyncio.Event().wait()  # Client stopped reading
+
+        await asyncio.wait_for(
+            response({"type": "http"}, lambda: self.disconnect_after(0.05), send), timeout=1
+        )
+
+        assert blocked.is_set()
+        assert closed == [True]
+
+    @pytest.mark.asyncio
+    async def test_finished_stream_runs_background(self):
+        """Test that a stream ending normally does not wait for a disconnect"""
+        done = []
+
+        async def body():
+            yield DONE_EVENT
+
+        async def never():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            pass
+
+        response = CancellableStreamingResponse(body(), background=BackgroundTask(done.append, 1))
+        await asyncio.wait_for(response({"type": "http"}, never, send), timeout=1)
+
+        assert done == [1]
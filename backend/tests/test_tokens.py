@@ -0,0 +1,68 @@
+"""Unit tests for token accounting and estimation"""
+
+from pydantic_ai.usage import RunUsage
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+
+from src.services.tokens import MESSAGE_OVERHEAD_TOKENS, TokenEstimator, TokenUsage
+
+
+class TestTokenUsage:
+    """Test the OpenAI usage object"""
+
+    def test_update_from_run_usage(self):
+        """Test copying the counts reported by Pydantic AI"""
+        usage = TokenUsage()
+
+        usage.update(RunUsage(input_tokens=20, output_tokens=7))
+
+        assert usage.as_dict() == {"prompt_tokens": 20, "completion_tokens": 7, "total_tokens": 27}
+
+    def test_cached_prompt_tokens(self):
+        """Test that prefix cache hits reported by the provider are kept"""
+        usage = TokenUsage()
+
+        usage.update(RunUsage(input_tokens=900, cache_read_tokens=800, output_tokens=7))
+
+        assert usage.as_dict()["prompt_tokens_details"] == {"cached_tokens": 800}
+        assert TokenUsage.from_dict(usage.as_dict()) == usage
+
+    def test_dict_round_trip(self):
+        """Test that cached usage is restored"""
+        usage = TokenUsage(prompt_tokens=3, completion_tokens=9)
+
+        assert TokenUsage.from_dict(usage.as_dict()) == usage
+
+
+class TestTokenEstimator:
+    """Test local token counts"""
+
+    def test_heuristic_without_tokenizer(self):
+        """Test the characters-per-token fallback"""
+        estimator = TokenEstimator()
+
+        assert estimator.count("") == 0
+        assert estimator.count("abcdefghi") == 3
+
+    def test_count_with_tokenizer(self):
+        """Test exact counts with a tokenizer"""
+        tokenizer = Tokenizer(WordLevel({"hello": 0, "world": 1, "[UNK]": 2}, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = Whitespace()
+        estimator = TokenEstimator(tokenizer)
+
+        assert estimator.count("hello world again") == 3
+
+    def test_count_messages_includes_system_prompt(self):
+        """Test the prompt estimate of a chat request"""
+        estimator = TokenEstimator()
+        messages = [{"role": "user", "content": "abcd"}, {"role": "user", "content": "abcdefgh"}]
+
+        assert estimator.count_messages(messages) == 3 + 2 * MESSAGE_OVERHEAD_TOKENS
+        assert estimator.count_messages(messages, "abcd") == 4 + 3 * MESSAGE_OVERHEAD_TOKENS
+
+    def test_load_falls_back_to_heuristic(self, tmp_path):
+        """Test that a missing tokenizer file does not prevent startup"""
+        estimator = TokenEstimator.load(str(tmp_path / "missing.json"))
+
+        assert estimator.tokenizer is None
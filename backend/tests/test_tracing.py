@@ -0,0 +1,139 @@
+"""Unit tests for request tracing"""
+
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+from src.core import tracing
+from src.core.tracing import (
+    FileSpanExporter,
+    StreamSpan,
+    TracingMiddleware,
+    create_tracer_provider,
+    mark_parsed,
+)
+
+EXPORTER = InMemorySpanExporter()
+PROVIDER = TracerProvider()
+PROVIDER.add_span_processor(SimpleSpanProcessor(EXPORTER))
+# The global provider can only be set once per process
+trace.set_tracer_provider(PROVIDER)
+
+
+@pytest.fixture
+def spans():
+    EXPORTER.clear()
+    yield EXPORTER.get_finished_spans
+    EXPORTER.clear()
+
+
+class TestStreamSpan:
+    """Test the span of a streamed completion"""
+
+    def test_token_events(self, spans):
+        span = StreamSpan("chat.stream", {"gen_ai.request.model": "mistral-large"})
+        for content in ("Bon", "jour", " !"):
+            span.token(content)
+        span.finish("completed", prompt_tokens=5, completion_tokens=3)
+
+        (finished,) = spans()
+        assert [event.name for event in finished.events] == ["first_token", "token", "token"]
+        assert finished.attributes["stream.outcome"] == "completed"
+        assert finished.attributes["stream.chunks"] == 3
+        assert finished.attributes["gen_ai.usage.output_tokens"] == 3
+
+    def test_token_events_capped(self, spans, monkeypatch):
+        monkeypatch.setattr(tracing, "TRACING_MAX_TOKEN_EVENTS", 2)
+        span = StreamSpan("chat.stream", {})
+        for _ in range(5):
+            span.token("x")
+        span.finish("cancelled")
+
+        (finished,) = spans()
+        assert len(finished.events) == 2
+        assert finished.attributes["stream.chunks"] == 5
+
+    def test_error_status(self, spans):
+        StreamSpan("chat.stream", {}).finish("error")
+
+        (finished,) = spans()
+        assert finished.status.status_code == trace.StatusCode.ERROR
+
+
+class TestSampling:
+    """Test head sampling"""
+
+    def test_rate_zero_records_nothing(self):
+        exporter = InMemorySpanExporter()
+        provider = create_tracer_provider(exporter, sample_rate=0.0)
+
+        with provider.get_tracer("test").start_as_current_span("root") as span:
+            assert not span.is_recording()
+        provider.shutdown()
+
+        assert exporter.get_finished_spans() == ()
+
+    def test_children_follow_root(self):
+        sampler = create_tracer_provider(InMemorySpanExporter(), sample_rate=1.0).sampler
+
+        assert isinstance(sampler, ParentBased)
+        assert isinstance(sampler._root, TraceIdRatioBased)
+
+
+class TestFileSpanExporter:
+    """Test the JSON lines exporter"""
+
+    def test_one_span_per_line(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        provider = create_tracer_provider(FileSpanExporter(str(path)), sample_rate=1.0)
+        tracer = provider.get_tracer("test")
+        with tracer.start_as_current_span("parent"):
+            with tracer.start_as_current_span("child"):
+                pass
+        provider.shutdown()
+
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [line["name"] for line in lines] == ["child", "parent"]
+        assert lines[0]["parent_id"] == lines[1]["context"]["span_id"]
+
+
+class TestTracingMiddleware:
+    """Test the server span"""
+
+    @pytest.fixture
+    def client(self):
+        app = FastAPI()
+
+        @app.get("/items/{item_id}")
+        async def item(item_id: int):
+            mark_parsed()
+            with tracing.tracer.start_as_current_span("lookup"):
+                return {"id": item_id}
+
+        app.add_middleware(TracingMiddleware)
+        return TestClient(app)
+
+    def test_span_named_after_route(self, client, spans):
+        assert client.get("/items/42").status_code == 200
+
+        lookup, server = spans()
+        assert server.name == "GET /items/{item_id}"
+        assert server.kind == trace.SpanKind.SERVER
+        assert server.attributes["http.response.status_code"] == 200
+        assert [event.name for event in server.events] == ["request parsed"]
+        assert lookup.parent.span_id == server.context.span_id
+
+    def test_continues_caller_trace(self, client, spans):
+        trace_id = "0af7651916cd43dd8448eb211c80319c"
+        client.get("/items/1", headers={"traceparent": f"00-{trace_id}-b7ad6b7169203331-01"})
+
+        server = spans()[-1]
+        assert format(server.context.trace_id, "032x") == trace_id
+        assert format(server.parent.span_id, "016x") == "b7ad6b7169203331"